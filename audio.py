@@ -1,77 +1,49 @@
+import time
 import sounddevice as sd
 import numpy as np
-from globdata import glob_data
+from globdata import glob_data, max_effects
+import synth
+import recorder
 from tkinter import filedialog
-import wave
 
 # This module handles audio processing and playback using the sounddevice library.
 
 # Audio Processing
 stream = None # Global variable for audio stream
-with glob_data.lock:
-    glob_data.recording = False  # Tracks if recording is enabled
 
-def sine_wave(frequency, amplitude, previous_amplitude, phase, num_samples):
-    t = np.arange(num_samples) / 48000
-    amp_ramp = np.linspace(previous_amplitude, amplitude, num_samples)  # gradual transition to new amplitude
-    return amp_ramp * np.sin(2 * np.pi * frequency * t + phase)
-
-
-def start_audio_stream(app, device_id, buffer_size):
+def start_audio_stream(device_id, buffer_size, num_channels=2):
     global stream  # Ensure stream is treated as a global variable
-    def audio_callback(outdata, frames, time_info, status):
-        outdata.fill(0)
-
-        channel_1_mix = np.zeros(frames)  # Mix variable for left channel
-        channel_2_mix = np.zeros(frames)  # Mix variable for right channel
-        
-        # For each effect in audio
-        with glob_data.lock: # Make a thread safe copy for audio processing
-            audio_copy = glob_data.audio.copy()
-
-        for effect_name, effect_params in audio_copy.items():
-            # Get parameters from audio variable
-            amplitude = effect_params.get('amplitude', 0)
-            prev_amplitude = effect_params.get('prev_amplitude', 0)
-            phase = effect_params.get('phase', 0)
-
-            # Get effect parameters from the GUI
-            app_effect = app.effects.get(effect_name)
-            frequency = float(app_effect.frequency_entry.get())
-            channel = app_effect.channel_dropdown.get()
-            try:
-                N = app_effect.transition_samples_entry.get() or frames  # default is buffer size, could add to GUI later
-            except AttributeError:
-                N = frames
-            
-            wave_gen = sine_wave(frequency, amplitude, prev_amplitude, phase, frames)
-            with glob_data.lock:
-                glob_data.audio[effect_name]['phase'] = glob_data.audio[effect_name].get('phase', 0) + (2 * np.pi * frequency * frames) / 48000
-                glob_data.audio[effect_name]['prev_amplitude'] = amplitude  # save amplitude to use as previous amplitude next time
-
-            # Add the data to the appropriate mix variable
-            if channel == "channel_1":
-                channel_1_mix += wave_gen
-            elif channel == "channel_2":
-                channel_2_mix += wave_gen
-            
-        # Protect against clipping
-        channel_1_mix = np.clip(channel_1_mix, -1.0, 1.0)
-        channel_2_mix = np.clip(channel_2_mix, -1.0, 1.0)
-        
-        # Play the data
-        outdata[:, 0] = channel_1_mix  # Left channel
-        outdata[:, 1] = channel_2_mix  # Right channel
-
-        if glob_data.recording:
-            with glob_data.lock:
-                glob_data.recorded_frames.append(outdata.copy())  # Record the output data
+    engine = synth.SynthEngine(buffer_size, num_channels=num_channels, max_effects=max_effects)
+    amplitudes = np.zeros(max_effects)  # Amplitudes of the current buffer, read without locking from glob_data.params
 
+    def audio_callback(outdata, frames, time_info, status):
+        started = time.perf_counter()
+        config = glob_data.params.read(amplitudes)  # Lock free, the processing thread is never waited on
+        if config is not None:  # None if the processing thread kept publishing while reading, keep the previous amplitudes
+            engine.apply(config)  # Only array copies when the audio settings were edited, nothing otherwise
+        np.copyto(engine.amplitude, amplitudes)
+        pulse = glob_data.pulses.pop()
+        while pulse is not None:  # Trigger pulses start at the first sample of this buffer
+            engine.trigger(*pulse)
+            pulse = glob_data.pulses.pop()
+
+        engine.render(outdata, frames)  # Run the oscillators, mix and clip every effect straight into the output buffer
+
+        active_recorder = glob_data.recorder
+        if active_recorder is not None:
+            active_recorder.push(outdata)  # Copied into the recorder's ring, its writer thread streams it to disk
+
+        latency = glob_data.latency
+        if latency is not None:
+            params = glob_data.params
+            latency.record_callback(started, frames, synth.samplerate, time_info, status, params.read_sequence, params.read_published)
+
+    glob_data.pulses.clear()  # Pulses queued while no stream was running are stale
     # Setup the audio stream
     stream = sd.OutputStream(
-        samplerate=48000,
+        samplerate=synth.samplerate,
         blocksize=buffer_size,  # Use the selected buffer size
-        channels=2,  # Change to 2 channels
+        channels=num_channels,  # Every output of the device, the effects are routed to them with the engine's gain matrix
         dtype='float32',
         device=device_id,
         callback=audio_callback,
@@ -95,17 +67,19 @@ def get_audio_devices_formatted(devices=None):
     }
     return output_devices
 
-def save_recording():
+# Ask for a file and start streaming the output to it. Returns False if no file was chosen
+def start_recording():
     filename = filedialog.asksaveasfilename(defaultextension=".wav", filetypes=[("WAV files", "*.wav")])
-    if filename:
-        recorded_data = np.concatenate(glob_data.recorded_frames, axis=0) # Convert recorded frames to numpy array
-        recorded_data = (recorded_data * 32767).astype(np.int16) # Normalize and convert to 16-bit PCM
-
-        with wave.open(filename, 'wb') as wf: # Save as WAV file
-            wf.setnchannels(2)  # Stereo
-            wf.setsampwidth(2)  # 16-bit samples
-            wf.setframerate(48000)  # Sample rate
-            wf.writeframes(recorded_data.tobytes())
-        
-        print(f"Recording saved to {filename}")
-
+    if not filename:
+        return False
+    num_channels = stream.channels if stream is not None else 2
+    glob_data.recorder = recorder.StreamRecorder(filename, num_channels, synth.samplerate)
+    print(f"Recording to {filename}")
+    return True
+
+
+def stop_recording():
+    active_recorder = glob_data.recorder
+    glob_data.recorder = None
+    if active_recorder is not None:
+        active_recorder.stop()  # Returns straight away, the file is finished in the background
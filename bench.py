@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+import numpy as np
+import game_files
+import history
+import packets
+import plotting
+import processing
+import synth
+from globdata import glob_data, max_effects
+
+# Benchmarks of the realtime paths, run without the GUI or an audio device:
+#   decode/*     decoding each packet of the game file by packet_id, with struct and the NumPy dtype
+#   effects/*    update_effects() with 1, 10 and 50 effects
+#   synth/*      the audio callback's work (reading the amplitudes and rendering) per buffer size and effect count
+#   plot/*       writing the telemetry history, and redrawing an effect plot from it on a canvas that only counts the calls
+# Each benchmark reports the time per call and the memory allocated per call (peak, from tracemalloc). The synth/*
+# benchmarks run on the audio thread and must not allocate at all, the run fails if one does.
+# Results can be saved as a baseline and later runs compared against it:
+#
+#   python bench.py --save baseline.json
+#   python bench.py --compare baseline.json
+#   python bench.py --filter synth/
+
+settings_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example_settings", "F1_23_example1.json")
+buffer_sizes = [32, 64, 128, 256, 512, 1024]
+synth_effect_counts = [1, 8, 16, 32, 64]
+update_effect_counts = [1, 10, 50]
+min_time = 0.1  # Seconds each timing repeat runs for at least
+repeats = 5  # Timing repeats, the fastest is reported
+regression_threshold = 1.25  # A benchmark this much slower than the baseline counts as a regression
+no_alloc_prefixes = ("synth/",)  # Benchmarks that have to allocate 0 bytes per call
+
+
+# Time per call in seconds, the fastest of several repeats
+def time_per_call(function):
+    calls = 1
+    while True:  # Find a call count that takes at least min_time
+        begin = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - begin
+        if elapsed >= min_time:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for _ in range(repeats - 1):
+        begin = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = min(best, (time.perf_counter() - begin) / calls)
+    return best
+
+
+# Peak memory allocated during one call, after a warm up call so one-off setup isn't counted
+def allocations_per_call(function):
+    function()
+    tracemalloc.start()
+    try:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        return tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+
+# A packet filled with plausible values: the right packetId, the player as car 0 and random values elsewhere
+def fake_packet(packet, rng):
+    values = []
+    for (offset, code), name in zip(packets.format_items(packet['format']), packet['fields']):
+        if name == 'packetId':
+            values.append(packet['id'])
+        elif name == 'playerCarIndex':
+            values.append(0)
+        elif code[1] in 'efd':
+            values.append(float(rng.uniform(-1000, 1000)))
+        elif code[1] == 'c':
+            values.append(b'a')
+        elif code[1] == '?':
+            values.append(True)
+        else:
+            values.append(int(rng.integers(0, 8)))
+    return struct.pack(packet['format'], *values)
+
+
+def decode_benchmarks(game_index, datagrams):
+    benchmarks = {}
+    for packet_id, packet in game_index["packets"].items():
+        data = datagrams[packet_id]
+        dtype = game_index["dtypes"][packet_id]
+        unpack_from = struct.Struct(packet['format']).unpack_from
+        benchmarks[f"decode/{packet_id}/struct"] = lambda unpack_from=unpack_from, data=data: unpack_from(data)
+        benchmarks[f"decode/{packet_id}/numpy"] = lambda dtype=dtype, data=data: packets.packet_view(dtype, data)
+    return benchmarks
+
+
+# Compile count effects by repeating the effects of the example settings under new names
+def build_specs(settings, game_index, count):
+    effects = list(settings["effects"].values())
+    return tuple(processing.compile_effect(f"effect{i}", effects[i % len(effects)], game_index) for i in range(count))
+
+
+def effects_benchmarks(settings, game_index, telemetry):
+    benchmarks = {}
+    for count in update_effect_counts:
+        specs = build_specs(settings, game_index, count)
+
+        def run(specs=specs):
+            glob_data.effect_specs = specs
+            glob_data.telemetry = telemetry
+            processing.update_effects(glob_data, {}, time.monotonic())
+        benchmarks[f"effects/update/{count}"] = run
+    return benchmarks
+
+
+def synth_benchmarks(settings, game_index):
+    benchmarks = {}
+    for count in synth_effect_counts:
+        specs = build_specs(settings, game_index, count)
+        params = type(glob_data.params)()
+        params.begin(specs)
+        for slot in range(count):
+            params.write(slot, 0.5)
+        params.publish()
+        for frames in buffer_sizes:
+            engine = synth.SynthEngine(frames, num_channels=2, max_effects=max_effects)
+            amplitudes = np.zeros(max_effects)
+            outdata = np.zeros((frames, 2), dtype=np.float32)
+
+            def run(engine=engine, params=params, amplitudes=amplitudes, outdata=outdata, frames=frames):  # What the audio callback does
+                config = params.read(amplitudes)
+                if config is not None:
+                    engine.apply(config)
+                np.copyto(engine.amplitude, amplitudes)
+                engine.render(outdata, frames)
+            benchmarks[f"synth/{frames}/{count}"] = run
+
+        # Loading the config of an edit that changed every frequency, in the callback after the edit
+        engine = synth.SynthEngine(buffer_sizes[0], num_channels=2, max_effects=max_effects)
+        before = synth.SynthConfig(specs, max_effects)
+        after = synth.SynthConfig(tuple(spec._replace(frequency=spec.frequency + 1) for spec in specs), max_effects, before)
+
+        def apply(engine=engine, before=before, after=after):
+            engine.config = before
+            engine.slots = before.slots
+            engine.apply(after)
+        benchmarks[f"synth/apply/{count}"] = apply
+    return benchmarks
+
+
+# Stand-in for a Tk canvas that only counts the drawing calls
+class FakeCanvas:
+    def __init__(self, width=600, height=150):
+        self.width = width
+        self.height = height
+        self.items = 0
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def find_all(self):
+        return range(self.items)
+
+    def delete(self, *args):
+        self.items = 0
+
+    def create_line(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    def create_text(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    def coords(self, *args):
+        pass
+
+    def itemconfigure(self, *args, **kwargs):
+        pass
+
+
+def plot_benchmarks():
+    rng = np.random.default_rng(0)
+    field_history = history.FieldHistory()
+    for index, value in enumerate(rng.uniform(0, 100, history.history_size * 3)):  # Wrapped, so snapshots have to reorder
+        field_history.append(index, index / 60, value)
+    line_plot = plotting.LinePlot(FakeCanvas())
+
+    def draw(count):
+        _, _, values, _ = field_history.snapshot(count)
+        line_plot.draw(values, 0.0, 100.0)
+    return {
+        "plot/history_append": lambda: field_history.append(field_history.tiers[0].write_index, 0.0, 1.0),
+        f"plot/draw/{plotting.plot_points}": lambda: draw(plotting.plot_points),
+        f"plot/draw/{history.history_size}": lambda: draw(history.history_size),
+    }
+
+
+def run_benchmarks(name_filter=""):
+    game_index = game_files.game_index('f1_23')
+    with open(settings_file) as file:
+        settings = json.load(file)
+    rng = np.random.default_rng(0)
+    datagrams = {packet_id: bytearray(fake_packet(packet, rng)) for packet_id, packet in game_index["packets"].items()}
+    telemetry = {(processing.primary_source, packet_id): data for packet_id, data in datagrams.items()}
+
+    benchmarks = {}
+    benchmarks.update(decode_benchmarks(game_index, datagrams))
+    benchmarks.update(effects_benchmarks(settings, game_index, telemetry))
+    benchmarks.update(synth_benchmarks(settings, game_index))
+    benchmarks.update(plot_benchmarks())
+
+    results = {}
+    for name, function in benchmarks.items():
+        if name_filter not in name:
+            continue
+        results[name] = {"time_us": time_per_call(function) * 1e6, "alloc_bytes": allocations_per_call(function)}
+        print(f"{name:40} {results[name]['time_us']:10.2f} us {results[name]['alloc_bytes']:10d} B")
+    return results
+
+
+# Print how each benchmark compares with the baseline. Returns the names of the benchmarks that got slower
+def compare(results, baseline):
+    regressions = []
+    print(f"\n{'benchmark':40} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["time_us"] / max(baseline[name]["time_us"], 1e-9)
+        flag = ""
+        if ratio > regression_threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        if result["alloc_bytes"] > baseline[name]["alloc_bytes"]:
+            flag += f"  allocates {result['alloc_bytes'] - baseline[name]['alloc_bytes']} B more"
+        print(f"{name:40} {baseline[name]['time_us']:10.2f} {result['time_us']:10.2f} {ratio:7.2f}{flag}")
+    return regressions
+
+
+# Names of the benchmarks that must not allocate but did
+def check_allocations(results):
+    failed = [name for name, result in results.items() if name.startswith(no_alloc_prefixes) and result["alloc_bytes"] != 0]
+    for name in failed:
+        print(f"{name} allocates {results[name]['alloc_bytes']} B per call, it runs on the audio thread and must allocate nothing")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ShakeLab realtime paths")
+    parser.add_argument("--filter", default="", help="only run benchmarks with this in their name")
+    parser.add_argument("--save", help="save the results as a baseline JSON file")
+    parser.add_argument("--compare", help="compare with a baseline JSON file, exits with 1 if anything got slower")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.filter)
+    failed = check_allocations(results)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f"Saved the results to {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline)
+        if regressions:
+            print(f"{len(regressions)} benchmarks are more than {regression_threshold:.2f}x slower than the baseline")
+            sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
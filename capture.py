@@ -0,0 +1,187 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+import game_files
+import packets
+
+# This module records the raw UDP telemetry to a capture file and reads it back, so effects can be tuned and profiled
+# without the game running.
+#
+# Capture file: a file header followed by one record per datagram, each record is a record header (time since the start
+# of the capture in nanoseconds, payload length) followed by the raw datagram.
+# Index file (capture path + '.idx'): one fixed size entry per record (time, file offset of the payload, packet_id,
+# length), so a reader can memory-map it and binary search by time without scanning the capture
+
+file_header = struct.Struct('<8sHHd32s')  # magic, version, udp port, start time (unix seconds), game file name
+record_header = struct.Struct('<QH')  # time since the start of the capture in ns, payload length
+magic = b'SLCAPTUR'
+version = 1
+index_dtype = np.dtype([('time', '<u8'), ('offset', '<u8'), ('packet_id', '<u2'), ('length', '<u2')])
+unknown_packet_id = 0xFFFF  # Used in the index for datagrams too short to have a packet_id
+
+max_pending = 4096  # Datagrams waiting for the writer thread, after that new datagrams are dropped
+writer_interval = 0.01  # How often the writer thread checks for new datagrams, in seconds
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class CaptureWriter:
+    def __init__(self, path, game_file="", udp_port=0):
+        self.path = path
+        self.start_ns = time.monotonic_ns()
+        self.pending = deque()  # (time, packet_id, datagram) waiting to be written, deque appends/pops are thread safe
+        self.dropped = 0  # Datagrams lost because the writer thread fell behind
+        self.count = 0  # Datagrams written
+        self.stopping = False
+
+        self.file = open(path, 'wb')
+        self.file.write(file_header.pack(magic, version, udp_port, time.time(), game_file.encode()[:32]))
+        self.index_file = open(index_path(path), 'wb')
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    # Called from the receive loop with every datagram. Only copies the datagram, the writer thread does the file I/O
+    def write(self, packet_id, data):
+        if self.stopping or len(self.pending) >= max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((time.monotonic_ns() - self.start_ns, packet_id, bytes(data)))
+
+    # Stop capturing. Returns straight away, the writer thread writes out what is left and closes the files
+    def stop(self):
+        self.stopping = True
+
+    def writer(self):
+        offset = self.file.tell()
+        entry = np.zeros(1, dtype=index_dtype)
+        while True:
+            stopping = self.stopping  # Read before checking for datagrams, so nothing written before the stop is missed
+            if not self.pending:
+                if stopping:
+                    break
+                time.sleep(writer_interval)
+                continue
+            timestamp, packet_id, data = self.pending.popleft()
+            self.file.write(record_header.pack(timestamp, len(data)))
+            self.file.write(data)
+            offset += record_header.size
+            entry[0] = (timestamp, offset, packet_id, len(data))
+            self.index_file.write(entry.tobytes())
+            offset += len(data)
+            self.count += 1
+        self.file.close()
+        self.index_file.close()
+        if self.dropped:
+            print(f"Capture dropped {self.dropped} datagrams")
+        print(f"Captured {self.count} datagrams to {self.path}")
+
+
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_magic, header_version, self.udp_port, self.start_time, game_file = file_header.unpack_from(self.buffer)
+        if header_magic != magic or header_version != version:
+            raise ValueError(f"{path} is not a version {version} capture file")
+        self.game_file = game_file.rstrip(b'\0').decode()
+        self.index = self.load_index()
+
+    # Memory-map the index file, rebuilding it from the capture if it is missing or doesn't match the capture
+    def load_index(self):
+        path = index_path(self.path)
+        if os.path.exists(path) and os.path.getsize(path) % index_dtype.itemsize == 0 and os.path.getsize(path) > 0:
+            index = np.memmap(path, dtype=index_dtype, mode='r')
+            if self.covers_capture(index):
+                return index
+        index = self.scan()
+        index.tofile(path)
+        return index
+
+    # Whether an index ends with the last complete record of the capture: the capture either ends right after it or
+    # only has a record that was cut short after it, like scan() would find. Otherwise records were added after the
+    # index was written, or it belongs to another capture
+    def covers_capture(self, index):
+        last = index[-1]
+        end = int(last['offset']) + int(last['length'])
+        if int(last['offset']) < file_header.size + record_header.size or end > len(self.buffer):
+            return False
+        if record_header.unpack_from(self.buffer, int(last['offset']) - record_header.size)[1] != int(last['length']):
+            return False
+        if end + record_header.size > len(self.buffer):
+            return True
+        _, length = record_header.unpack_from(self.buffer, end)
+        return end + record_header.size + length > len(self.buffer)
+
+    # Build the index by walking through every record of the capture. The packet_ids are read using the header layout
+    # of the game file the capture was made with
+    def scan(self):
+        packet_id_location = None
+        if self.game_file:
+            packet_id_location = game_files.game_index(self.game_file)["packet_id"]
+        entries = []
+        offset = file_header.size
+        while offset + record_header.size <= len(self.buffer):
+            timestamp, length = record_header.unpack_from(self.buffer, offset)
+            offset += record_header.size
+            if offset + length > len(self.buffer):
+                break  # Record cut short, e.g. the capture wasn't stopped cleanly
+            packet_id = unknown_packet_id
+            if packet_id_location is not None and length >= packet_id_location.offset + struct.calcsize(packet_id_location.code):
+                packet_id = struct.unpack_from(packet_id_location.code, self.buffer, offset + packet_id_location.offset)[0]
+            entries.append((timestamp, offset, packet_id, length))
+            offset += length
+        return np.array(entries, dtype=index_dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    # Length of the capture in seconds
+    def duration(self):
+        return float(self.index['time'][-1]) / 1e9 if len(self.index) else 0.0
+
+    # Number of the first record at or after a time in seconds, found with a binary search of the index
+    def seek(self, seconds):
+        return int(np.searchsorted(self.index['time'], int(seconds * 1e9), side='left'))
+
+    # Raw datagram of one record, without copying
+    def payload(self, record):
+        entry = self.index[record]
+        offset = int(entry['offset'])
+        return memoryview(self.buffer)[offset:offset + int(entry['length'])]
+
+    # Yield (time in seconds, packet_id, datagram) for each record from start up to stop
+    def records(self, start=0, stop=None):
+        stop = len(self.index) if stop is None else min(stop, len(self.index))
+        for record in range(start, stop):
+            entry = self.index[record]
+            yield float(entry['time']) / 1e9, int(entry['packet_id']), self.payload(record)
+
+    # Record numbers of every datagram of one packet_id, from record start up to stop
+    def records_of(self, packet_id, start=0, stop=None):
+        return start + np.flatnonzero(self.index['packet_id'][start:stop] == packet_id)
+
+    # Decode every datagram of one packet_id from record start up to stop at once with its NumPy dtype (see
+    # packets.packet_dtype). Returns the times in seconds and a structured array with one record per datagram
+    def decode(self, packet_id, dtype, start=0, stop=None):
+        records = self.records_of(packet_id, start, stop)
+        records = records[self.index['length'][records] >= dtype.itemsize]  # Skip datagrams that are too short
+        return self.index['time'][records] / 1e9, packets.decode_many(dtype, self.buffer, self.index['offset'][records])
+
+    def close(self):
+        self.index = None
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
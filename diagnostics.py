@@ -0,0 +1,96 @@
+import atexit
+import threading
+import time
+from collections import deque
+
+# Messages from the realtime threads (UDP processing, audio callback) go through here instead of print/logging, so a
+# slow console (Windows terminals can block for milliseconds) never holds up telemetry processing.
+# Posting a message only appends it to a bounded queue; the text is formatted and printed by a background thread.
+# Warnings are deduplicated: the same warning is shown at most once per repeat_interval, with a count of the repeats
+# that were held back
+
+max_pending = 1024  # Messages waiting to be printed, after that new messages are dropped and counted
+printer_interval = 0.05  # How often the printer thread checks for new messages, in seconds
+repeat_interval = 5.0  # Seconds before the same warning is shown again
+max_warning_keys = 256  # Warnings remembered for the deduplication, after that the ones not shown recently are forgotten
+
+
+class Diagnostics:
+    def __init__(self):
+        self.pending = deque()  # (level, message, args, repeats) waiting to be printed, deque appends/pops are thread safe
+        self.dropped = 0  # Messages lost because the queue was full
+        self.last_shown = {}  # (message, args) -> [time last shown, repeats held back since]
+        self.thread = None
+
+    def post(self, level, message, args, repeats=0):
+        if len(self.pending) >= max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((level, message, args, repeats))
+        if self.thread is None:  # Started on first use, so importing this module has no side effects
+            self.thread = threading.Thread(target=self.printer, daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)  # The printer is a daemon thread, print what it didn't get to on exit
+
+    # Message shown every time, for events that happen rarely like the game pausing.
+    # message is a %-format string, formatted with args on the printer thread
+    def info(self, message, *args):
+        self.post("INFO", message, args)
+
+    # Message shown once per repeat_interval for the same message and args
+    def warning(self, message, *args):
+        now = time.monotonic()
+        key = (message, args)
+        shown = self.last_shown.get(key)
+        if shown is not None and now - shown[0] < repeat_interval:
+            shown[1] += 1
+            return
+        if shown is None and len(self.last_shown) >= max_warning_keys:  # Warnings with changing args, like sizes
+            self.forget_warnings(now)
+        self.last_shown[key] = [now, 0]
+        self.post("WARNING", message, args, shown[1] if shown is not None else 0)
+
+    # Forget the warnings not shown within repeat_interval, their held back repeats are lost. If there are still too
+    # many, only the half shown most recently is kept. The dict is replaced as a whole, as several threads post warnings
+    def forget_warnings(self, now):
+        recent = [(key, shown) for key, shown in list(self.last_shown.items()) if now - shown[0] < repeat_interval]
+        recent.sort(key=lambda item: item[1][0])
+        self.last_shown = dict(recent[-(max_warning_keys // 2):])
+
+    def printer(self):
+        while True:
+            if not self.pending:
+                time.sleep(printer_interval)
+                continue
+            try:
+                message = self.pending.popleft()
+            except IndexError:
+                continue  # flush() took the last one
+            self.show(*message)
+
+    # Print everything still queued, on the calling thread
+    def flush(self):
+        while self.pending:
+            try:
+                self.show(*self.pending.popleft())
+            except IndexError:
+                break  # The printer thread took the last one
+
+    # Format and print one message
+    def show(self, level, message, args, repeats):
+        try:
+            text = message % args if args else message
+        except (TypeError, ValueError) as e:
+            text = f"{message} {args} (format error: {e})"
+        if repeats:
+            text += f" (repeated {repeats} times)"
+        if level != "INFO":
+            text = f"{level}: {text}"
+        print(text)
+        if self.dropped:
+            print(f"WARNING: {self.dropped} diagnostic messages dropped")
+            self.dropped = 0
+
+
+# Global instance, like glob_data
+diagnostics = Diagnostics()
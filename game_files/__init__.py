@@ -0,0 +1,77 @@
+import importlib
+import os
+from importlib import metadata
+import packets
+
+# Registry of the game adapters. A game adapter is a module that declares:
+#   udp_port          port the game sends its telemetry to
+#   PacketHeader      header definition with a packetId field, see packets.struct_schema()
+#   use_packets       the packets to read telemetry from, see packets.packet_schema()
+#   player_car_field  optional, header field with the index of the player car in packets with car_data
+#   expected_header   optional, {header field: value} every packet must have, e.g. the packet format of the game version
+#                     the definitions are for. Other packets are dropped and reported
+#   title             optional, name shown to the user
+# The framework compiles the definitions into field readers and NumPy dtypes (packets.build_game_index), so an adapter
+# never writes its own decoding code.
+# Games are found in the manifest below, as modules dropped into this folder, and in other installed packages that
+# register their module under the 'shakelab.games' entry point group. A game is only imported once it is loaded
+
+entry_point_group = "shakelab.games"
+
+# Games that ship with ShakeLab: name -> module
+manifest = {
+    "f1_23": "game_files.f1_23",
+}
+
+required_attributes = ["udp_port", "PacketHeader", "use_packets"]
+
+loaded_games = {}  # name -> imported adapter module
+game_indexes = {}  # name -> compiled lookup tables of the game
+
+
+# Every game that can be loaded: name -> module, without importing any of them
+def discover():
+    games = dict(manifest)
+    folder = os.path.dirname(__file__)
+    for file_name in os.listdir(folder):
+        name, extension = os.path.splitext(file_name)
+        if extension == '.py' and name != '__init__':
+            games.setdefault(name, f'game_files.{name}')
+    try:
+        entry_points = metadata.entry_points(group=entry_point_group)
+    except TypeError:  # Python before 3.10
+        entry_points = metadata.entry_points().get(entry_point_group, [])
+    for entry_point in entry_points:
+        games.setdefault(entry_point.name, entry_point.value)
+    return games
+
+
+def available_games():
+    return sorted(discover())
+
+
+# Import a game adapter and check it declares what the framework needs. Raises ValueError for an unknown or broken adapter
+def load_game(name):
+    if name in loaded_games:
+        return loaded_games[name]
+    games = discover()
+    if name not in games:
+        raise ValueError(f"Unknown game: {name}")
+    module = importlib.import_module(games[name])
+    missing = [attribute for attribute in required_attributes if not hasattr(module, attribute)]
+    if missing:
+        raise ValueError(f"Game adapter {name} is missing {', '.join(missing)}")
+    if "packetId" not in module.PacketHeader["fields"]:
+        raise ValueError(f"Game adapter {name} header has no packetId field")
+    unknown = [field for field in getattr(module, 'expected_header', {}) if field not in module.PacketHeader["fields"]]
+    if unknown:
+        raise ValueError(f"Game adapter {name} expected_header has fields that aren't in the header: {', '.join(unknown)}")
+    loaded_games[name] = module
+    return module
+
+
+# The compiled lookup tables of a game (see packets.build_game_index), built once per game
+def game_index(name):
+    if name not in game_indexes:
+        game_indexes[name] = packets.build_game_index(load_game(name))
+    return game_indexes[name]
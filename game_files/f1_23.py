@@ -1,86 +1,62 @@
 # This file is for storing data output formatting for F1 2023 game telemetry data
+from packets import struct_schema, field_group, packet_schema
 
 # telemetry setup
+title = "F1 23"
 udp_port = 20777  # udp telemetry port
-
-PacketHeader = {
-    "format": '<HBBBBBQfIIBB',
-    "size": 29,
-    "fields": [
-        "packetFormat", "gameYear", "gameMajorVersion", "gameMinorVersion", "packetVersion", "packetId",
-        "sessionUID", "sessionTime", "frameIdentifier", "overallFrameIdentifier", "playerCarIndex", "secondaryPlayerCarIndex" #12
-    ]
-}
-
-CarTelemetryData = {
-    "id": 6,
-    "format": '<HfffBbHBBH4H4B4BH4f4B',
-    "size": 60,
-    "fields": [
-        "speed", 
-        "throttle", 
-        "steer", 
-        "brake", 
-        "clutch", 
-        "gear", 
-        "engineRPM", 
-        "drs", 
-        "revLightsPercent", 
-        "revLightsBitValue", 
-        "brakesTemperatureRL", "brakesTemperatureRR", "brakesTemperatureFL", "brakesTemperatureFR",
-        "tyresSurfaceTemperatureRL", "tyresSurfaceTemperatureRR", "tyresSurfaceTemperatureFL", "tyresSurfaceTemperatureFR",
-        "tyresInnerTemperatureRL", "tyresInnerTemperatureRR", "tyresInnerTemperatureFL", "tyresInnerTemperatureFR",
-        "engineTemperature", 
-        "tyresPressureRL", "tyresPressureRR", "tyresPressureFL", "tyresPressureFR",
-        "surfaceTypeRL", "surfaceTypeRR", "surfaceTypeFL", "surfaceTypeFR"
-    ]
-}
-
-PacketCarTelemetryData = {
-    "id": 6,  # Assuming packet ID 6 based on F1 23 telemetry docs
-    "format": PacketHeader["format"] + ('HfffBbHBBH4H4B4BH4f4B' * 22) + 'BBb',
-    "size": PacketHeader["size"] + (22 * 60) + 3,  # Header size + (22 * size of CarTelemetryData) + 3 bytes for extra fields
-    "fields": PacketHeader["fields"] + CarTelemetryData["fields"] * 22 + ["mfdPanelIndex", "mfdPanelIndexSecondaryPlayer", "suggestedGear"],
-    "custom_processing": lambda telemetry_name, telemetry_data: ProcessPacketCarTelemetryData(telemetry_name, telemetry_data)
-}
-
-def ProcessPacketCarTelemetryData(telemetry_name, telemetry_data):
-    if telemetry_name in CarTelemetryData["fields"]: # if in car telemetry data, will need to multiply by playerCarIndex to get our car - thats what this custom processing is for
-        telemetry_index = CarTelemetryData["fields"].index(telemetry_name)
-        player_car_index = telemetry_data[PacketHeader["fields"].index("playerCarIndex")]
-        if player_car_index > 21: #this condition will results in out of range error I think, just printing in case this happens we can track it down
-            print("player car index is ", player_car_index)
-        value = telemetry_data[len(PacketHeader["fields"]) + (player_car_index * len(CarTelemetryData["fields"])) + telemetry_index] # header + account for which car place we're in + index of telemetry data
-        return value
-    else:
-        #if we're here we are in the lst 3 fields of the packet, just return the value at its index
-        return telemetry_data[PacketCarTelemetryData["fields"].index(telemetry_name)]
-
-PacketMotionExData = {
-    "id": 13,
-    "format": PacketHeader["format"] + '4f4f4f4f4f4f4ffffffffffff4f',
-    "size": 188,
-    "fields": PacketHeader["fields"] + [
-        "suspensionPositionRL", "suspensionPositionRR", "suspensionPositionFL", "suspensionPositionFR",
-        "suspensionVelocityRL", "suspensionVelocityRR", "suspensionVelocityFL", "suspensionVelocityFR",
-        "suspensionAccelerationRL", "suspensionAccelerationRR", "suspensionAccelerationFL", "suspensionAccelerationFR",
-        "wheelSpeedRL", "wheelSpeedRR", "wheelSpeedFL", "wheelSpeedFR",
-        "wheelSlipRatioRL", "wheelSlipRatioRR", "wheelSlipRatioFL", "wheelSlipRatioFR",
-        "wheelSlipAngleRL", "wheelSlipAngleRR", "wheelSlipAngleFL", "wheelSlipAngleFR",
-        "wheelLatForceRL", "wheelLatForceRR", "wheelLatForceFL", "wheelLatForceFR",
-        "wheelLongForceRL", "wheelLongForceRR", "wheelLongForceFL", "wheelLongForceFR",
-        "heightOfCOGAboveGround", 
-        "localVelocityX", "localVelocityY", "localVelocityZ",
-        "angularVelocityX", "angularVelocityY", "angularVelocityZ",
-        "angularAccelerationX", "angularAccelerationY", "angularAccelerationZ",
-        "frontWheelsAngle", 
-        "wheelVertForceRL", "wheelVertForceRR", "wheelVertForceFL", "wheelVertForceFR"
-    ],
-}
+player_car_field = "playerCarIndex"  # Header field used to pick our car from packets with car_data
+expected_header = {"packetFormat": 2023, "gameYear": 23}  # Packets from other game versions have different layouts
+
+wheels = ["RL", "RR", "FL", "FR"]  # Order of the per-wheel values in every packet
+
+PacketHeader = struct_schema([
+    ("packetFormat", "H"), ("gameYear", "B"), ("gameMajorVersion", "B"), ("gameMinorVersion", "B"),
+    ("packetVersion", "B"), ("packetId", "B"), ("sessionUID", "Q"), ("sessionTime", "f"),
+    ("frameIdentifier", "I"), ("overallFrameIdentifier", "I"), ("playerCarIndex", "B"), ("secondaryPlayerCarIndex", "B")
+])
+
+CarTelemetryData = struct_schema([
+    ("speed", "H"),
+    ("throttle", "f"),
+    ("steer", "f"),
+    ("brake", "f"),
+    ("clutch", "B"),
+    ("gear", "b"),
+    ("engineRPM", "H"),
+    ("drs", "B"),
+    ("revLightsPercent", "B"),
+    ("revLightsBitValue", "H"),
+    *field_group("brakesTemperature", "H", wheels),
+    *field_group("tyresSurfaceTemperature", "B", wheels),
+    *field_group("tyresInnerTemperature", "B", wheels),
+    ("engineTemperature", "H"),
+    *field_group("tyresPressure", "f", wheels),
+    *field_group("surfaceType", "B", wheels)
+])
+CarTelemetryData["id"] = 6
+
+# One CarTelemetryData per car, the player car is picked using player_car_field from the header
+PacketCarTelemetryData = packet_schema(
+    6, PacketHeader, car_data=CarTelemetryData, num_cars=22,
+    trailer=[("mfdPanelIndex", "B"), ("mfdPanelIndexSecondaryPlayer", "B"), ("suggestedGear", "b")]
+)
+
+PacketMotionExData = packet_schema(13, PacketHeader, [
+    *field_group("suspensionPosition", "f", wheels),
+    *field_group("suspensionVelocity", "f", wheels),
+    *field_group("suspensionAcceleration", "f", wheels),
+    *field_group("wheelSpeed", "f", wheels),
+    *field_group("wheelSlipRatio", "f", wheels),
+    *field_group("wheelSlipAngle", "f", wheels),
+    *field_group("wheelLatForce", "f", wheels),
+    *field_group("wheelLongForce", "f", wheels),
+    ("heightOfCOGAboveGround", "f"),
+    ("localVelocityX", "f"), ("localVelocityY", "f"), ("localVelocityZ", "f"),
+    ("angularVelocityX", "f"), ("angularVelocityY", "f"), ("angularVelocityZ", "f"),
+    ("angularAccelerationX", "f"), ("angularAccelerationY", "f"), ("angularAccelerationZ", "f"),
+    ("frontWheelsAngle", "f"),
+    *field_group("wheelVertForce", "f", wheels)
+])
 
 #list of packets to read telemetry from
 use_packets = [PacketCarTelemetryData, PacketMotionExData]
-
-
-
-
@@ -1,16 +1,124 @@
 import threading
+import time
+import numpy as np
+from history import TelemetryHistory
+from synth import SynthConfig, synth_config
 
 # This is to store shared variables that need to be accesed by multiple files
 
+max_effects = 64  # Most effects that can play at once
+
+
+# Effect amplitudes passed from the processing thread (the only writer) to the audio callback (the reader) without a lock,
+# so the audio callback never waits on the processing thread.
+# The writer fills the back buffer and publishes it by swapping the front index. The sequence number goes up with every
+# publish, so the reader can tell if the writer swapped again while it was copying and simply copy again.
+# Each buffer also carries the synth config of its specs, built by the writer when the specs change, so the audio
+# callback only has to load arrays
+class ParameterBlock:
+    def __init__(self, size=max_effects):
+        self.amplitudes = np.zeros((2, size))  # Front and back buffer
+        self.buffers = list(self.amplitudes)  # Views of the two buffers, so the reader doesn't make a new view on every read
+        self.specs = [(), ()]  # The effect specs each buffer was written for, slot i belongs to specs[i]
+        self.configs = [SynthConfig((), size)] * 2  # The SynthConfig of each buffer's specs
+        self.published_at = [0.0, 0.0]  # time.perf_counter() each buffer was published at, for the latency measurements
+        self.front = 0
+        self.sequence = 0
+        self.read_buffer = np.zeros(size)  # Reader scratch, so a torn copy never reaches the caller
+        self.read_sequence = -1  # Sequence and publish time of the last successful read, only used by the reader
+        self.read_published = 0.0
+
+    # Writer: start a new set of amplitudes from the published values. If the specs were recompiled the values are
+    # moved to the new slots by effect name, and the synth config is rebuilt if their audio settings changed
+    def begin(self, specs):
+        back = 1 - self.front
+        if specs is self.specs[self.front]:
+            self.amplitudes[back] = self.amplitudes[self.front]
+            self.configs[back] = self.configs[self.front]
+        else:
+            self.configs[back] = synth_config(specs, len(self.read_buffer), self.configs[self.front])
+            previous_slots = {spec.name: slot for slot, spec in enumerate(self.specs[self.front])}
+            self.amplitudes[back] = 0
+            for slot, spec in enumerate(specs[:len(self.read_buffer)]):
+                if spec.name in previous_slots:
+                    self.amplitudes[back, slot] = self.amplitudes[self.front, previous_slots[spec.name]]
+        self.specs[back] = specs
+
+    # Writer: set the amplitude of one effect slot in the back buffer
+    def write(self, slot, amplitude):
+        if slot < len(self.read_buffer):
+            self.amplitudes[1 - self.front, slot] = amplitude
+
+    # Writer: make the back buffer visible to the reader
+    def publish(self):
+        self.published_at[1 - self.front] = time.perf_counter()
+        self.front = 1 - self.front
+        self.sequence += 1
+
+    # Reader: copy the latest amplitudes into out and return the SynthConfig they belong to. Never blocks, if the writer
+    # keeps publishing during the copy the previous values in out are kept and None is returned
+    def read(self, out):
+        attempts = 3  # A while loop, a for loop over range() allocates its iterator
+        while attempts:
+            attempts -= 1
+            sequence = self.sequence
+            front = self.front
+            config = self.configs[front]
+            published = self.published_at[front]
+            np.copyto(self.read_buffer, self.buffers[front])
+            if self.sequence == sequence:
+                np.copyto(out, self.read_buffer)
+                self.read_sequence = sequence
+                self.read_published = published
+                return config
+        return None
+
+
+# Trigger pulses passed from the processing thread (the only writer) to the audio callback (the only reader) without a
+# lock. A fixed ring of (effect name, amplitude) events with counters that only grow, each only changed by one side
+class PulseQueue:
+    def __init__(self, capacity=256):
+        self.events = [None] * capacity
+        self.write_index = 0
+        self.read_index = 0
+        self.dropped = 0  # Pulses lost because the queue was full, e.g. no audio stream running
+
+    # Writer: queue a pulse
+    def push(self, name, amplitude):
+        if self.write_index - self.read_index >= len(self.events):
+            self.dropped += 1
+            return
+        self.events[self.write_index % len(self.events)] = (name, amplitude)
+        self.write_index += 1  # Published only after the event is stored
+
+    # Reader: the oldest queued pulse, None if there is none
+    def pop(self):
+        if self.read_index == self.write_index:
+            return None
+        event = self.events[self.read_index % len(self.events)]
+        self.read_index += 1
+        return event
+
+    # Reader: drop everything queued, e.g. pulses from before the audio stream started
+    def clear(self):
+        self.read_index = self.write_index
+
+
 # Shared state class
 class globdata:
     def __init__(self):
         self.game_info = {} # Used to store some game information after loading the game file
         self.telemetry = {}  # Dictionary to store telemetry fields and corresponding packet_id
-        self.audio = {} # Dictionary to store audio data between audio callbacks
+        self.effect_specs = ()  # Compiled effect settings, replaced as a whole by the GUI whenever an effect is edited
+        self.params = ParameterBlock()  # Effect amplitudes for the audio callback, written only by the processing thread
+        self.pulses = PulseQueue()  # Trigger pulses for the audio callback, written only by the processing thread
         self.channels = {}  # Variable to store channels
-        self.recorded_frames = []  # Variable to store recorded frames
+        self.recorder = None  # StreamRecorder while the output is being recorded
+        self.capture = None  # CaptureWriter while the raw telemetry is being captured
+        self.latency = None  # LatencyMonitor while latency is being measured
+        self.processing_stats = {"datagrams": 0, "drains": 0, "mismatched": 0}  # Counted by the processing thread, for measuring throughput
         self.plot_telemetry = {}  # Store telemetry data for plotting
+        self.history = TelemetryHistory()  # Recent values of the fields the effects use, written by the processing thread
         self.lock = threading.Lock()  # Add a threading lock
 
 # Global instance of ShakeVars
@@ -2,32 +2,33 @@ import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import tkinter as tk
 import json
-import os
 import audio
-import importlib
-import threading
-from collections import deque
-from globdata import glob_data
+from globdata import glob_data, max_effects
 import processing
+import capture
+import game_files
+import hub
+import latency
+import plotting
+import synth
 import numpy as np
+from diagnostics import diagnostics
 
 # This module handles the GUI for the application using customtkinter.
 
-udp_thread = None  # Initialize udp_thread
+telemetry_hub = None  # Receives the telemetry of every source and runs the effects, started with the first source
 
 telemetry_process_options = {
     "range_effect": ["max", "min", "average"],
     "trigger_effect": ["change"]
 }
 
-# Function to load telemetry options from a game file
-def load_telemetry_options(game_file):
-    field_packet_map = {}  # Dictionary to store field -> packet_id mapping
-    for packet in game_file.use_packets:
-        for field in packet['fields']:
-            if field not in field_packet_map: # If the field is not already in the dictionary, add it
-                field_packet_map[field] = packet['id']# Dictionary keys are field names and values are their corresponding packet_id
-                                       
+# Function to load telemetry options from a game file index, and the indexes of the other telemetry sources
+def load_telemetry_options(game_index, source_indexes=None):
+    field_packet_map = {field: location.packet_id for field, location in game_index["fields"].items()} if game_index else {}  # Dictionary keys are field names and values are their corresponding packet_id
+    for source_name, source_index in (source_indexes or {}).items():  # Fields of other sources are source:field
+        field_packet_map.update({f"{source_name}:{field}": location.packet_id for field, location in source_index["fields"].items()})
+
     with glob_data.lock:
         glob_data.game_info["telemetry_options"] = field_packet_map
     print(f"Game Telemetry Options: {list(glob_data.game_info.get('telemetry_options', {}).keys())}")
@@ -45,6 +46,10 @@ class BassShakerGUI(ctk.CTk):
         self.geometry("1100x700")
 
         self.effects = {}  # Store effect settings
+        self.game_index = None  # Lookup tables for the loaded game file, needed to compile the effects
+        self.sources = []  # Telemetry sources besides the game, see hub.TelemetrySource
+        self.source_indexes = {}  # Source name -> lookup tables of its game file
+        self.forward_targets = ()  # "host:port" targets the game telemetry is sent on to, for other programs using it
 
         # Top Menu
         top_frame = ctk.CTkFrame(self)
@@ -62,6 +67,9 @@ class BassShakerGUI(ctk.CTk):
         self.save_button = ctk.CTkButton(top_frame, text="Save Settings", command=self.save_settings)
         self.save_button.pack(side="left", padx=5)
 
+        self.sources_button = ctk.CTkButton(top_frame, text="Sources", command=self.edit_sources)
+        self.sources_button.pack(side="left", padx=5)
+
         # Effect List
         self.effect_list_frame = ctk.CTkScrollableFrame(self)
         self.effect_list_frame.pack(fill="both", expand=True, padx=10, pady=5)
@@ -97,25 +105,52 @@ class BassShakerGUI(ctk.CTk):
         self.record_button = ctk.CTkButton(self, text="Rec", fg_color="grey", width=50, height=30, command=self.toggle_recording)
         self.record_button.pack(side="left", padx=10, pady=10)
 
+        # Add telemetry capture button
+        self.capture_button = ctk.CTkButton(self, text="Capture", fg_color="grey", width=70, height=30, command=self.toggle_capture)
+        self.capture_button.pack(side="left", padx=10, pady=10)
+
         # Add start/stop plots button
         self.plotting = False
         self.plot_button = ctk.CTkButton(self, text="Start Plots", fg_color="grey", width=100, height=30, command=self.toggle_plots)
         self.plot_button.pack(side="left", padx=10, pady=10)
 
+        # Add latency measurement button and the label showing the results
+        self.latency_button = ctk.CTkButton(self, text="Latency", fg_color="grey", width=70, height=30, command=self.toggle_latency)
+        self.latency_button.pack(side="left", padx=10, pady=10)
+        self.latency_label = ctk.CTkLabel(self, text="", justify="left", font=("Courier", 11))
+        self.latency_label.pack(side="left", padx=5, pady=5)
+
     def add_effect(self, effect_data=None):
         effect_id = f"effect{len(self.effects) + 1}"
         effect_type = self.effect_type_var.get() if not effect_data else effect_data.get("effect_type", "range_effect")
-        effect = EffectFrame(self.effect_list_frame, effect_id, self.remove_effect, effect_type)
+        effect = EffectFrame(self.effect_list_frame, effect_id, self.remove_effect, effect_type, change_callback=lambda effect: self.publish_effects([effect]))
         effect.pack(fill="x", pady=5)
         self.effects[effect_id] = effect
 
         if effect_data:  # Load existing settings
             effect.load_data(effect_data)
+        self.publish_effects([effect])
 
     def remove_effect(self, effect_id):
         if effect_id in self.effects:
             self.effects[effect_id].destroy()
             del self.effects[effect_id]
+        self.publish_effects(())
+
+    # Compile effects and hand the specs of all effects to the processing thread, so the processing thread never has to
+    # read the widgets itself. Called whenever an effect setting is edited with just that effect, the others keep the
+    # spec they were compiled to. Without a list (new game file or sources) every effect is recompiled
+    def publish_effects(self, edited=None):
+        specs = []
+        if self.game_index is not None:
+            for effect in (self.effects.values() if edited is None else edited):
+                effect.spec = effect.compile(self.game_index, self.source_indexes)  # Kept for the plot and the next publish
+            specs = [effect.spec for effect in self.effects.values() if effect.spec is not None]
+        if len(specs) > max_effects:
+            print(f"Only the first {max_effects} effects will play")
+        glob_data.history.ensure(field_name for spec in specs for field_name in spec.fields)  # Before the processing thread sees the specs
+        with glob_data.lock:
+            glob_data.effect_specs = tuple(specs[:max_effects])
 
     
     def load_settings(self):
@@ -151,6 +186,11 @@ class BassShakerGUI(ctk.CTk):
                             f"The saved game file '{game_file}' was not found. Please make sure the game file is available in the game_files directory."
                         )
                         return
+                    try:
+                        self.set_sources(hub.settings_sources(data), hub.settings_forward(data))  # The other telemetry sources, before the effects that use them
+                    except (ValueError, KeyError, ImportError) as e:
+                        messagebox.showwarning("Telemetry Sources", f"The saved telemetry sources could not be loaded: {e}")
+                        return
 
                 if load_effects_var.get():
                     for widget in self.effect_list_frame.winfo_children():
@@ -184,6 +224,8 @@ class BassShakerGUI(ctk.CTk):
         data = {
             "game_file": self.game_file_dropdown.get(),
             "audio_device": self.audio_device_dropdown.get(),
+            "sources": [source._asdict() for source in self.sources],
+            "forward": list(self.forward_targets),
             "effects": {key: effect.get_data() for key, effect in self.effects.items()}
         }
 
@@ -197,38 +239,137 @@ class BassShakerGUI(ctk.CTk):
         ctk.set_appearance_mode("Light" if ctk.get_appearance_mode() == "Dark" else "Dark")
 
     def get_game_files(self):
-        game_files_dir = os.path.join(os.path.dirname(__file__), 'game_files')
-        return [f.replace('.py', '') for f in os.listdir(game_files_dir) if f.endswith('.py') and f != '__init__.py']
+        return game_files.available_games()  # Found without importing any game
 
     def on_game_file_selected(self, selected_file):
-        global udp_thread
         print(f"Selected game file: {selected_file}")
+        try:
+            game_file = game_files.load_game(selected_file)  # Import the game adapter
+        except (ValueError, ImportError) as e:
+            messagebox.showerror("Game File Error", f"The game file '{selected_file}' could not be loaded: {e}")
+            return
         with glob_data.lock:
             glob_data.game_info = {"game_file": selected_file} # Store the game file name in glob_data
-
-        game_file = importlib.import_module((f'game_files.{selected_file}')) # Import the game file
-        load_telemetry_options(game_file) # load the telemetry options to glob_data
-        # Update all telemetry dropdowns
+        glob_data.game_info["udp_port"] = game_file.udp_port
+        self.game_index = game_files.game_index(selected_file)  # Field and packet lookup tables, built once per game file
+        self.refresh_telemetry_options()
+        self.publish_effects()  # Recompile the effects against the new game file
+
+        # Listen to the new game in place of the old one, the other telemetry sources keep running
+        self.start_hub()
+        telemetry_hub.set_source(hub.TelemetrySource(processing.primary_source, selected_file, forward=self.forward_targets))
+
+    # The telemetry hub is started once and keeps running, sources are swapped in and out while it runs
+    def start_hub(self):
+        global telemetry_hub
+        if telemetry_hub is None:
+            telemetry_hub = hub.TelemetryHub(glob_data)
+            telemetry_hub.start()
+
+    # load the telemetry options of the game and the other sources to glob_data and update all telemetry dropdowns
+    def refresh_telemetry_options(self):
+        load_telemetry_options(self.game_index, self.source_indexes)
+        telemetry_inputs = list(glob_data.game_info.get('telemetry_options', {}).keys())
         for effect in self.effects.values():
-            print(f"Updating telemetry dropdowns for effect: {effect.effect_id}")
-            telemetry_inputs = list(glob_data.game_info.get('telemetry_options', {}).keys())
             for telemetry_input in effect.telemetry_inputs: # For every telemetry input dropdown in the effect
                 telemetry_input.configure(values=telemetry_inputs)
 
-        # If there is a telemetry and effect processing thread running, try to stop it
-        if udp_thread and udp_thread.is_alive(): 
-            print("Stopping the previous UDP thread")
-            with glob_data.lock:
-                glob_data.game_info["stop_thread"] = True #this will be read within the thread to end it
-            udp_thread.join(timeout=5)  # Wait for the thread to finish with a timeout of 5 seconds
-            if udp_thread.is_alive():
-                print("Error: Was not able to stop previous UDP Thread.")
-        else:
-            glob_data.game_info["stop_thread"] = False
+    # Listen to a new list of telemetry sources besides the game and forward the game to new targets.
+    # Sources that didn't change keep running
+    def set_sources(self, sources, forward_targets):
+        source_indexes = hub.source_indexes(sources)  # Raises ValueError for an unknown game file
+        self.start_hub()
+        if forward_targets != self.forward_targets:
+            self.forward_targets = forward_targets
+            if self.game_index is not None:
+                telemetry_hub.set_source(hub.TelemetrySource(processing.primary_source, self.selected_game_file.get(), forward=forward_targets))
+        names = {source.name for source in sources}
+        for source in self.sources:
+            if source.name not in names:
+                telemetry_hub.remove_source(source.name)
+        for source in sources:
+            if source not in self.sources:
+                telemetry_hub.set_source(source)
+        self.sources = sources
+        self.source_indexes = source_indexes
+        self.refresh_telemetry_options()
+        self.publish_effects()
+
+    # Popup listing the telemetry sources besides the game, e.g. a motion platform forwarder or a second PC.
+    # Their fields show up in the telemetry dropdowns as name:field. Forwarding targets are comma separated host:port
+    def edit_sources(self):
+        popup = ctk.CTkToplevel(self)
+        popup.title("Telemetry Sources")
+        popup.transient(self)  # Keep the popup in front of the main window
+        popup.grab_set()  # Make the popup modal
+
+        forward_frame = ctk.CTkFrame(popup)
+        forward_frame.pack(fill="x", padx=10, pady=5)
+        ctk.CTkLabel(forward_frame, text="Forward game to:").pack(side="left", padx=2)
+        game_forward_entry = ctk.CTkEntry(forward_frame, width=300, placeholder_text="host:port, host:port")
+        game_forward_entry.insert(0, ", ".join(self.forward_targets))
+        game_forward_entry.pack(side="left", fill="x", expand=True, padx=2)
+
+        forward_counts = telemetry_hub.forward_counts() if telemetry_hub is not None else {}
+        if forward_counts:
+            counts_text = "\n".join(f"{source} -> {target}: {sent} sent, {dropped} dropped" for (source, target), (sent, dropped) in forward_counts.items())
+            ctk.CTkLabel(popup, text=counts_text, justify="left", font=("Courier", 11)).pack(anchor="w", padx=10)
+
+        rows_frame = ctk.CTkFrame(popup)
+        rows_frame.pack(fill="x", padx=10, pady=5)
+        rows = []  # (frame, name entry, game file dropdown, host entry, port entry, forward entry)
+
+        def add_row(source=None):
+            row = ctk.CTkFrame(rows_frame)
+            row.pack(fill="x", pady=2)
+            entries = []
+            for placeholder, value, width in (("name", source and source.name, 100), ("host", source and source.host, 110),
+                                              ("port", source and source.port, 70), ("forward to", source and ", ".join(source.forward), 160)):
+                entry = ctk.CTkEntry(row, width=width, placeholder_text=placeholder)
+                if value:
+                    entry.insert(0, str(value))
+                entries.append(entry)
+            game_dropdown = ctk.CTkComboBox(row, values=self.game_files, width=110)
+            game_dropdown.set(source.game_file if source else self.selected_game_file.get())
+            for widget in (entries[0], game_dropdown, entries[1], entries[2], entries[3]):
+                widget.pack(side="left", padx=2)
+            entry_row = (row, entries[0], game_dropdown, entries[1], entries[2], entries[3])
+            rows.append(entry_row)
+
+            def remove_row():
+                row.destroy()
+                rows.remove(entry_row)
+            ctk.CTkButton(row, text="X", fg_color="red", width=20, command=remove_row).pack(side="right", padx=2)
+
+        for source in self.sources:
+            add_row(source)
+
+        # "host:port, host:port" -> ["host:port", ...]
+        def targets(entry):
+            return [target.strip() for target in entry.get().split(",") if target.strip()]
+
+        def on_confirm():
+            sources_data = []
+            for _, name_entry, game_dropdown, host_entry, port_entry, forward_entry in rows:
+                port = port_entry.get().strip()
+                if port and not port.isdigit():
+                    messagebox.showwarning("Invalid Port", f"The port of source '{name_entry.get()}' has to be a number.")
+                    return
+                sources_data.append({"name": name_entry.get().strip(), "game_file": game_dropdown.get(),
+                                     "host": host_entry.get().strip(), "port": int(port) if port else None, "forward": targets(forward_entry)})
+            names = [source_data["name"] for source_data in sources_data]
+            if len(set(names)) != len(names):
+                messagebox.showwarning("Duplicate Source", "Every telemetry source needs its own name.")
+                return
+            try:
+                self.set_sources(hub.settings_sources({"sources": sources_data}), hub.settings_forward({"forward": targets(game_forward_entry)}))
+            except (ValueError, ImportError) as e:
+                messagebox.showwarning("Invalid Source", str(e))
+                return
+            popup.destroy()
 
-        # Start the telemetry and effect processing thread
-        udp_thread = threading.Thread(target=processing.effects_processing, args=(self, glob_data, game_file), daemon=True)
-        udp_thread.start() # Start the thread
+        ctk.CTkButton(popup, text="Add Source", command=add_row).pack(pady=5)
+        ctk.CTkButton(popup, text="Confirm", command=on_confirm).pack(pady=10)
 
     def on_audio_device_selected(self, selected_device_value):
         global stream
@@ -256,7 +397,7 @@ class BassShakerGUI(ctk.CTk):
                     print(f"Error stopping audio stream: {e}")
             try:
                 buffer_size = int(self.buffer_size_var.get())
-                stream = audio.start_audio_stream(self, device_id, buffer_size)
+                stream = audio.start_audio_stream(device_id, buffer_size, num_channels)
             except Exception as e:
                 print(f"Error starting audio stream: {e}")
         else:
@@ -269,13 +410,46 @@ class BassShakerGUI(ctk.CTk):
 
     # recording toggle function
     def toggle_recording(self):
-        glob_data.recording = not glob_data.recording   
-        if glob_data.recording:
-            self.record_button.configure(fg_color="red", text="Stop")
+        if glob_data.recorder is None:
+            if audio.start_recording():  # Asks for the file to record to
+                self.record_button.configure(fg_color="red", text="Stop")
         else:
+            audio.stop_recording()
             self.record_button.configure(fg_color="grey", text="Rec")
-            audio.save_recording()
-            glob_data.recorded_frames = []  # Clear recorded frames after saving
+
+    # telemetry capture toggle function, records the raw UDP telemetry so it can be replayed without the game
+    def toggle_capture(self):
+        if glob_data.capture is None:
+            if "udp_port" not in glob_data.game_info:
+                messagebox.showwarning("No Game File", "Select a game file before capturing telemetry.")
+                return
+            filename = filedialog.asksaveasfilename(defaultextension=".slcap", filetypes=[("Telemetry captures", "*.slcap")])
+            if not filename:
+                return
+            glob_data.capture = capture.CaptureWriter(filename, glob_data.game_info["game_file"], glob_data.game_info["udp_port"])
+            self.capture_button.configure(fg_color="red", text="Stop Cap")
+        else:
+            active_capture = glob_data.capture
+            glob_data.capture = None
+            active_capture.stop()  # Returns straight away, the files are finished in the background
+            self.capture_button.configure(fg_color="grey", text="Capture")
+
+    # latency measurement toggle function, shows receive -> apply -> DAC percentiles while on
+    def toggle_latency(self):
+        if glob_data.latency is None:
+            glob_data.latency = latency.LatencyMonitor()
+            self.latency_button.configure(fg_color="green", text="Stop Lat")
+            self.update_latency()
+        else:
+            print(glob_data.latency.summary())
+            glob_data.latency = None
+            self.latency_button.configure(fg_color="grey", text="Latency")
+            self.latency_label.configure(text="")
+
+    def update_latency(self):
+        if glob_data.latency is not None:
+            self.latency_label.configure(text=glob_data.latency.summary())
+            self.after(500, self.update_latency)
 
     def toggle_plots(self):
         self.plotting = not self.plotting
@@ -293,11 +467,12 @@ class BassShakerGUI(ctk.CTk):
 
 
 class EffectFrame(ctk.CTkFrame):
-    def __init__(self, parent, effect_id, remove_callback, effect_type="range_effect"):
+    def __init__(self, parent, effect_id, remove_callback, effect_type="range_effect", change_callback=None):
         super().__init__(parent, border_width=2)
 
         self.effect_id = effect_id
         self.remove_callback = remove_callback
+        self.change_callback = change_callback  # Called with the effect whenever a setting is edited so it can be recompiled
         self.effect_type = effect_type
 
         # Header
@@ -316,6 +491,7 @@ class EffectFrame(ctk.CTkFrame):
         self.enable_var = ctk.BooleanVar(value=True)
         self.enable_checkbox = ctk.CTkCheckBox(self.header, variable=self.enable_var, text="Enabled", width=10)
         self.enable_checkbox.pack(side="right", padx=5)
+        self.enable_var.trace_add("write", lambda *args: self.on_change())
         
         # Max Output Amplitude Slider
         max_output_label = ctk.CTkLabel(self.header, text="Max Output:")
@@ -324,10 +500,15 @@ class EffectFrame(ctk.CTkFrame):
         self.max_output_amplitude_slider = ctk.CTkSlider(self.header, from_=0, to=1, variable=self.max_output_amplitude_var)
         self.max_output_amplitude_slider.pack(side="left", padx=5)
         self.max_output_amplitude_var.trace_add("write", lambda *args: self.max_output_value_label.configure(text=f"{self.max_output_amplitude_var.get():.2f}")) # Update the label when the slider is moved
+        self.max_output_amplitude_var.trace_add("write", lambda *args: self.on_change())
         
         # Add a label to show the value of the max output amplitude slider
         self.max_output_value_label = ctk.CTkLabel(self.header, text=f"{self.max_output_amplitude_var.get():.2f}")
         self.max_output_value_label.pack(side="left", padx=5)
+
+        # Why the effect isn't playing, empty while its settings compile
+        self.error_label = ctk.CTkLabel(self.header, text="", text_color="orange")
+        self.error_label.pack(side="left", padx=5)
         
         # Collapsible Section
         self.content_frame = ctk.CTkFrame(self)
@@ -335,7 +516,12 @@ class EffectFrame(ctk.CTkFrame):
 
         self.telemetry_inputs = []  # Initialize telemetry_inputs
     
-        self.plot_data = deque(maxlen=1000)  # Set a max length if needed    # Initialize plot data for effect
+        self.spec = None  # Compiled settings of the effect, set by BassShakerGUI.publish_effects
+        self.compile_error = None  # Why the settings don't compile, shown in the header until they do
+        self.channel_gains = {}  # Output gains set in the routing popup, on top of the channel dropdown at full gain
+        self.line_plot = None  # LinePlot drawing the effect input, created with the plot canvas
+        self.plotted = None  # (fields, process) the plot range below belongs to
+        self.plotted_end = 0  # History update index after the last plotted entry
         self.max_plotted = float('-inf')
         self.min_plotted = float('inf')
 
@@ -370,8 +556,9 @@ class EffectFrame(ctk.CTkFrame):
         self.process_method_frame.pack(fill="x", pady=2)
         process_method_label = ctk.CTkLabel(self.process_method_frame, text="Process Method:", width = in_out_label_width)
         process_method_label.pack(side="left", padx=2, pady=0)
-        self.process_method_dropdown = ctk.CTkComboBox(self.process_method_frame, values=telemetry_process_options[self.effect_type])
+        self.process_method_dropdown = ctk.CTkComboBox(self.process_method_frame, values=telemetry_process_options[self.effect_type], command=lambda value: self.on_change())
         self.process_method_dropdown.pack(fill="x", pady=2)
+        self.bind_change(self.process_method_dropdown)
         
         # Frequency (Right - Output)
         self.frequency_frame = ctk.CTkFrame(self.output_frame)
@@ -380,6 +567,25 @@ class EffectFrame(ctk.CTkFrame):
         frequency_label.pack(side="left", padx=2, pady=0)
         self.frequency_entry = ctk.CTkEntry(self.frequency_frame, placeholder_text="Frequency")
         self.frequency_entry.pack(fill="x", pady=2)
+        self.bind_change(self.frequency_entry)
+
+        # Waveform (Right - Output)
+        self.waveform_frame = ctk.CTkFrame(self.output_frame)
+        self.waveform_frame.pack(fill="x", pady=2)
+        waveform_label = ctk.CTkLabel(self.waveform_frame, text="Waveform:", width = in_out_label_width)
+        waveform_label.pack(side="left", padx=2, pady=0)
+        self.waveform_dropdown = ctk.CTkComboBox(self.waveform_frame, values=synth.waveforms, command=lambda value: self.on_change())
+        self.waveform_dropdown.pack(fill="x", pady=2)
+        self.waveform_dropdown.set("sine")
+
+        # Transition Samples (Right - Output)
+        self.transition_samples_frame = ctk.CTkFrame(self.output_frame)
+        self.transition_samples_frame.pack(fill="x", pady=2)
+        transition_samples_label = ctk.CTkLabel(self.transition_samples_frame, text="Transition:", width = in_out_label_width)
+        transition_samples_label.pack(side="left", padx=2, pady=0)
+        self.transition_samples_entry = ctk.CTkEntry(self.transition_samples_frame, placeholder_text="Samples (blank = buffer)")
+        self.transition_samples_entry.pack(fill="x", pady=2)
+        self.bind_change(self.transition_samples_entry)
         
         if self.effect_type == "range_effect":
             # Min Input (Left - Input)
@@ -389,6 +595,7 @@ class EffectFrame(ctk.CTkFrame):
             min_input_label.pack(side="left", padx=2, pady=0)
             self.min_input_entry = ctk.CTkEntry(self.min_input_frame, placeholder_text="Min Input")
             self.min_input_entry.pack(fill="x", pady=2)
+            self.bind_change(self.min_input_entry)
             
             # Min Amplitude (Right - Output)
             self.min_amplitude_frame = ctk.CTkFrame(self.output_frame)
@@ -397,6 +604,7 @@ class EffectFrame(ctk.CTkFrame):
             min_amplitude_label.pack(side="left", padx=2, pady=0)
             self.min_amplitude_entry = ctk.CTkEntry(self.min_amplitude_frame, placeholder_text="Min Amplitude")
             self.min_amplitude_entry.pack(fill="x", pady=2)
+            self.bind_change(self.min_amplitude_entry)
             
             # Max Input (Left - Input)
             self.max_input_frame = ctk.CTkFrame(self.input_frame)
@@ -405,6 +613,7 @@ class EffectFrame(ctk.CTkFrame):
             max_input_label.pack(side="left", padx=2, pady=0)
             self.max_input_entry = ctk.CTkEntry(self.max_input_frame, placeholder_text="Max Input")
             self.max_input_entry.pack(fill="x", pady=2)
+            self.bind_change(self.max_input_entry)
             
 
              # Output Exponent (Right - Output)
@@ -419,14 +628,10 @@ class EffectFrame(ctk.CTkFrame):
             self.output_expo.insert(0, str(1))  # Default value
             self.output_expo.bind("<Return>", lambda e: self.plot_response_curve())
             self.output_expo.bind("<FocusOut>", lambda e: self.plot_response_curve())
+            self.bind_change(self.output_expo)
 
             # Channel Selection (Right - Output)
-            self.channel_frame = ctk.CTkFrame(self.output_frame)
-            self.channel_frame.pack(fill="x", pady=2)
-            channel_label = ctk.CTkLabel(self.channel_frame, text="Channel:", width = in_out_label_width)
-            channel_label.pack(side="left", padx=2, pady=0)
-            self.channel_dropdown = ctk.CTkComboBox(self.channel_frame, variable=ctk.StringVar(), values=list(glob_data.channels.keys()))
-            self.channel_dropdown.pack(fill="x", pady=0)
+            self.create_channel_selection(in_out_label_width)
             
         elif self.effect_type == "trigger_effect":
             # Pulse Duration (Right - Output)
@@ -436,14 +641,24 @@ class EffectFrame(ctk.CTkFrame):
             pulse_duration_label.pack(side="left", padx=2, pady=0)
             self.pulse_duration_entry = ctk.CTkEntry(self.pulse_duration_frame, placeholder_text="Pulse Duration")
             self.pulse_duration_entry.pack(fill="x", pady=2)
+            self.bind_change(self.pulse_duration_entry)
+
+            # Pulse envelope and repeats (Right - Output), settings key -> entry
+            self.pulse_entries = {}
+            for key, label, default in (("pulse_attack", "Attack (s):", 0), ("pulse_release", "Release (s):", 0),
+                                        ("pulse_repeats", "Repeats:", 1), ("pulse_gap", "Repeat Gap (s):", 0)):
+                pulse_frame = ctk.CTkFrame(self.output_frame)
+                pulse_frame.pack(fill="x", pady=2)
+                pulse_label = ctk.CTkLabel(pulse_frame, text=label, width = in_out_label_width)
+                pulse_label.pack(side="left", padx=2, pady=0)
+                entry = ctk.CTkEntry(pulse_frame)
+                entry.pack(fill="x", pady=2)
+                entry.insert(0, str(default))
+                self.bind_change(entry)
+                self.pulse_entries[key] = entry
             
             # Channel Selection (Right - Output)
-            self.channel_frame = ctk.CTkFrame(self.output_frame)
-            self.channel_frame.pack(fill="x", pady=2)
-            channel_label = ctk.CTkLabel(self.channel_frame, text="Channel:", width = in_out_label_width)
-            channel_label.pack(side="left", padx=2, pady=0)
-            self.channel_dropdown = ctk.CTkComboBox(self.channel_frame, variable=ctk.StringVar(), values=list(glob_data.channels.keys()))
-            self.channel_dropdown.pack(fill="x", pady=0)
+            self.create_channel_selection(in_out_label_width)
             
         # Telemetry Inputs (Left)
         self.add_telemetry_button = ctk.CTkButton(self.input_frame, text="Add Telemetry", command=self.add_telemetry_input)
@@ -453,16 +668,88 @@ class EffectFrame(ctk.CTkFrame):
         self.plot_frame.pack(fill="both", expand=True, padx=5, pady=5)
         print("updating effect plot with self")
 
+    # Channel dropdown for the main output and a button to route the effect to more channels
+    def create_channel_selection(self, label_width):
+        self.channel_frame = ctk.CTkFrame(self.output_frame)
+        self.channel_frame.pack(fill="x", pady=2)
+        channel_label = ctk.CTkLabel(self.channel_frame, text="Channel:", width=label_width)
+        channel_label.pack(side="left", padx=2, pady=0)
+        self.routing_button = ctk.CTkButton(self.channel_frame, text="Routing", width=60, command=self.edit_routing)
+        self.routing_button.pack(side="right", padx=2)
+        self.channel_var = ctk.StringVar()
+        self.channel_dropdown = ctk.CTkComboBox(self.channel_frame, variable=self.channel_var, values=list(glob_data.channels.keys()))
+        self.channel_dropdown.pack(fill="x", pady=0)
+        self.channel_var.trace_add("write", lambda *args: self.on_change())
+
+    # Popup with a gain for every output channel of the device. The main channel plays at 1 unless changed here
+    def edit_routing(self):
+        popup = ctk.CTkToplevel(self)
+        popup.title("Channel Routing")
+        popup.transient(self)  # Keep the popup in front of the main window
+        popup.grab_set()  # Make the popup modal
+
+        entries = {}
+        for channel_name in glob_data.channels:
+            gain = self.channel_gains.get(channel_name, 1.0 if channel_name == self.channel_dropdown.get() else 0.0)
+            row = ctk.CTkFrame(popup)
+            row.pack(fill="x", padx=10, pady=2)
+            ctk.CTkLabel(row, text=channel_name, width=100).pack(side="left", padx=2)
+            entry = ctk.CTkEntry(row, width=80)
+            entry.insert(0, str(gain))
+            entry.pack(side="left", padx=2)
+            entries[channel_name] = entry
+
+        def on_confirm():
+            try:
+                channel_gains = {channel_name: float(entry.get() or 0) for channel_name, entry in entries.items()}
+            except ValueError:
+                messagebox.showwarning("Invalid Gain", "Channel gains have to be numbers.")
+                return
+            self.channel_gains = {channel_name: gain for channel_name, gain in channel_gains.items()
+                                  if gain != (1.0 if channel_name == self.channel_dropdown.get() else 0.0)}  # Only what differs from the dropdown
+            popup.destroy()
+            self.on_change()
+
+        ctk.CTkButton(popup, text="Confirm", command=on_confirm).pack(pady=10)
+
+    # Recompile the effect whenever one of these widgets is edited
+    def bind_change(self, widget):
+        widget.bind("<KeyRelease>", lambda e: self.on_change())
+        widget.bind("<FocusOut>", lambda e: self.on_change())
+
+    def on_change(self):
+        if self.change_callback:
+            self.change_callback(self)
+
+    # Compile the current settings into an EffectSpec for the processing thread. Returns None while the settings are
+    # incomplete, the reason is shown in the header and reported once per new reason, not on every key press
+    def compile(self, game_index, sources=None):
+        try:
+            spec = processing.compile_effect(self.effect_id, self.get_data(), game_index, sources)
+            error = None
+        except (ValueError, KeyError) as e:
+            spec = None
+            error = str(e)
+        if error != self.compile_error:
+            self.compile_error = error
+            self.error_label.configure(text=f"Not active: {error}" if error else "")
+            if error:
+                diagnostics.warning("Effect %s not active: %s", self.effect_id, error)
+        return spec
 
     def plot_response_curve(self):
+        effect_data = self.get_data()
+        effect_data["telemetry_inputs"] = []  # The response curve doesn't depend on the telemetry inputs
+        spec = processing.compile_effect(self.effect_id, effect_data, None)
+
         def calculate_amplitude(input_value):
-            return processing.amplitude_calc(self, input_value)
+            return processing.amplitude_calc(spec, input_value)
 
         # Get min/max values
-        min_input = float(self.min_input_entry.get())
-        max_input = float(self.max_input_entry.get())
-        min_amp = float(self.min_amplitude_entry.get())
-        max_amp = float(self.max_output_amplitude_slider.get())
+        min_input = spec.min_input
+        max_input = spec.max_input
+        min_amp = spec.min_amplitude
+        max_amp = spec.max_amplitude
 
         # Define input range with higher resolution
         input_range = np.linspace(min_input, max_input, 100)
@@ -526,8 +813,10 @@ class EffectFrame(ctk.CTkFrame):
         telemetry_frame = ctk.CTkFrame(self.input_frame)
         telemetry_frame.pack(fill="x", pady=2)
 
-        telemetry_dropdown = ctk.CTkComboBox(telemetry_frame, variable=ctk.StringVar(), values=list(glob_data.game_info.get('telemetry_options', {}).keys()))        
+        telemetry_var = ctk.StringVar()
+        telemetry_dropdown = ctk.CTkComboBox(telemetry_frame, variable=telemetry_var, values=list(glob_data.game_info.get('telemetry_options', {}).keys()))        
         telemetry_dropdown.pack(side="left", fill="x", expand=True, padx=2)
+        telemetry_var.trace_add("write", lambda *args: self.on_change())
 
         remove_btn = ctk.CTkButton(telemetry_frame, text="X", fg_color="red", width=20, command=lambda: self.remove_telemetry_input(telemetry_frame, telemetry_dropdown))
         remove_btn.pack(side="right", padx=2)
@@ -538,67 +827,45 @@ class EffectFrame(ctk.CTkFrame):
     def remove_telemetry_input(self, frame, dropdown):
         frame.destroy()
         self.telemetry_inputs.remove(dropdown)
+        self.on_change()
 
     def remove_effect(self):
         self.destroy()
         self.remove_callback(self.effect_id)
 
     def plot_telemetry(self):
-        # Initialize the plot canvas if it doesn't exist
-        if not hasattr(self, "plot_canvas"):
+        # Initialize the plot canvas and its line if they don't exist
+        if self.line_plot is None:
             self.plot_canvas = tk.Canvas(self.plot_frame, height=150, bg="#3a3a3a", highlightthickness=0)
             self.plot_canvas.pack(fill="both", expand=True)
-            print("Initialized plot canvas")
-        try:
-            if hasattr(self, "plot_canvas"):
-                if self.plot_canvas.find_all():
-                    self.plot_canvas.delete("all")
-            else:
-                print("Plot canvas not initialized")
-                return
-        except Exception as e:
-            print(f"Error deleting canvas items: {e}")
-            if hasattr(self, "plot_canvas"): # Reinitialize the canvas if it caused an error
-                self.plot_canvas.destroy()
-            self.plot_canvas = tk.Canvas(self.plot_frame, height=150, bg="#3a3a3a", highlightthickness=0)
-            self.plot_canvas.pack(fill="both", expand=True)
-        
-        if self.plot_data and max(self.plot_data) > self.max_plotted:
-            self.max_plotted = max(self.plot_data)
-        if self.plot_data and min(self.plot_data) < self.min_plotted:
-            self.min_plotted = min(self.plot_data)
-        if self.plot_data:
-            self.draw_plot(self.plot_data)
-
-
+            self.line_plot = plotting.LinePlot(self.plot_canvas)
+        spec = self.spec
+        if spec is None or not spec.fields:
+            return
+        snapshot = glob_data.history.snapshot(spec.fields, plotting.plot_points)  # Lock free copy of the latest input values
+        if snapshot is None:
+            return
+        end, times, input_vals, _ = snapshot
+        plot_data = processing.vector_process_methods[spec.process](input_vals)  # The effect input, as update_effects works it out
+
+        # Widen the plot range with only the values added since the last redraw
+        if self.plotted != (spec.fields, spec.process):
+            self.plotted = (spec.fields, spec.process)
+            self.max_plotted = float('-inf')
+            self.min_plotted = float('inf')
+            self.plotted_end = end - len(plot_data)
+        new_data = plot_data[max(len(plot_data) - (end - self.plotted_end), 0):]
+        self.plotted_end = end
+        if len(new_data) and not np.isnan(new_data).all():
+            self.max_plotted = max(self.max_plotted, float(np.nanmax(new_data)))
+            self.min_plotted = min(self.min_plotted, float(np.nanmin(new_data)))
+        plot_data = plot_data[~np.isnan(plot_data)]
+        if len(plot_data):
+            self.draw_plot(plot_data)
+
+    # Move the plot line to the latest values, the canvas items are only updated, never recreated
     def draw_plot(self, plot_data):
-        # Get current width and height of the plot canvas
-        width = self.plot_canvas.winfo_width()
-        height = self.plot_canvas.winfo_height()
-        padding = 10  # Maintain constant padding
-
-        # Ensure we don't get a division by zero error
-        min_val, max_val = self.min_plotted, self.max_plotted
-        range_val = max_val - min_val if max_val - min_val != 0 else 1
-        
-        # Scale the data based on the current canvas size
-        scaled_data = [((val - min_val) / range_val) * (height - 2 * padding) for val in plot_data]
-        
-        # Calculate step size based on number of data points and available width
-        step_x = (width - 2 * padding) / max(len(scaled_data) - 1, 1)
-        
-        # Calculate points
-        points = [(padding + i * step_x, height - padding - y) for i, y in enumerate(scaled_data)]
-        
-        # Clear the canvas before drawing (optional to prevent layering old plots)
-        self.plot_canvas.delete("all")
-        
-        n = 1  # Plot every nth point (you can adjust this if needed)
-        for i in range(n, len(points), n):
-            self.plot_canvas.create_line(points[i - n], points[i], fill="orange", width=3)
-        
-        # Display the max value at the top left with a larger font
-        self.plot_canvas.create_text(padding, padding, anchor="nw", text=f"max: {max_val:.2f}", fill="orange", font=("Roboto", 18))
+        self.line_plot.draw(plot_data, self.min_plotted, self.max_plotted)
 
     def get_data(self):
         data = {
@@ -606,7 +873,10 @@ class EffectFrame(ctk.CTkFrame):
             "effect_type": self.effect_type,
             "effect_enabled": self.enable_var.get(),
             "channel": self.channel_dropdown.get(),
-            "telemetry_inputs": [{"field_name": telemetry.get(), "packet_id": glob_data.game_info['telemetry_options'].get(telemetry.get())} for telemetry in self.telemetry_inputs],
+            "channel_gains": dict(self.channel_gains),
+            "waveform": self.waveform_dropdown.get(),
+            "transition_samples": int(self.transition_samples_entry.get() or 0),
+            "telemetry_inputs": [{"field_name": telemetry.get(), "packet_id": glob_data.game_info.get('telemetry_options', {}).get(telemetry.get())} for telemetry in self.telemetry_inputs],
             "max_output_amplitude": self.max_output_amplitude_slider.get()
         }
 
@@ -623,7 +893,11 @@ class EffectFrame(ctk.CTkFrame):
             data.update({
                 "process_method": self.process_method_dropdown.get(),
                 "frequency": float(self.frequency_entry.get() or 0),
-                "pulse_duration": float(self.pulse_duration_entry.get() or 0)
+                "pulse_duration": float(self.pulse_duration_entry.get() or 0),
+                "pulse_attack": float(self.pulse_entries["pulse_attack"].get() or 0),
+                "pulse_release": float(self.pulse_entries["pulse_release"].get() or 0),
+                "pulse_repeats": int(self.pulse_entries["pulse_repeats"].get() or 1),
+                "pulse_gap": float(self.pulse_entries["pulse_gap"].get() or 0)
             })
 
         return data
@@ -634,6 +908,10 @@ class EffectFrame(ctk.CTkFrame):
         self.enable_var.set(data.get("effect_enabled", True))
         self.toggle_collapse()
         self.max_output_amplitude_slider.set(data.get("max_output_amplitude", 0.5))
+        self.waveform_dropdown.set(data.get("waveform", "sine"))
+        self.channel_gains = dict(data.get("channel_gains") or {})
+        if data.get("transition_samples"):
+            self.transition_samples_entry.delete(0, tk.END); self.transition_samples_entry.insert(0, str(data["transition_samples"]))
 
         if self.effect_type == "range_effect":
             self.process_method_dropdown.set(data.get("process_method", "max"))
@@ -647,6 +925,9 @@ class EffectFrame(ctk.CTkFrame):
             self.process_method_dropdown.set(data.get("process_method", "change"))
             self.frequency_entry.delete(0, tk.END); self.frequency_entry.insert(0, str(data.get("frequency", 0)))
             self.pulse_duration_entry.delete(0, tk.END); self.pulse_duration_entry.insert(0, str(data.get("pulse_duration", 0)))
+            for key, entry in self.pulse_entries.items():
+                if key in data:
+                    entry.delete(0, tk.END); entry.insert(0, str(data[key]))
             self.channel_dropdown.set(data.get("channel", "channel_1"))
 
         for telemetry in data.get("telemetry_inputs", []):
@@ -0,0 +1,110 @@
+import math
+import numpy as np
+
+# This module keeps the recent history of the telemetry fields the effects use, for the plots and anything else that
+# wants to look back at the data (calibration, exporters).
+# Every field has preallocated rings of (time, value) written only by the processing thread. All fields are written at
+# the same update index, which only grows, so entry i of every field comes from the same update. A reader takes a
+# snapshot without a lock: it copies the entries, then checks the write index again and drops any entries the writer
+# overwrote during the copy.
+# On top of the raw data are downsampled tiers, each entry holding the lowest and highest value of tier_factor entries
+# of the tier below, so long time windows can be shown from a few thousand points
+
+history_size = 4000  # Entries per ring, at 60 updates a second about a minute of raw data
+tier_factor = 10  # Entries of the tier below reduced into one entry of the next tier
+tier_count = 2  # Downsampled tiers on top of the raw data, about 11 minutes and 2 hours at 60 updates a second
+
+
+# One ring of (time, low, high) entries, the raw data uses the same array for low and high.
+# Entries that were never written are NaN
+class Ring:
+    def __init__(self, size, start, with_high):
+        self.times = np.full(size, math.nan)
+        self.lows = np.full(size, math.nan)
+        self.highs = np.full(size, math.nan) if with_high else self.lows
+        self.write_index = start  # Index after the last entry written, only grows
+
+    def write(self, index, time, low, high):
+        position = index % len(self.times)
+        self.times[position] = time
+        self.lows[position] = low
+        self.highs[position] = high
+        self.write_index = index + 1  # Published only after the entry is written
+
+    # Copy of the latest count entries oldest first, as (end, times, lows, highs) with end the index after the last
+    # entry. Entries overwritten by the writer during the copy are dropped
+    def snapshot(self, count, end=None):
+        size = len(self.times)
+        if end is None:
+            end = self.write_index
+        count = min(count, end, size)
+        indices = np.arange(end - count, end) % size
+        times, lows, highs = self.times[indices], self.lows[indices], self.highs[indices]
+        # The writer may be writing the entry at write_index, which sits in the same place as the entry size back
+        overwritten = self.write_index + 1 - size - (end - count)
+        if overwritten > 0:
+            times, lows, highs = times[overwritten:], lows[overwritten:], highs[overwritten:]
+        return end, times, lows, highs
+
+
+# History of one telemetry field: the raw ring and its downsampled tiers. start is the update index the field was
+# added at, the entries before it stay NaN
+class FieldHistory:
+    def __init__(self, size=history_size, start=0):
+        self.size = size
+        self.tiers = [Ring(size, start, False)] + [Ring(size, start // tier_factor ** tier, True) for tier in range(1, tier_count + 1)]
+
+    def append(self, index, time, value):
+        self.tiers[0].write(index, time, value, value)
+        for tier in range(1, tier_count + 1):
+            index += 1
+            if index % tier_factor:
+                break  # The block of the tier below isn't full yet, so neither are the tiers above
+            index = index // tier_factor - 1  # Entry of this tier the block reduces into
+            below = self.tiers[tier - 1]
+            positions = np.arange(index * tier_factor, (index + 1) * tier_factor) % self.size
+            self.tiers[tier].write(index, below.times[positions[-1]],
+                                   np.fmin.reduce(below.lows[positions]), np.fmax.reduce(below.highs[positions]))  # NaN only if all are NaN
+
+    # See Ring.snapshot, tier 0 is the raw data with lows and highs the same values
+    def snapshot(self, count, tier=0, end=None):
+        return self.tiers[tier].snapshot(count, end)
+
+
+# The histories of every field the effects use
+class TelemetryHistory:
+    def __init__(self, size=history_size):
+        self.size = size
+        self.updates = 0  # Updates appended so far, the index of the next update
+        self.fields = {}  # field name -> FieldHistory, replaced as a whole so the writer can iterate it without a lock
+
+    # GUI thread: make sure every field in field_names has a history. Histories are kept when a field stops being used
+    def ensure(self, field_names):
+        missing = [field_name for field_name in field_names if field_name not in self.fields]
+        if missing:
+            fields = dict(self.fields)
+            for field_name in missing:
+                fields[field_name] = FieldHistory(self.size, self.updates)
+            self.fields = fields
+
+    # Processing thread: add the values of one update. Every history gets an entry, NaN if the field wasn't read
+    def append(self, time, field_values):
+        index = self.updates
+        for field_name, field_history in self.fields.items():
+            field_history.append(index, time, field_values.get(field_name, math.nan))
+        self.updates = index + 1
+
+    # Snapshot the latest count entries of several fields, entry i of every field from the same update.
+    # Returns (end, times, lows, highs) with lows and highs (fields x entries) arrays, None if a field has no history.
+    # end is the update index after the last entry (or tier entry), so a reader can tell which entries are new
+    def snapshot(self, field_names, count, tier=0):
+        field_histories = [self.fields.get(field_name) for field_name in field_names]
+        if not field_histories or None in field_histories:
+            return None
+        end = min(field_history.tiers[tier].write_index for field_history in field_histories)  # All fields finished writing it
+        snapshots = [field_history.snapshot(count, tier, end) for field_history in field_histories]
+        length = min(len(snapshot[1]) for snapshot in snapshots)
+        times = snapshots[0][1][len(snapshots[0][1]) - length:]
+        lows = np.array([snapshot[2][len(snapshot[2]) - length:] for snapshot in snapshots])
+        highs = np.array([snapshot[3][len(snapshot[3]) - length:] for snapshot in snapshots])
+        return end, times, lows, highs
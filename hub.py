@@ -0,0 +1,346 @@
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+import game_files
+import processing
+from diagnostics import diagnostics
+
+# The telemetry hub receives UDP telemetry from several sources at once, e.g. the game plus a motion platform forwarder
+# or a second PC on the network, and runs the effects on all of it from one thread.
+# Every source has its own socket and game file. The sockets are multiplexed in one selector loop and the effects are
+# updated once per wake up, with the newest packet of each id from every source that sent data. The telemetry is
+# stored per (source name, packet_id), so an effect can mix fields of several sources (see processing.resolve_field).
+# Sources are added, replaced and removed while the hub runs, without stopping the other sources.
+# A source can also forward every datagram it receives to other programs that want the same telemetry (a dash app, a
+# motion sim), as the game only sends to one port. Datagrams are sent on as soon as they are received, straight from the
+# receive buffer, before anything else is done with them
+
+max_packet_size = 2048  # Receive buffer size - adjustable based on expected packet size
+receive_buffer_size = 1 << 20  # Socket receive buffer in bytes
+max_drain_packets = 256  # Most datagrams read in one drain, so effects still update during a flood of packets
+
+TelemetrySource = namedtuple('TelemetrySource', [
+    'name',  # processing.primary_source for the selected game, other sources' fields are used as name:field
+    'game_file',  # Name of the game file the packets are decoded with, see game_files
+    'host',  # Interface to listen on, 'localhost' for this PC or '0.0.0.0' for telemetry from other PCs
+    'port',  # UDP port, None for the port of the game file
+    'forward'  # tuple of "host:port" targets every datagram is sent on to
+], defaults=('localhost', None, ()))
+
+
+# Split a "host:port" forwarding target. Raises ValueError if it isn't one
+def parse_target(target):
+    host, _, port = target.strip().rpartition(':')
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"Forwarding target '{target}' is not host:port")
+    return host, int(port)
+
+
+# Sends datagrams on to one target over a pre-connected socket, so the address is only resolved once.
+# Never blocks: a datagram the target can't take right now is dropped and counted
+class Forwarder:
+    def __init__(self, target):
+        self.target = target
+        self.host, self.port = parse_target(target)
+        self.sent = 0
+        self.dropped = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        try:
+            self.sock.connect((self.host, self.port))
+        except OSError:
+            self.sock.close()
+            raise
+
+    def send(self, data):
+        try:
+            self.sock.send(data)
+            self.sent += 1
+        except OSError as e:  # BlockingIOError when the send buffer is full, ConnectionRefusedError when nothing listens
+            self.dropped += 1
+            diagnostics.warning("Forwarding to %s failed: %s", self.target, e.__class__.__name__)
+
+    def close(self):
+        self.sock.close()
+
+
+# The extra telemetry sources of a settings file, saved by the GUI as a list of {"name", "game_file", "host", "port", "forward"}
+def settings_sources(settings):
+    sources = []
+    for source_data in settings.get("sources", []):
+        name = source_data.get("name", "")
+        if not name or ':' in name or name == processing.primary_source:
+            raise ValueError(f"Invalid telemetry source name: '{name}'")
+        forward = tuple(source_data.get("forward") or ())
+        for target in forward:
+            parse_target(target)
+        sources.append(TelemetrySource(name, source_data["game_file"], source_data.get("host") or 'localhost', source_data.get("port"), forward))
+    return sources
+
+
+# The forwarding targets of the game in a settings file, saved by the GUI as a list of "host:port"
+def settings_forward(settings):
+    forward = tuple(settings.get("forward") or ())
+    for target in forward:
+        parse_target(target)
+    return forward
+
+
+# Source name -> game index of each source, for compiling effects that use their fields
+def source_indexes(sources):
+    return {source.name: game_files.game_index(source.game_file) for source in sources}
+
+
+# The socket and receive buffers of one source. Only used by the hub thread
+class SourceReceiver:
+    def __init__(self, source, stats):
+        self.source = source
+        self.name = source.name
+        self.game_file = game_files.load_game(source.game_file)
+        self.game_index = game_files.game_index(source.game_file)
+        self.port = source.port or self.game_file.udp_port
+        self.stats = stats
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind((source.host, self.port))
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)  # non-blocking mode, the selector waits for data and drain() reads everything pending
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)  # Room for bursts while effects are updating
+        self.forwarders = []
+        try:
+            for target in source.forward:
+                host, port = parse_target(target)
+                if port == self.port and host in ('localhost', '127.0.0.1', '0.0.0.0', source.host):
+                    raise ValueError(f"Forwarding target {target} is the port {source.name} listens on")
+                self.forwarders.append(Forwarder(target))
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+        packet_id = self.game_index["packet_id"]
+        self.packet_table = self.game_index["packet_table"]
+        self.packet_id_unpack_from = struct.Struct(packet_id.code).unpack_from
+        self.packet_id_offset = packet_id.offset
+        self.byte_packet_id = struct.calcsize(packet_id.code) == 1  # Read as a single byte without unpacking
+        self.header_checks = self.game_index["header_checks"]
+        self.header_size = self.game_file.PacketHeader['size']
+        self.reported_versions = set()  # Header values of other game versions already reported
+
+        # Preallocated receive buffers: one to receive into and one holding the newest packet of each used packet_id.
+        # A used packet swaps its buffer with the receive buffer, so nothing is copied and stale packets are simply overwritten
+        self.receive_buffer = bytearray(max_packet_size)
+        self.latest_buffers = {packet_id: bytearray(max_packet_size) for packet_id in self.game_index["packets"]}
+        self.latest_sizes = {}  # packet_id -> size of the packet in latest_buffers, for the packets received in this drain
+
+    # Report a packet from a game version the game file isn't for, once per version. Its packet_id isn't read, other
+    # versions can have it somewhere else
+    def version_mismatch(self, data):
+        self.stats["mismatched"] += 1
+        header_version = self.game_index["header_version"]
+        version = tuple(struct.unpack_from(location.code, data, location.offset)[0] for _, location in header_version)
+        if version not in self.reported_versions:
+            self.reported_versions.add(version)
+            diagnostics.warning("Packets from %s have %s but the game file is for %s, packets from this game version are ignored",
+                                self.name,
+                                ", ".join(f"{name}={value}" for (name, _), value in zip(header_version, version)),
+                                ", ".join(f"{name}={value}" for name, value in self.game_file.expected_header.items()))
+
+    # Read every datagram waiting on the socket, keeping the newest packet of each used id. capture is a CaptureWriter
+    # that gets every datagram, arrivals gets the perf_counter arrival time of each kept packet while measuring latency.
+    # Returns True if a used packet arrived
+    def drain(self, capture, arrivals):
+        sock = self.sock
+        receive_buffer = self.receive_buffer
+        latest_buffers = self.latest_buffers
+        latest_sizes = self.latest_sizes
+        packet_table = self.packet_table
+        table_size = len(packet_table)
+        packet_id_offset = self.packet_id_offset
+        byte_packet_id = self.byte_packet_id
+        header_checks = self.header_checks
+        header_size = self.header_size
+        forwarders = self.forwarders
+        name = self.name
+        latest_sizes.clear()
+        received = 0
+        for _ in range(max_drain_packets):
+            try:
+                nbytes = sock.recv_into(receive_buffer)
+            except BlockingIOError:
+                break  # Nothing left to read
+            except ConnectionResetError:
+                continue  # Windows reports ICMP errors from earlier sends on UDP sockets, not relevant here
+            received += 1
+            if forwarders:  # First, so the other programs get the datagram as soon as possible
+                data = memoryview(receive_buffer)[:nbytes]  # A view of the receive buffer, nothing is copied
+                for forwarder in forwarders:
+                    forwarder.send(data)
+            if nbytes < header_size:  # At least a complete header to get the packet_id
+                continue
+            # The version first: the packet_id and sizes of other game versions can't be read with this game file's layout
+            mismatch = False
+            for offset, expected in header_checks:  # Compared straight against the buffer, nothing is unpacked
+                if not receive_buffer.startswith(expected, offset):
+                    mismatch = True
+                    break
+            if mismatch:
+                self.version_mismatch(receive_buffer)
+                continue
+            if byte_packet_id:
+                packet_id = receive_buffer[packet_id_offset]
+            else:
+                packet_id = self.packet_id_unpack_from(receive_buffer, packet_id_offset)[0]
+            if capture is not None:
+                capture.write(packet_id, memoryview(receive_buffer)[:nbytes])  # Every packet of the game version is captured, not just the used ones
+            packet = packet_table[packet_id] if packet_id < table_size else None
+            if packet is None:
+                continue  # Skip packets that aren't in the packets list before doing anything else with them
+            if nbytes < packet['size']:
+                diagnostics.warning("Packet %s from %s is %s bytes, expected at least %s", packet_id, name, nbytes, packet['size'])
+                continue
+            receive_buffer, latest_buffers[packet_id] = latest_buffers[packet_id], receive_buffer
+            latest_sizes[packet_id] = nbytes
+            if arrivals is not None:
+                arrivals[(name, packet_id)] = time.perf_counter()
+        self.receive_buffer = receive_buffer
+
+        self.stats["datagrams"] += received
+        self.stats["drains"] += 1
+        return bool(latest_sizes)
+
+    # Store the newest raw packet of each id from the last drain, the compiled effect inputs only unpack the fields they use
+    def publish(self, telemetry):
+        for packet_id, nbytes in self.latest_sizes.items():
+            telemetry[(self.name, packet_id)] = memoryview(self.latest_buffers[packet_id])[:nbytes]
+
+    def close(self):
+        self.sock.close()
+        for forwarder in self.forwarders:
+            forwarder.close()
+
+
+class TelemetryHub:
+    def __init__(self, glob_data):
+        self.glob_data = glob_data
+        self.changes = deque()  # (name, TelemetrySource or None to remove) waiting for the hub thread, deque appends/pops are thread safe
+        self.stop_signal = processing.StopSignal()  # Also wakes the hub thread up for changes
+        self.receivers = {}  # name -> SourceReceiver, replaced as a whole by the hub thread so other threads can read it
+        self.thread = None
+
+    # Any thread: listen to a source, replacing the source with the same name if there is one. Setting the source that
+    # is already running changes nothing
+    def set_source(self, source):
+        self.changes.append((source.name, source))
+        self.stop_signal.wake()
+
+    # Any thread: stop listening to a source. The effects using its fields stop getting data
+    def remove_source(self, name):
+        self.changes.append((name, None))
+        self.stop_signal.wake()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Any thread: {(source name, target): (datagrams sent, datagrams dropped)} for every forwarding target
+    def forward_counts(self):
+        return {(name, forwarder.target): (forwarder.sent, forwarder.dropped)
+                for name, receiver in self.receivers.items() for forwarder in receiver.forwarders}
+
+    # Stop the hub thread and close every socket. Returns False if the thread didn't stop within timeout seconds
+    def stop(self, timeout=5):
+        self.stop_signal.set()  # Wakes the thread up straight away
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+            return not self.thread.is_alive()
+        return True
+
+    # Hub thread: open and close the sockets of the sources that were set or removed
+    def apply_changes(self, selector):
+        telemetry = self.glob_data.telemetry
+        receivers = dict(self.receivers)
+        while self.changes:
+            name, source = self.changes.popleft()
+            if name in receivers and receivers[name].source == source:
+                continue  # Already listening like this, the socket and the telemetry it received are kept
+            receiver = receivers.pop(name, None)
+            if receiver is not None:
+                selector.unregister(receiver.sock)
+                receiver.close()
+                with self.glob_data.lock:  # Effects using this source's fields get no data until it's back
+                    for key in [key for key in telemetry if key[0] == name]:
+                        del telemetry[key]
+                diagnostics.info("Stopped listening to %s on %s:%s", name, receiver.source.host, receiver.port)
+            if source is None:
+                continue
+            try:
+                receiver = SourceReceiver(source, self.glob_data.processing_stats)
+            except (OSError, ValueError, ImportError) as e:
+                diagnostics.warning("Telemetry source %s could not be started: %s", name, e)
+                continue
+            selector.register(receiver.sock, selectors.EVENT_READ, receiver)
+            receivers[name] = receiver
+            diagnostics.info("Listening to %s (%s) on %s:%s", name, source.game_file, source.host, receiver.port)
+            if source.forward:
+                diagnostics.info("Forwarding %s to %s", name, ", ".join(source.forward))
+        self.receivers = receivers
+
+    def run(self):
+        glob_data = self.glob_data
+        stop_signal = self.stop_signal
+        selector = selectors.DefaultSelector()
+        selector.register(stop_signal, selectors.EVENT_READ, None)
+        pause_deadline = None  # When to silence the effects if no more data arrives, None while paused
+        effect_states = {}  # Per-effect state owned by this thread
+        arrivals = {}  # (source, packet_id) -> perf_counter arrival time of the packets used in this update, while measuring latency
+        updated = []  # Receivers that got used packets in this wake up
+
+        # Block until data arrives, a timer runs out, the sources change or a stop is requested
+        try:
+            self.apply_changes(selector)
+            while not stop_signal.is_set():
+                timeout = max(0, pause_deadline - time.monotonic()) if pause_deadline is not None else None
+                events = selector.select(timeout)
+                if stop_signal.is_set():
+                    break
+                now = time.monotonic()
+                capture = glob_data.capture  # CaptureWriter while the telemetry is being captured
+                latency = glob_data.latency  # LatencyMonitor while latency is being measured
+                arrivals.clear()
+                updated.clear()
+                changed = False
+                for key, _ in events:
+                    receiver = key.data
+                    if receiver is None:
+                        changed = True  # Woken up by set_source() or remove_source()
+                    elif receiver.drain(capture if receiver.name == processing.primary_source else None,
+                                        arrivals if latency is not None else None):
+                        updated.append(receiver)
+
+                if updated:  # Effects are updated once per wake up, with only the newest packet of each id
+                    with glob_data.lock:
+                        for receiver in updated:
+                            receiver.publish(glob_data.telemetry)
+                    processing.update_effects(glob_data, effect_states, now)
+                    if latency is not None and arrivals:
+                        params = glob_data.params
+                        latency.record_apply(arrivals.values(), params.published_at[params.front])
+                    pause_deadline = now + processing.pause_timeout
+                elif pause_deadline is not None and now >= pause_deadline:
+                    diagnostics.info("game paused")
+                    processing.silence_effects(glob_data)
+                    pause_deadline = None
+                if changed:  # After the reads, so no socket is closed while its events are being handled
+                    stop_signal.clear()
+                    self.apply_changes(selector)
+        finally: # Close the sockets before exiting the function
+            for receiver in self.receivers.values():
+                receiver.close()
+            selector.close()
+            stop_signal.close()
+            diagnostics.info("Closed the sockets")
@@ -0,0 +1,75 @@
+import time
+import numpy as np
+
+# Opt-in latency measurements, from a datagram arriving to the audio that uses it reaching the DAC.
+# While glob_data.latency holds a LatencyMonitor:
+#   - the processing thread stamps every datagram it keeps on arrival, and records receive -> apply once the effects
+#     using it are published
+#   - the audio callback records apply -> DAC for the first buffer that plays each published set of amplitudes, using
+#     time_info.outputBufferDacTime, plus how long the callback took and the underruns reported in status
+# All times are time.perf_counter() seconds. Each series keeps the latest values in a fixed ring, so recording never
+# allocates and the GUI works out the percentiles from a copy
+
+window = 4096  # Latest measurements kept per series
+
+
+# Rolling window of measurements. Only one thread adds to a series, the GUI reads a copy
+class LatencySeries:
+    def __init__(self, size=window):
+        self.values = np.zeros(size)
+        self.count = 0  # Measurements added so far, only grows
+
+    def add(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    # (p50, p95, p99) of the window, None if nothing was measured yet
+    def percentiles(self):
+        values = self.values[:min(self.count, len(self.values))].copy()
+        if not len(values):
+            return None
+        return tuple(np.percentile(values, (50, 95, 99)))
+
+
+class LatencyMonitor:
+    def __init__(self):
+        self.receive_apply = LatencySeries()  # Datagram arrival -> amplitudes published, processing thread
+        self.apply_dac = LatencySeries()  # Amplitudes published -> first buffer using them at the DAC, audio callback
+        self.callback_duration = LatencySeries()  # Time spent in the audio callback
+        self.callback_budget = 0.0  # Length of one buffer in seconds, the callback has to finish well within this
+        self.callbacks = 0
+        self.underruns = 0  # Buffers the audio device ran out of data on
+        self.last_sequence = -1  # Parameter block sequence that apply -> DAC was last measured for
+
+    # Processing thread: the amplitudes computed from datagrams that arrived at arrivals were published at applied
+    def record_apply(self, arrivals, applied):
+        for arrival in arrivals:
+            self.receive_apply.add(applied - arrival)
+
+    # Audio callback: called at the end of the callback with the perf_counter time it started
+    def record_callback(self, started, frames, samplerate, time_info, status, sequence, published):
+        now = time.perf_counter()
+        self.callbacks += 1
+        if status.output_underflow:
+            self.underruns += 1
+        self.callback_budget = frames / samplerate
+        self.callback_duration.add(now - started)
+        if sequence != self.last_sequence and published:
+            self.last_sequence = sequence
+            # The DAC time is on the stream clock, move it onto the perf_counter clock via the stream's current time.
+            # Some host APIs report 0 for both, the buffer is then taken to play straight away
+            dac_delay = max(0.0, time_info.outputBufferDacTime - time_info.currentTime)
+            self.apply_dac.add(started + dac_delay - published)
+
+    # Text summary in milliseconds, for the GUI and the console
+    def summary(self):
+        lines = []
+        for label, series in (("receive->apply", self.receive_apply), ("apply->DAC", self.apply_dac), ("callback", self.callback_duration)):
+            percentiles = series.percentiles()
+            if percentiles is None:
+                lines.append(f"{label}: no data")
+            else:
+                lines.append(f"{label}: p50 {percentiles[0] * 1000:.2f} p95 {percentiles[1] * 1000:.2f} p99 {percentiles[2] * 1000:.2f} ms")
+        lines[-1] += f" (budget {self.callback_budget * 1000:.2f} ms)"
+        lines.append(f"underruns: {self.underruns} in {self.callbacks} buffers")
+        return "\n".join(lines)
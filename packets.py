@@ -0,0 +1,283 @@
+import re
+import struct
+from collections import namedtuple
+import numpy as np
+
+# This module builds lookup tables from the packet definitions in the game files, so fields can be found without searching lists.
+# It also turns the packet definitions into NumPy structured dtypes for zero-copy and bulk decoding
+
+# Where a telemetry field lives in its packet
+FieldLocation = namedtuple('FieldLocation', [
+    'packet_id',
+    'offset',  # byte offset of the field (of the first car for per-car fields)
+    'code',  # struct format of the field including the byte order, e.g. '<f' or '<H'
+    'stride',  # bytes between cars for per-car fields, 0 otherwise
+    'item',  # index of the field in the unpacked packet tuple (of the first car for per-car fields)
+    'item_stride'  # items between cars in the unpacked packet tuple, 0 otherwise
+])
+
+format_token = re.compile(r'(\d*)([xcbB?hHiIlLqQefd])')
+
+
+# Split a struct format string into (byte offset, struct format) for every value it unpacks to
+def format_items(format):
+    byte_order = format[0]
+    if byte_order not in '<>!=':
+        raise ValueError(f"Packet format '{format}' must start with an explicit byte order, e.g. '<'")
+    body = format[1:]
+    if format_token.sub('', body):
+        raise ValueError(f"Unsupported struct codes in packet format '{format}'")
+
+    items = []
+    offset = 0
+    for count, code in format_token.findall(body):
+        count = int(count) if count else 1
+        size = struct.calcsize(byte_order + code)
+        if code == 'x':  # Padding bytes don't produce values
+            offset += count * size
+            continue
+        for _ in range(count):
+            items.append((offset, byte_order + code))
+            offset += size
+    return items
+
+
+# Declarative packet definitions: a game file lists its fields as (name, struct code) pairs and these build the format
+# string, size and field list, so nothing has to be counted or kept in step by hand
+
+# Definition of a block of fields, e.g. a header or the data of one car
+def struct_schema(fields, byte_order='<'):
+    format = byte_order + ''.join(code for _, code in fields)
+    return {"format": format, "size": struct.calcsize(format), "fields": [name for name, _ in fields]}
+
+
+# The same field for each of several suffixes, e.g. one per wheel
+def field_group(name, code, suffixes):
+    return [(name + suffix, code) for suffix in suffixes]
+
+
+# Definition of a packet: the header, then fields, then optionally car_data repeated num_cars times, then trailer fields.
+# Per-car fields are read for the player car, see build_game_index()
+def packet_schema(packet_id, header, fields=(), car_data=None, num_cars=0, trailer=()):
+    byte_order = header["format"][0]
+    format = header["format"] + struct_schema(fields, byte_order)["format"][1:]
+    names = header["fields"] + [name for name, _ in fields]
+    if car_data is not None:
+        format += car_data["format"][1:] * num_cars
+        names += car_data["fields"] * num_cars
+    format += struct_schema(trailer, byte_order)["format"][1:]
+    names += [name for name, _ in trailer]
+    packet = {"id": packet_id, "format": format, "size": struct.calcsize(format), "fields": names}
+    if car_data is not None:
+        packet["car_data"] = car_data
+        packet["num_cars"] = num_cars
+    return packet
+
+
+# Work out the location of every field in a packet. Fields that appear more than once keep their first location
+def packet_field_locations(packet):
+    items = format_items(packet['format'])
+    fields = packet['fields']
+    if len(items) != len(fields):
+        raise ValueError(f"Packet {packet['id']} format has {len(items)} values but {len(fields)} field names")
+    if struct.calcsize(packet['format']) != packet['size']:
+        raise ValueError(f"Packet {packet['id']} format is {struct.calcsize(packet['format'])} bytes but size is {packet['size']}")
+
+    # Packets with one block of data per car declare it with 'car_data' and 'num_cars'
+    car_fields = packet['car_data']['fields'] if 'car_data' in packet else []
+    car_start = None
+    if car_fields:
+        for i in range(len(fields) - len(car_fields) + 1):
+            if fields[i:i + len(car_fields)] == car_fields:
+                car_start = i
+                break
+        if car_start is None:
+            raise ValueError(f"Packet {packet['id']} declares car_data but its fields don't contain the car fields")
+
+    locations = {}
+    for i, (offset, code) in enumerate(items):
+        name = fields[i]
+        if name in locations:
+            continue
+        if car_start is not None and car_start <= i < car_start + len(car_fields):
+            locations[name] = FieldLocation(packet['id'], offset, code, packet['car_data']['size'], i, len(car_fields))
+        else:
+            locations[name] = FieldLocation(packet['id'], offset, code, 0, i, 0)
+    return locations
+
+
+# The header values the game file expects in every packet (its expected_header), as (offset, bytes) runs that are
+# compared straight against the raw packet. Fields next to each other are merged into one run
+def header_checks(game_file, header_locations):
+    runs = []
+    expected_header = getattr(game_file, 'expected_header', {})
+    for name, value in sorted(expected_header.items(), key=lambda item: header_locations[item[0]].offset):
+        location = header_locations[name]
+        data = struct.pack(location.code, value)
+        if runs and runs[-1][0] + len(runs[-1][1]) == location.offset:
+            runs[-1] = (runs[-1][0], runs[-1][1] + data)
+        else:
+            runs.append((location.offset, data))
+    return runs
+
+
+# Packet definitions indexed by packet id, None for the ids the game file doesn't use, so the packet of a datagram is
+# found with one list lookup. Covers every id a one byte packetId can have
+def packet_table(packets, packet_id_location):
+    size = max([packet_id + 1 for packet_id in packets] + [256 if struct.calcsize(packet_id_location.code) == 1 else 0])
+    table = [None] * size
+    for packet_id, packet in packets.items():
+        table[packet_id] = packet
+    return table
+
+
+# Build the lookup tables for a game file. This is done once when the game file is loaded
+def build_game_index(game_file):
+    header_locations = packet_field_locations(dict(game_file.PacketHeader, id=None))
+    index = {
+        "packets": {},  # packet_id -> packet definition
+        "fields": {},  # field name -> FieldLocation
+        "packet_id": header_locations["packetId"],  # Location of the packetId in the header
+        "player_car": None,  # Location of the player car index in the header, for per-car fields
+        "player_car_field": None,  # Name of that header field
+        "dtypes": {},  # packet_id -> NumPy structured dtype
+        "packet_table": None,  # packet_id -> packet definition or None, see packet_table()
+        "header_checks": header_checks(game_file, header_locations),  # (offset, expected bytes) runs of the header
+        "header_version": [(name, header_locations[name]) for name in getattr(game_file, 'expected_header', {})],  # Checked fields, for reporting
+    }
+    player_car_field = getattr(game_file, 'player_car_field', None)
+    if player_car_field:
+        index["player_car"] = header_locations[player_car_field]
+        index["player_car_field"] = player_car_field
+
+    for packet in game_file.use_packets:
+        index["packets"][packet["id"]] = packet
+        index["dtypes"][packet["id"]] = packet_dtype(packet)
+        check_packet_dtype(packet, index["dtypes"][packet["id"]], check_pattern(packet['size']))
+        for name, location in packet_field_locations(packet).items():
+            if name not in index["fields"]:  # Fields from earlier packets take priority, e.g. the header fields
+                index["fields"][name] = location
+    index["packet_table"] = packet_table(index["packets"], index["packet_id"])
+    return index
+
+
+# Build a function that reads one field straight from the raw packet bytes, returns None if the player car is out of range.
+# Only this field is unpacked, so reading a couple of fields from the 1352 byte car telemetry packet stays cheap
+def field_reader(field_name, index):
+    location = index["fields"][field_name]
+    unpack_from = struct.Struct(location.code).unpack_from
+    offset = location.offset
+    if not location.stride:
+        return lambda data: unpack_from(data, offset)[0]
+
+    stride = location.stride
+    player_unpack_from = struct.Struct(index["player_car"].code).unpack_from
+    player_offset = index["player_car"].offset
+    num_cars = index["packets"][location.packet_id]["num_cars"]
+
+    def read(data):
+        player_car_index = player_unpack_from(data, player_offset)[0]
+        if player_car_index >= num_cars:  # e.g. 255 while spectating
+            return None
+        return unpack_from(data, offset + player_car_index * stride)[0]
+    return read
+
+
+# NumPy type for each struct code, the byte order is added from the packet format
+numpy_codes = {
+    'c': 'S1', 'b': 'i1', 'B': 'u1', '?': '?', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+    'l': 'i4', 'L': 'u4', 'q': 'i8', 'Q': 'u8', 'e': 'f2', 'f': 'f4', 'd': 'f8'
+}
+
+
+# Build a NumPy structured dtype with the same layout as the packet format. The per-car block of packets with car_data
+# becomes a nested 'cars' array, so e.g. record['cars']['speed'] holds the speed of every car
+def packet_dtype(packet):
+    items = format_items(packet['format'])
+    fields = packet['fields']
+    if len(items) != len(fields):
+        raise ValueError(f"Packet {packet.get('id')} format has {len(items)} values but {len(fields)} field names")
+
+    car_fields = packet['car_data']['fields'] if 'car_data' in packet else []
+    names, formats, offsets = [], [], []
+    i = 0
+    while i < len(fields):
+        offset, code = items[i]
+        if car_fields and fields[i:i + len(car_fields)] == car_fields:  # Start of the per-car block
+            names.append('cars')
+            formats.append((packet_dtype(packet['car_data']), packet['num_cars']))
+            offsets.append(offset)
+            i += len(car_fields) * packet['num_cars']
+            continue
+        if fields[i] in names:
+            raise ValueError(f"Field {fields[i]} appears more than once in packet {packet.get('id')}")
+        names.append(fields[i])
+        formats.append(code[0] + numpy_codes[code[1]])
+        offsets.append(offset)
+        i += 1
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': packet['size']})
+
+
+# Zero-copy view of a single packet as a structured record, fields are read with record['speed'] etc.
+def packet_view(dtype, data):
+    return np.frombuffer(data, dtype=dtype, count=1)[0]
+
+
+decode_chunk_bytes = 1 << 20  # Packet bytes gathered per step in decode_many(), bounds the size of the byte index
+
+
+# Decode many packets of the same type at once, e.g. from a capture file. buffer holds the raw bytes and offsets is
+# where each packet starts. Returns a structured array with one record per packet.
+# The bytes are gathered straight into the result a chunk of packets at a time, so besides the result only an index
+# for decode_chunk_bytes of packet data is allocated
+def decode_many(dtype, buffer, offsets):
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    result = np.empty(len(offsets), dtype=dtype)
+    result_bytes = result.view(np.uint8).reshape(len(offsets), dtype.itemsize)
+    chunk = max(1, decode_chunk_bytes // dtype.itemsize)
+    byte_offsets = np.arange(dtype.itemsize)
+    index = np.empty((min(chunk, len(offsets)), dtype.itemsize), dtype=np.int64)
+    for start in range(0, len(offsets), chunk):
+        end = min(start + chunk, len(offsets))
+        np.add(offsets[start:end, None], byte_offsets, out=index[:end - start])
+        np.take(raw, index[:end - start], out=result_bytes[start:end])
+    return result
+
+
+# Decode a whole packet with struct, in the order of the packet fields. This is the reference the dtypes are checked against
+def decode_packet(packet, data):
+    return struct.unpack_from(packet['format'], data)
+
+
+# Flatten a structured record back into the order of the packet fields
+def flatten_record(record):
+    values = []
+    for name in record.dtype.names:
+        value = record[name]
+        if name == 'cars':
+            for car in value:
+                values.extend(flatten_record(car))
+        elif record.dtype[name].kind == 'S':
+            values.append(bytes(value).ljust(record.dtype[name].itemsize, b'\0'))  # NumPy strips trailing zero bytes
+        else:
+            values.append(value.item())
+    return values
+
+
+# Bytes with a different value at every nearby offset, so a field read from the wrong place decodes to a different value
+def check_pattern(size):
+    return bytes((i * 7 + 3) % 251 for i in range(size))
+
+
+# Check that the NumPy dtype decodes a packet to exactly the same values as the struct format. Raises ValueError on a mismatch.
+# build_game_index() runs this for every packet on check_pattern() bytes
+def check_packet_dtype(packet, dtype, data):
+    expected = decode_packet(packet, data)
+    decoded = flatten_record(packet_view(dtype, data))
+    if len(expected) != len(decoded):
+        raise ValueError(f"Packet {packet.get('id')} dtype decodes {len(decoded)} values, struct decodes {len(expected)}")
+    for i, (a, b) in enumerate(zip(expected, decoded)):
+        if a != b and not (a != a and b != b):  # NaN never equals itself, treat two NaNs as a match
+            raise ValueError(f"Packet {packet.get('id')} field {packet['fields'][i]} decodes to {b}, struct gives {a}")
+    return True
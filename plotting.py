@@ -0,0 +1,50 @@
+import numpy as np
+
+# This module draws the effect input plots. Each plot is a single canvas line whose coordinates are replaced with
+# coords() on every redraw, worked out with NumPy and reduced to at most two points per pixel column, so a redraw costs
+# the same however many samples are plotted. It only uses the canvas methods, so it can run on a stand-in canvas
+
+plot_points = 1000  # Latest values shown in each effect plot
+
+
+# Reduce values to the lowest and highest value in each of columns equal slices, keeping peaks that plain
+# subsampling would miss. Returns (x, y) with x the position of each point from 0 to 1
+def decimate_minmax(values, columns):
+    count = len(values)
+    if count <= 2 * columns:
+        return np.linspace(0, 1, count), values
+    starts = (np.arange(columns) * count) // columns
+    y = np.empty(2 * columns)
+    y[0::2] = np.minimum.reduceat(values, starts)
+    y[1::2] = np.maximum.reduceat(values, starts)
+    x = np.repeat(np.linspace(0, 1, columns), 2)
+    return x, y
+
+
+# One plot on a canvas: a single line item and the max label, both created once and then only updated
+class LinePlot:
+    def __init__(self, canvas, color="orange", padding=10):
+        self.canvas = canvas
+        self.padding = padding
+        self.line = canvas.create_line(0, 0, 0, 0, fill=color, width=3)
+        self.label = canvas.create_text(padding, padding, anchor="nw", text="", fill=color, font=("Roboto", 18))
+        self.label_value = None
+
+    # Redraw the line for values scaled between min_val and max_val
+    def draw(self, values, min_val, max_val):
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        padding = self.padding
+        if len(values) == 0 or width <= 2 * padding or height <= 2 * padding:
+            return  # Nothing to draw, or the canvas isn't laid out yet
+        range_val = max_val - min_val if max_val - min_val != 0 else 1
+
+        x, y = decimate_minmax(values, width - 2 * padding)
+        points = np.empty(2 * max(len(x), 2))  # A line needs two points, a single value is repeated into a dot
+        points[0::2] = padding + x * (width - 2 * padding)
+        points[1::2] = height - padding - (y - min_val) / range_val * (height - 2 * padding)
+        self.canvas.coords(self.line, points.tolist())
+
+        if max_val != self.label_value:
+            self.canvas.itemconfigure(self.label, text=f"max: {max_val:.2f}")
+            self.label_value = max_val
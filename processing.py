@@ -1,160 +1,281 @@
 import socket
-import struct
-import logging
-import threading
-import time
+from collections import namedtuple
+import numpy as np
+import packets
+from diagnostics import diagnostics
 
 # This is the processing file for the telemetry data and effects
 
+# Compiled effect settings. These are built on the GUI thread from EffectFrame.get_data() whenever an effect is edited,
+# so neither the UDP thread nor the audio callback ever reads a Tk widget
+EffectSpec = namedtuple('EffectSpec', [
+    'name', 'effect_type', 'enabled',
+    'inputs',  # tuple of ((source, packet_id), reader) pairs, reader(data) returns the telemetry value from the raw packet
+    'fields',  # tuple of the telemetry field names of the inputs (source:field for other sources), in the same order
+    'process',  # function that turns the list of input values into a single input value
+    'min_input', 'max_input', 'min_amplitude', 'max_amplitude', 'output_expo',
+    # Trigger pulse envelope in seconds: ramp up over pulse_attack, hold for pulse_duration, ramp down over pulse_release,
+    # played pulse_repeats times with pulse_gap of silence in between
+    'pulse_attack', 'pulse_duration', 'pulse_release', 'pulse_repeats', 'pulse_gap',
+    # Audio settings, read by the audio callback
+    'frequency', 'waveform',
+    'channel_gains',  # tuple of (output channel index, gain) pairs, the effect plays on each of these channels
+    'transition_samples'  # samples to ramp to a new amplitude over, 0 to use the whole buffer
+])
+
+# Process methods, resolved once when the effect is compiled
+def process_max(input_vals):
+    return abs(max(input_vals, key=abs))
+
+def process_min(input_vals):
+    return abs(min(input_vals, key=abs))
+
+def process_average(input_vals):
+    return sum(abs(val) for val in input_vals) / len(input_vals)
+
+def process_change(input_vals):
+    return input_vals[0]  # Only one input value is expected
+
+process_methods = {
+    "max": process_max,
+    "min": process_min,
+    "average": process_average,
+    "change": process_change
+}
+
+# The same process methods for many updates at once, used by the offline renderer. input_vals is an (inputs x updates)
+# array with NaN where an input has no data yet, the result is NaN where no input has data
+def vector_max(input_vals):
+    return np.fmax.reduce(np.abs(input_vals), axis=0)
+
+def vector_min(input_vals):
+    return np.fmin.reduce(np.abs(input_vals), axis=0)
+
+def vector_average(input_vals):
+    with np.errstate(invalid='ignore'):  # 0 / 0 where no input has data gives NaN, as intended
+        return np.nansum(np.abs(input_vals), axis=0) / np.sum(~np.isnan(input_vals), axis=0)
+
+def vector_change(input_vals):
+    return input_vals[0]
+
+vector_process_methods = {
+    process_max: vector_max,
+    process_min: vector_min,
+    process_average: vector_average,
+    process_change: vector_change
+}
+
+
+# Turn a channel name like "channel_2" into its output index, -1 if no channel is selected
+def channel_index(channel):
+    if channel and channel.startswith("channel_") and channel[8:].isdigit():
+        return int(channel[8:]) - 1
+    return -1
+
+
+# Output routing of an effect as ((channel index, gain), ...). The "channel" setting plays at full gain and
+# "channel_gains" ({"channel_N": gain}) adds channels or changes their gain, so older settings files still load the same
+def channel_routing(effect_data):
+    gains = {}
+    channel = channel_index(effect_data.get("channel", ""))
+    if channel >= 0:
+        gains[channel] = 1.0
+    for channel_name, gain in (effect_data.get("channel_gains") or {}).items():
+        channel = channel_index(channel_name)
+        if channel < 0:
+            raise ValueError(f"Unknown output channel: {channel_name}")
+        gains[channel] = float(gain)
+    return tuple(sorted((channel, gain) for channel, gain in gains.items() if gain != 0))
+
+
+primary_source = "game"  # Source the selected game file listens on, its fields are used without a source: prefix
+
+
+# Split a telemetry input into (source name, field name, game index of the source). Fields of the game are used as they
+# are, fields of the other telemetry sources (see hub.py) are written source:field. sources maps the name of every other
+# source to its game index
+def resolve_field(field_name, game_index, sources):
+    source, _, field = field_name.rpartition(':')
+    if not source:
+        return primary_source, field, game_index
+    if source not in (sources or {}):
+        raise ValueError(f"Telemetry source {source} is not set up")
+    return source, field, sources[source]
+
+
+# Compile one effect from its settings data (same format as EffectFrame.get_data() and the saved settings files)
+# Raises ValueError if the settings are incomplete or invalid
+def compile_effect(effect_name, effect_data, game_index, sources=None):
+    effect_type = effect_data.get("effect_type", "range_effect")
+    if effect_type not in ("range_effect", "trigger_effect"):
+        raise ValueError(f"Unknown effect type: {effect_type}")
+
+    process_method = effect_data.get("process_method", "max" if effect_type == "range_effect" else "change")
+    if process_method not in process_methods:
+        raise ValueError(f"Unknown process method: {process_method}")
+
+    inputs = []
+    fields = []
+    for telemetry_input in effect_data.get("telemetry_inputs", []):
+        field_name = telemetry_input["field_name"]
+        if not field_name:
+            continue  # Input dropdown that hasn't been set yet
+        source, field, source_index = resolve_field(field_name, game_index, sources)
+        if field not in source_index["fields"]:
+            raise ValueError(f"Telemetry field {field_name} is not available for this game")
+        packet_id = source_index["fields"][field].packet_id
+        inputs.append(((source, packet_id), packets.field_reader(field, source_index)))
+        fields.append(field_name)
+
+    min_input = float(effect_data.get("min_input", 0))
+    max_input = float(effect_data.get("max_input", 0))
+    if effect_type == "range_effect" and max_input <= min_input:
+        raise ValueError(f"Max input must be larger than min input for effect {effect_name}")
+
+    return EffectSpec(
+        name=effect_name,
+        effect_type=effect_type,
+        enabled=bool(effect_data.get("effect_enabled", True)),
+        inputs=tuple(inputs),
+        fields=tuple(fields),
+        process=process_methods[process_method],
+        min_input=min_input,
+        max_input=max_input,
+        min_amplitude=float(effect_data.get("min_output_amplitude", 0)),
+        max_amplitude=float(effect_data.get("max_output_amplitude", 0)),
+        output_expo=float(effect_data.get("output_expo", 1)),
+        pulse_attack=float(effect_data.get("pulse_attack") or 0),
+        pulse_duration=float(effect_data.get("pulse_duration", 0)),
+        pulse_release=float(effect_data.get("pulse_release") or 0),
+        pulse_repeats=max(int(effect_data.get("pulse_repeats") or 1), 1),
+        pulse_gap=float(effect_data.get("pulse_gap") or 0),
+        frequency=float(effect_data.get("frequency", 0)),
+        waveform=effect_data.get("waveform", "sine"),
+        channel_gains=channel_routing(effect_data),
+        transition_samples=int(effect_data.get("transition_samples") or 0)
+    )
+
+
+# Compile every effect of a settings file (the format saved by the GUI), for running without the GUI
+def compile_settings(settings, game_index, sources=None):
+    return tuple(compile_effect(effect_name, effect_data, game_index, sources) for effect_name, effect_data in settings.get("effects", {}).items())
+
+
 # This is the amplitude calculation
-def amplitude_calc(effect, input): # Effect is the effect object, input is the telemetry value
-    min_input = float(effect.min_input_entry.get())
-    max_input = float(effect.max_input_entry.get())
-    min_amplitude = float(effect.min_amplitude_entry.get())
-    max_amplitude = float(effect.max_output_amplitude_slider.get())
-    output_expo = float(effect.output_expo.get())  # Get the exponent value
-    
-    normalized_input = max(0, min(1, (input - min_input) / (max_input - min_input)))
-    amplitude = (
-                    0 if input < min_input else
-                    min_amplitude + (max_amplitude - min_amplitude) * (normalized_input ** output_expo)
-                )
-    return amplitude
-
-
-# Trigger Effect Thread
-def trigger_effect_handler(input, effect_name, effect, glob_data):
-    print(f"pulseduration: {effect.pulse_duration_entry.get()}")
-    print(f"effect_name: {effect_name}")
-    with glob_data.lock:         
-        glob_data.audio[effect_name]['amplitude'] = effect.max_output_amplitude_slider.get() # Trigger the effect                  
-        glob_data.audio[effect_name]['prev_gear'] = input # Update prev_gear
-    
-    def reset_amplitude(effect_name):
-        with glob_data.lock:
-            glob_data.audio[effect_name]['amplitude'] = 0
-    threading.Timer(float(effect.pulse_duration_entry.get()), lambda: reset_amplitude(effect_name)).start()
-    
-    
-
-def effects_processing(app, glob_data, game_file):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    print('udp port is ', game_file.udp_port)
-    sock.bind(('localhost', game_file.udp_port))
-    sock.settimeout(0.01)  # non-blocking mode
-
-    def read_udp_data():
+def amplitude_calc(spec, input): # spec is the compiled EffectSpec, input is the telemetry value
+    if input < spec.min_input:
+        return 0
+    normalized_input = min(1, (input - spec.min_input) / (spec.max_input - spec.min_input))
+    return spec.min_amplitude + (spec.max_amplitude - spec.min_amplitude) * (normalized_input ** spec.output_expo)
+
+
+# amplitude_calc for an array of input values, NaN inputs give NaN
+def amplitude_curve(spec, inputs):
+    normalized_input = np.clip((inputs - spec.min_input) / (spec.max_input - spec.min_input), 0, 1)
+    amplitude = spec.min_amplitude + (spec.max_amplitude - spec.min_amplitude) * (normalized_input ** spec.output_expo)
+    return np.where(inputs < spec.min_input, 0, amplitude)
+
+
+# Trigger Effect. Queues a pulse for the audio engine, which plays its envelope sample by sample (see SynthEngine.trigger)
+def trigger_effect_handler(input, spec, pulses, effect_state):
+    pulses.push(spec.name, spec.max_amplitude)
+    effect_state['prev_input'] = input # Update prev_gear
+
+
+# Work out the new amplitude of every effect from the latest telemetry and publish them to the audio callback.
+# effect_states holds per-effect state that only the processing thread uses, like the previous input of trigger effects
+def update_effects(glob_data, effect_states, now):
+    specs = glob_data.effect_specs  # Read the compiled effects once, the GUI swaps in a new tuple when anything is edited
+    telemetry = glob_data.telemetry
+    params = glob_data.params
+    field_values = {}  # Field values read in this update, for effects sharing a field and for the history
+    params.begin(specs)
+    for slot, spec in enumerate(specs):
+        if not spec.enabled: # Turn off the effect if effect_enabled is set to False
+            params.write(slot, 0)
+            continue
+        # Read the telemetry values using the compiled readers
+        input_vals = []
+        for field_name, (telemetry_key, reader) in zip(spec.fields, spec.inputs):
+            value = field_values.get(field_name)
+            if value is None:
+                packet_data = telemetry.get(telemetry_key)
+                if packet_data is None:
+                    diagnostics.warning("Telemetry data for source %s packet_id %s not found in glob_data.telemetry", *telemetry_key)
+                    continue
+                value = reader(packet_data)
+                if value is None:
+                    continue
+                field_values[field_name] = value
+            input_vals.append(value)
+
+        if not input_vals:
+            diagnostics.warning("No telemetry inputs found for effect %s", spec.name)
+            continue  # Skip processing this effect if no telemetry inputs are found
+
+        input = spec.process(input_vals)  # Use the process method to determine the input_value
+
+        if spec.effect_type == 'range_effect':
+            amplitude = amplitude_calc(spec, input) # Calculate the amplitude of the effect based on the input value
+            params.write(slot, amplitude)
+
+        elif spec.effect_type == 'trigger_effect':
+            params.write(slot, 0)  # Pulses are played by the audio engine, not through the amplitude
+            effect_state = effect_states.setdefault(spec.name, {'prev_input': input})
+            if effect_state['prev_input'] != input:
+                trigger_effect_handler(input, spec, glob_data.pulses, effect_state)
+    params.publish()
+    glob_data.history.append(now, field_values)  # For the plots, after publishing so the audio gets the update first
+
+
+pause_timeout = 0.1  # Effects are silenced after this many seconds without data
+
+
+# Stop request for the processing thread. It is backed by a socket pair so the selector in the telemetry hub
+# wakes up as soon as a stop is requested, instead of polling a flag. wake() wakes the selector without stopping it
+class StopSignal:
+    def __init__(self):
+        self.receive_socket, self.send_socket = socket.socketpair()
+        self.receive_socket.setblocking(False)
+        self.send_socket.setblocking(False)
+        self.stopped = False
+
+    def set(self):
+        self.stopped = True
         try:
-            data, _ = sock.recvfrom(2048)   # 2048 is the buffer size - adjustable based on expected packet size
-            if len(data) < game_file.PacketHeader['size']:  # At least a complete header to get the packet_id
-                return False
-            header = struct.unpack_from(game_file.PacketHeader['format'], data)
-            #print('player car index is ', header[5])
-            packet_id = header[game_file.PacketHeader['fields'].index('packetId')]
-            for packet in game_file.use_packets:
-                if packet["id"] == packet_id:
-                    #print('packet is, ', packet["id"])
-                    if len(data) < packet['size']:
-                        print('size error')
-                        return False
-                    packet_data = struct.unpack_from(packet['format'], data)
-                    
-                    #print(packet_data[10])
-                    with glob_data.lock:
-                        if packet_id not in glob_data.telemetry:
-                            glob_data.telemetry[packet_id] = {}
-                        glob_data.telemetry[packet_id] = packet_data  # Store the packet data in the shared state telemetry variable
-                    return True
-            return False  # Return false if packet_id is not in the packets list
-        except socket.timeout:
-            return False
-
-    def update_effects():
-        for effect_name, effect in app.effects.items():
-            if not effect.enable_var.get(): # Turn off the effect if effect_enabled is set to False
-                with glob_data.lock: # Update or create any variables required for the audio
-                    if effect_name not in glob_data.audio:
-                        glob_data.audio[effect_name] = {}
-                    glob_data.audio[effect_name]['amplitude'] = 0   
-                continue
-            # Read the telemetry values using the index
-            input_vals = []
-            for telemetry_input in effect.telemetry_inputs:
-                packet_id = glob_data.game_info['telemetry_options'].get(telemetry_input.get())
-                if packet_id in glob_data.telemetry:
-                    packet_data = glob_data.telemetry[packet_id]  # This is the data - now read what you want from it
-                    for packet in game_file.use_packets:
-                        if packet["id"] == packet_id:
-                            if 'custom_processing' in packet:
-                                input_vals.append(packet['custom_processing'](telemetry_input.get(), packet_data))  # run the custom processing function if there is one
-                            else:
-                                input_vals.append(packet_data[packet['fields'].index(telemetry_input.get())]) # get the field index and read from the packet - default behaviour
-                else:
-                    logging.warning(f"Telemetry data for packet_id {packet_id} not found in glob_data.telemetry")
-
-            if not input_vals:
-                logging.warning(f"No telemetry inputs found for effect {effect_name}")
-                continue  # Skip processing this effect if no telemetry inputs are found
-
-            # Use the process method to determine the input_value
-            if effect.process_method_dropdown.get() == 'max':
-                input = abs(max(input_vals, key=abs))
-            elif effect.process_method_dropdown.get() == 'min':
-                input = abs(min(input_vals, key=abs))
-            elif effect.process_method_dropdown.get() == 'average':
-                input = abs(sum(input_vals, key=abs)) / len(input_vals) if input_vals else 0
-            elif effect.process_method_dropdown.get() == 'change':
-                input = input_vals[0]  # Only one input value is expected
-            else:
-                raise ValueError(f"Unknown process method: {effect.process_method_dropdown.get()}")
-
-            
-            app.effects[effect_name].plot_data.append(input) # Append the input value to the plot_data list
-            
-            
-            if effect.effect_type == 'range_effect':
-                amplitude = amplitude_calc(effect, input) # Calculate the amplitude of the effect based on the input value
-
-                with glob_data.lock:
-                    if effect_name not in glob_data.audio:
-                        glob_data.audio[effect_name] = {}
-                    glob_data.audio[effect_name]['amplitude'] = amplitude
-
-                logging.debug(f"Effect {effect_name} amplitude updated to {amplitude}")
-
-            elif effect.effect_type == 'trigger_effect':
-                with glob_data.lock:
-                    if effect_name not in glob_data.audio:
-                        glob_data.audio[effect_name] = {}
-                    prev_gear = glob_data.audio[effect_name].setdefault('prev_gear', input) # Get the previous gear value, write input to it if it doesn't exist
-                
-                if prev_gear != input:      
-                    print("gear change triggered!")
-                    trigger_effect_handler(input, effect_name, effect, glob_data)
-        
-            else:
-                raise ValueError(f"Unknown effect type: {effect['type']}")
-
-    last_update_time = time.time()
-
-    # Loop forever unless the stop_thread flag is set to True
-    while glob_data.game_info["stop_thread"] == False:
-        if read_udp_data():
-            last_update_time = time.time()
-            update_effects()
-        else:
-            if time.time() - last_update_time > 0.1: # pause after 0.1 seconds of no data     
-                if any(glob_data.audio.get(effect_name, {}).get('amplitude', 0) != 0 for effect_name in app.effects.keys()): # Check if any effect is still active. I guess this makes sure that this only runs once
-                    print("game paused")
-                    with glob_data.lock:
-                        for effect_name in app.effects.keys():
-                            if effect_name not in glob_data.audio:
-                                glob_data.audio[effect_name] = {}
-                            glob_data.audio[effect_name]['amplitude'] = 0
-    
-    try: # Close the socket if it is still open, before exiting the function
-            sock.getsockname()  # Checks if the socket is still bound
-            sock.close()
-            print("Closed the socket")
-    except (NameError, OSError):
-        pass  # The socket is already closed or not defined
\ No newline at end of file
+            self.send_socket.send(b'\0')
+        except OSError:
+            pass  # Already closed by the processing thread
+
+    def wake(self):
+        try:
+            self.send_socket.send(b'\0')
+        except OSError:
+            pass  # Already closed, or so many wake ups pending that one more changes nothing
+
+    # Read the pending wake ups so the selector doesn't keep waking up for them
+    def clear(self):
+        try:
+            while self.receive_socket.recv(4096):
+                pass
+        except OSError:
+            pass  # Nothing left to read
+
+    def is_set(self):
+        return self.stopped
+
+    def fileno(self):  # Lets the selector wait on the signal like a socket
+        return self.receive_socket.fileno()
+
+    def close(self):
+        self.receive_socket.close()
+        self.send_socket.close()
+
+
+# Turn off every effect, used when the game stops sending data. Pulses already started play out
+def silence_effects(glob_data):
+    specs = glob_data.effect_specs
+    glob_data.params.begin(specs)
+    for slot in range(len(specs)):
+        glob_data.params.write(slot, 0)
+    glob_data.params.publish()
@@ -0,0 +1,97 @@
+import struct
+import threading
+import time
+import numpy as np
+
+# This module streams the audio output to a WAV file while recording.
+# The audio callback pushes each buffer into a preallocated ring and a writer thread streams it to disk, so memory use
+# stays the same however long the recording runs and the audio callback never waits on the disk
+
+ring_seconds = 10  # Audio the ring can hold if the disk falls behind, after that buffers are dropped
+writer_interval = 0.02  # How often the writer thread checks for new audio, in seconds
+
+junk_size = 28  # Space reserved after the RIFF header for the ds64 chunk, used if the file grows past 4 GB (RF64)
+fmt_offset = 12 + 8 + junk_size
+fact_offset = fmt_offset + 8 + 18
+data_offset = fact_offset + 8 + 4 + 8  # Start of the sample data, after the data chunk header
+
+
+# 32-bit float WAV header, data_size is the number of bytes of sample data. Files past 4 GB become RF64, with the real
+# sizes in the ds64 chunk that takes the place of the JUNK chunk
+def wav_header(num_channels, samplerate, data_size):
+    frames = data_size // (num_channels * 4)
+    riff_size = data_offset - 8 + data_size
+    if riff_size > 0xFFFFFFFF:
+        header = struct.pack('<4sI4s', b'RF64', 0xFFFFFFFF, b'WAVE')
+        header += struct.pack('<4sIQQQI', b'ds64', junk_size, riff_size, data_size, frames, 0)
+        riff_size = data_size = frames = 0xFFFFFFFF
+    else:
+        header = struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE')
+        header += struct.pack('<4sI', b'JUNK', junk_size) + bytes(junk_size)
+    header += struct.pack('<4sIHHIIHHH', b'fmt ', 18, 3, num_channels, samplerate,
+                          samplerate * num_channels * 4, num_channels * 4, 32, 0)  # 3 = IEEE float
+    header += struct.pack('<4sII', b'fact', 4, frames)
+    header += struct.pack('<4sI', b'data', data_size)
+    return header
+
+
+class StreamRecorder:
+    def __init__(self, filename, num_channels, samplerate):
+        self.filename = filename
+        self.num_channels = num_channels
+        self.samplerate = samplerate
+        self.ring = np.zeros((samplerate * ring_seconds, num_channels), dtype=np.float32)
+        # Frame counters that only grow: write_index is only changed by the audio callback, read_index only by the
+        # writer thread, so neither needs a lock
+        self.write_index = 0
+        self.read_index = 0
+        self.dropped_frames = 0  # Frames lost because the ring was full
+        self.stopping = False
+
+        self.file = open(filename, 'wb')
+        self.file.write(wav_header(num_channels, samplerate, 0))
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    # Called from the audio callback with each output buffer (frames x channels)
+    def push(self, block):
+        frames = len(block)
+        capacity = len(self.ring)
+        if self.stopping or block.shape[1] != self.num_channels or frames > capacity - (self.write_index - self.read_index):
+            self.dropped_frames += frames
+            return
+        start = self.write_index % capacity
+        first = min(frames, capacity - start)  # Frames that fit before the end of the ring, the rest wraps to the start
+        self.ring[start:start + first] = block[:first]
+        self.ring[:frames - first] = block[first:]
+        self.write_index += frames
+
+    # Stop recording. Returns straight away, the writer thread writes out what is left and finishes the file
+    def stop(self):
+        self.stopping = True
+
+    def writer(self):
+        capacity = len(self.ring)
+        while True:
+            stopping = self.stopping  # Read before write_index, so audio pushed before the stop is always written
+            write_index = self.write_index
+            if write_index == self.read_index:
+                if stopping:
+                    break
+                time.sleep(writer_interval)
+                continue
+            start = self.read_index % capacity
+            end = min(start + (write_index - self.read_index), capacity)  # Up to the end of the ring, the rest next time
+            self.file.write(memoryview(self.ring[start:end]))
+            self.read_index += end - start
+        self.finish()
+
+    # Write the final sizes into the header and close the file
+    def finish(self):
+        data_size = self.read_index * self.num_channels * 4
+        self.file.seek(0)
+        self.file.write(wav_header(self.num_channels, self.samplerate, data_size))
+        self.file.close()
+        if self.dropped_frames:
+            print(f"Recording dropped {self.dropped_frames} frames")
+        print(f"Recording saved to {self.filename}")
@@ -0,0 +1,208 @@
+import argparse
+import json
+import time
+import numpy as np
+import capture
+import game_files
+import hub
+import processing
+import recorder
+import synth
+
+# Renders the output of a settings file for a telemetry capture straight to a WAV file, without the GUI or an audio
+# device, so profiles can be previewed without a shaker connected and checked in CI.
+# The capture is worked through in windows of chunk_blocks buffers: the effect inputs of the datagrams in a window are
+# decoded in one go per packet type with the packet's NumPy dtype and the amplitudes are worked out for all of them at
+# once, so memory use doesn't grow with the length of the capture. The audio is rendered with the same SynthEngine as
+# the live output, one buffer at a time, with each buffer using the amplitudes the live processing would have published
+# by its start
+#
+#   python render.py example_settings/F1_23_example1.json session.slcap session.wav
+#   python render.py example_settings/F1_23_example1.json session.slcap session.wav --buffer 256 --channels 4
+
+chunk_blocks = 256  # Buffers rendered before each write to the file, and the length of the windows the capture is decoded in
+
+
+# Value at each of the times in at of a series sampled at times, initial before the first sample
+def latest(times, values, at, initial=np.nan):
+    positions = np.searchsorted(times, at, side='right') - 1
+    result = np.full(len(at), initial)
+    found = positions >= 0
+    result[found] = values[positions[found]]
+    return result
+
+
+# Replace NaN with the last value before it, like the live processing keeping an effect's amplitude while it has no data
+def fill_forward(values):
+    positions = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(positions, out=positions)
+    return values[positions]
+
+
+# Value of one telemetry field in every decoded datagram of its packet type, NaN where the player car is out of range
+def field_series(field_name, game_index, decoded):
+    location = game_index["fields"][field_name]
+    times, records = decoded[location.packet_id]
+    if not location.stride:
+        return times, records[field_name].astype(np.float64)
+    values = np.full(len(records), np.nan)
+    player_car_index = records[game_index["player_car_field"]].astype(np.int64)
+    valid = np.flatnonzero(player_car_index < game_index["packets"][location.packet_id]["num_cars"])
+    values[valid] = records['cars'][field_name][valid, player_car_index[valid]]
+    return times, values
+
+
+# Works out what one effect does, one window of the capture at a time. The latest value of each input and the last
+# processed input are carried over from the earlier windows, so the windows give the same result as the whole capture
+class EffectTimeline:
+    def __init__(self, spec, game_index):
+        self.spec = spec
+        self.game_index = game_index
+        self.input_values = np.full(len(spec.fields), np.nan)  # Latest value of each input
+        self.last_input = np.nan  # Last processed input, NaN until there is one
+        self.last_change = -np.inf  # Time of the last amplitude change of a range effect, and the amplitude from then
+        self.last_amplitude = np.nan
+
+    # The effect during one window, decoded holds the window's datagrams by packet_id (see CaptureReader.decode).
+    # Returns the times the amplitude changes and the amplitude from each of those times for range effects, starting
+    # with the last change before the window, or the times pulses are triggered and None for trigger effects
+    def window(self, decoded):
+        spec = self.spec
+        series = [field_series(field_name, self.game_index, decoded) for field_name in spec.fields]
+        if not series:
+            return np.zeros(0), np.zeros(0)
+        # The effect is updated whenever a packet with one of its inputs arrives, using the latest value of every input
+        update_times = np.unique(np.concatenate([times for times, _ in series]))
+        if len(update_times):
+            input_vals = np.array([latest(times, values, update_times, previous)
+                                   for (times, values), previous in zip(series, self.input_values)])
+            for i, (_, values) in enumerate(series):
+                if len(values):
+                    self.input_values[i] = values[-1]
+            processed = processing.vector_process_methods[spec.process](input_vals)
+        else:
+            processed = np.zeros(0)
+        inputs = fill_forward(np.concatenate(([self.last_input], processed)))  # Starts with the last window's input
+        self.last_input = inputs[-1]
+
+        if spec.effect_type == 'range_effect':
+            times = np.concatenate(([self.last_change], update_times))
+            values = np.concatenate(([self.last_amplitude], processing.amplitude_curve(spec, inputs[1:])))
+            self.last_change, self.last_amplitude = times[-1], values[-1]
+            return times, values
+        changed = (inputs[1:] != inputs[:-1]) & ~np.isnan(inputs[:-1])  # The first value only sets the previous input
+        return update_times[changed], None
+
+
+# Amplitude of every effect at the start of each buffer, (effects x buffers), from the timelines of the window the
+# buffers are in. datagram_times holds the arrival of every game datagram of the window, after the last one before it.
+# Effects are silenced during gaps in the data like the live processing does
+def block_amplitudes(specs, timelines, block_times, datagram_times):
+    amplitudes = np.zeros((len(specs), len(block_times)))
+    last_datagram = latest(datagram_times, datagram_times, block_times)
+    receiving = block_times - last_datagram <= processing.pause_timeout  # False before the first datagram too, as it is -inf
+    for slot, (spec, (times, values)) in enumerate(zip(specs, timelines)):
+        if not spec.enabled or not len(times):
+            continue
+        if values is not None:  # Trigger effects only play pulses, see pulse_blocks()
+            amplitudes[slot] = np.nan_to_num(latest(times, values, block_times))
+    amplitudes[:, ~receiving] = 0
+    return amplitudes
+
+
+# The pulses of the trigger effects as {buffer number: [(effect name, amplitude), ...]}. Live, a pulse starts at the
+# first audio buffer after the packet that triggered it arrived
+def pulse_blocks(specs, timelines, buffer_size):
+    block_starts = {}
+    for spec, (times, values) in zip(specs, timelines):
+        if values is not None or not spec.enabled:
+            continue
+        for block in np.ceil(times * synth.samplerate / buffer_size).astype(np.int64):
+            block_starts.setdefault(int(block), []).append((spec.name, spec.max_amplitude))
+    return block_starts
+
+
+# The capture only holds the game's telemetry, so the inputs of the other telemetry sources of the settings are left out
+# of the effects, like live when such a source sends nothing. Effects with only such inputs stay silent
+def game_inputs_only(specs):
+    result = []
+    for spec in specs:
+        kept = [index for index, ((source, _), _) in enumerate(spec.inputs) if source == processing.primary_source]
+        if len(kept) < len(spec.inputs):
+            print(f"Effect {spec.name}: inputs of other telemetry sources than the game are left out, the capture only has the game's telemetry")
+            spec = spec._replace(inputs=tuple(spec.inputs[index] for index in kept), fields=tuple(spec.fields[index] for index in kept))
+        result.append(spec)
+    return tuple(result)
+
+
+# Render the effects of a settings file for a capture into a 32-bit float WAV file.
+# Returns the number of seconds of audio written
+def render(settings, reader, output, buffer_size=128, num_channels=None):
+    game_name = reader.game_file or settings.get("game_file")
+    if not game_name:
+        raise ValueError("The capture has no game file and neither do the settings")
+    game_index = game_files.game_index(game_name)
+    specs = game_inputs_only(processing.compile_settings(settings, game_index, hub.source_indexes(hub.settings_sources(settings))))
+    if num_channels is None:
+        num_channels = max([2] + [channel + 1 for spec in specs for channel, _ in spec.channel_gains])
+
+    packet_ids = {packet_id for spec in specs for (_, packet_id), _ in spec.inputs}  # Packet types the effects read from
+    timelines = [EffectTimeline(spec, game_index) for spec in specs]
+    last_datagram = -np.inf  # Arrival of the last game datagram before the window
+    pulses = {}  # Pulses of the trigger effects by buffer number, for the buffers not rendered yet
+
+    engine = synth.SynthEngine(buffer_size, num_channels, max_effects=max(len(specs), 1))
+    engine.configure(specs)
+    n = len(engine.slots)
+    total_blocks = int(np.ceil(reader.duration() * synth.samplerate / buffer_size))
+    chunk = np.zeros((chunk_blocks * buffer_size, num_channels), dtype=np.float32)
+    with open(output, 'wb') as file:
+        file.write(recorder.wav_header(num_channels, synth.samplerate, 0))
+        stop = 0
+        for first_block in range(0, total_blocks, chunk_blocks):
+            blocks = min(chunk_blocks, total_blocks - first_block)
+            block_times = (first_block + np.arange(blocks)) * buffer_size / synth.samplerate
+
+            # Decode the datagrams that arrived before the start of the next chunk, all datagrams of a type at once
+            start, stop = stop, reader.seek((first_block + chunk_blocks) * buffer_size / synth.samplerate)
+            decoded = {packet_id: reader.decode(packet_id, game_index["dtypes"][packet_id], start, stop) for packet_id in packet_ids}
+            windows = [timeline.window(decoded) for timeline in timelines]
+            for block, block_pulses in pulse_blocks(specs, windows, buffer_size).items():
+                pulses.setdefault(block, []).extend(block_pulses)
+            entries = reader.index[start:stop]
+            datagram_times = entries['time'][np.isin(entries['packet_id'], list(game_index["packets"]))] / 1e9
+            datagram_times = np.concatenate(([last_datagram], datagram_times))
+            last_datagram = datagram_times[-1]
+
+            amplitudes = block_amplitudes(specs, windows, block_times, datagram_times)
+            for block in range(blocks):
+                engine.amplitude[:n] = amplitudes[:n, block]
+                for pulse in pulses.pop(first_block + block, ()):
+                    engine.trigger(*pulse)
+                engine.render(chunk[block * buffer_size:(block + 1) * buffer_size])
+            file.write(memoryview(chunk[:blocks * buffer_size]))
+        file.seek(0)
+        file.write(recorder.wav_header(num_channels, synth.samplerate, total_blocks * buffer_size * num_channels * 4))
+    return total_blocks * buffer_size / synth.samplerate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the output of a ShakeLab settings file for a telemetry capture to a WAV file")
+    parser.add_argument("settings", help="settings file saved from the GUI")
+    parser.add_argument("capture", help="capture file recorded with the Capture button")
+    parser.add_argument("output", help="WAV file to write")
+    parser.add_argument("--buffer", type=int, default=128, help="audio buffer size in frames, as set in the GUI")
+    parser.add_argument("--channels", type=int, help="output channels, defaults to the highest channel the effects use (at least 2)")
+    args = parser.parse_args()
+
+    with open(args.settings) as file:
+        settings = json.load(file)
+    begin = time.perf_counter()
+    with capture.CaptureReader(args.capture) as reader:
+        seconds = render(settings, reader, args.output, args.buffer, args.channels)
+    elapsed = time.perf_counter() - begin
+    print(f"Rendered {seconds:.1f} s of audio to {args.output} in {elapsed:.2f} s ({seconds / max(elapsed, 1e-9):.0f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
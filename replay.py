@@ -0,0 +1,122 @@
+import argparse
+import json
+import socket
+import time
+import capture
+import game_files
+
+# Replays a telemetry capture to the game's UDP port, as a stand-in for the game.
+# Runs at the captured timing, scaled by --speed, or as fast as possible with --speed 0. With --settings the effects
+# processing runs in this process without the GUI, and the processed datagram rate is reported
+#
+#   python replay.py session.slcap
+#   python replay.py session.slcap --speed 4 --loop
+#   python replay.py session.slcap --speed 0 --settings example_settings/F1_23_example1.json
+
+spin_time = 0.001  # The last part of each wait is spent spinning, sleep() is too coarse for packet timing
+
+
+# Wait until a time.perf_counter() time
+def wait_until(target):
+    remaining = target - time.perf_counter()
+    if remaining > spin_time:
+        time.sleep(remaining - spin_time)
+    while time.perf_counter() < target:
+        pass
+
+
+# Send every record of the capture from start, keeping the captured timing scaled by speed (0 for as fast as possible).
+# Returns (datagrams sent, seconds taken, latest a datagram was sent in seconds)
+def replay(reader, sock, address, speed=1.0, start=0.0):
+    first = reader.seek(start)
+    sent = 0
+    max_late = 0.0
+    begin = time.perf_counter()
+    first_time = None
+    for record_time, packet_id, data in reader.records(first):
+        if first_time is None:
+            first_time = record_time
+        if speed > 0:
+            target = begin + (record_time - first_time) / speed
+            wait_until(target)
+            max_late = max(max_late, time.perf_counter() - target)
+        try:
+            sock.sendto(data, address)
+            sent += 1
+        except (BlockingIOError, ConnectionResetError):
+            pass  # Receiver not keeping up or not listening, carry on like the game would
+    return sent, time.perf_counter() - begin, max_late
+
+
+# Run the effects processing in this process, with the effects and telemetry sources of a settings file
+def start_processing(settings_path, game_name):
+    import hub
+    import processing
+    from globdata import glob_data
+
+    with open(settings_path) as file:
+        settings = json.load(file)
+    sources = hub.settings_sources(settings)
+    glob_data.effect_specs = processing.compile_settings(settings, game_files.game_index(game_name), hub.source_indexes(sources))
+    telemetry_hub = hub.TelemetryHub(glob_data)
+    telemetry_hub.set_source(hub.TelemetrySource(processing.primary_source, game_name, forward=hub.settings_forward(settings)))
+    for source in sources:
+        telemetry_hub.set_source(source)
+    telemetry_hub.start()
+    time.sleep(0.1)  # Let the thread bind the sockets
+    return telemetry_hub, glob_data.processing_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a ShakeLab telemetry capture over UDP")
+    parser.add_argument("capture", help="capture file recorded with the Capture button")
+    parser.add_argument("--host", default="127.0.0.1", help="where to send the datagrams")
+    parser.add_argument("--port", type=int, help="UDP port, defaults to the port of the captured game")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 sends as fast as possible")
+    parser.add_argument("--start", type=float, default=0.0, help="start this many seconds into the capture")
+    parser.add_argument("--loop", action="store_true", help="keep replaying until interrupted")
+    parser.add_argument("--settings", help="also run the effects processing headless with this settings file")
+    args = parser.parse_args()
+
+    with capture.CaptureReader(args.capture) as reader:
+        game_file = game_files.load_game(reader.game_file) if reader.game_file else None
+        port = args.port or reader.udp_port or (game_file.udp_port if game_file else None)
+        if not port:
+            parser.error("the capture has no UDP port, use --port")
+        print(f"Replaying {len(reader)} datagrams ({reader.duration():.1f} s) from {args.capture} to {args.host}:{port}")
+
+        telemetry_hub = None
+        if args.settings:
+            if game_file is None:
+                parser.error("the capture has no game file, --settings can't be used")
+            telemetry_hub, stats = start_processing(args.settings, reader.game_file)
+            stats_before = dict(stats)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        try:
+            while True:
+                sent, elapsed, max_late = replay(reader, sock, (args.host, port), args.speed, args.start)
+                print(f"Sent {sent} datagrams in {elapsed:.2f} s ({sent / max(elapsed, 1e-9):.0f}/s), latest send {max_late * 1000:.2f} ms")
+                if telemetry_hub is not None:
+                    time.sleep(0.2)  # Let the processing thread finish the last datagrams
+                    datagrams = stats["datagrams"] - stats_before["datagrams"]
+                    drains = stats["drains"] - stats_before["drains"]
+                    mismatched = stats["mismatched"] - stats_before["mismatched"]
+                    print(f"Processed {datagrams} datagrams ({datagrams / max(elapsed, 1e-9):.0f}/s) in {drains} effect updates, {sent - datagrams} lost, "
+                          f"{mismatched} from another game version")
+                    for (source, target), (forwarded, dropped) in telemetry_hub.forward_counts().items():
+                        print(f"Forwarded {forwarded} datagrams from {source} to {target}, {dropped} dropped")
+                    stats_before = dict(stats)
+                if not args.loop:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+            if telemetry_hub is not None:
+                telemetry_hub.stop()
+
+
+if __name__ == "__main__":
+    main()
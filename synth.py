@@ -0,0 +1,363 @@
+import numpy as np
+
+# This module holds the synthesis engine used by the audio callback. It only depends on NumPy, so it can also run without
+# an audio device. All effects are rendered together in one (effects x frames) array using preallocated buffers.
+# Rendering a buffer allocates nothing: NumPy ufuncs allocate an iteration buffer whenever an operand is broadcast or
+# has to be cast, so per-effect values are first spread over a whole scratch array with np.copyto (which doesn't), every
+# ufunc then works on arrays of the same shape and dtype, constants are 0-d arrays, and the views of the active rows
+# are made once in bind() instead of being sliced in every callback
+
+samplerate = 48000
+table_size = 4096  # Samples per waveform in the wavetable
+waveforms = ["sine", "square", "triangle", "noise"]  # Waveforms an effect can use, in the order they are stored in the wavetable
+
+
+# Build the table store: one row per waveform with one extra sample on the end (a copy of the first) so interpolation
+# never has to wrap, plus the slope to the next sample for linear interpolation
+def build_wavetables():
+    position = np.arange(table_size) / table_size  # Phase of each table sample, 0 -> 1
+    tables = np.zeros((len(waveforms), table_size + 1))
+    tables[0, :-1] = np.sin(2 * np.pi * position)
+    tables[1, :-1] = np.where(position < 0.5, 1.0, -1.0)
+    tables[2, :-1] = 1 - 4 * np.abs(position - 0.5)
+    tables[2, :-1] = np.roll(tables[2, :-1], -table_size // 4)  # Start at 0 going up, like the sine
+    tables[3, :-1] = np.random.default_rng(0).uniform(-1, 1, table_size)
+    tables[:, -1] = tables[:, 0]
+    slopes = np.zeros_like(tables)
+    slopes[:, :-1] = np.diff(tables, axis=1)
+    return tables.ravel(), slopes.ravel()
+
+
+wavetables, wavetable_slopes = build_wavetables()
+
+
+# Per-effect audio settings, one row each in SynthConfig.settings and SynthEngine.settings:
+#   increment      phase increment per sample in cycles, frequency / samplerate
+#   table_offset   start of the effect's waveform in the wavetable store, a whole number
+#   transition     amplitude ramp length in samples, 0 for the whole buffer
+#   pulse_period   from the start of one pulse repeat to the next, in samples like the rest of the pulse envelope
+#   pulse_rise     attack + 1, the envelope rises by 1 / pulse_rise per sample
+#   pulse_fall     release + 1, the envelope falls by 1 / pulse_fall per sample
+#   pulse_end      end of the release within a repeat
+#   pulse_length   end of the last repeat
+setting_names = ('increment', 'table_offset', 'transition', 'pulse_period', 'pulse_rise', 'pulse_fall', 'pulse_end', 'pulse_length')
+# Per-effect state that moves to the effect's new row when the effects change, one row each in SynthEngine.state:
+#   amplitude        amplitude for this buffer
+#   prev_amplitude   amplitude at the end of the last buffer, ramped from to avoid clicks
+#   prev_increment   increment of the last buffer, ramped from so the phase stays continuous
+#   phase            phase at the start of the next buffer, in cycles 0 -> 1
+#   pulse_start      clock at the start of the running pulse
+#   pulse_amplitude  peak amplitude of the running pulse, 0 if none is running
+state_names = ('amplitude', 'prev_amplitude', 'prev_increment', 'phase', 'pulse_start', 'pulse_amplitude')
+
+
+# The audio settings of a tuple of compiled effect specs as slot arrays, slot i plays specs[i]. Built off the audio
+# thread (ParameterBlock.begin() builds one on the processing thread when the specs change), so loading one into the
+# engine is only a few array copies. previous is the config the engine most likely has loaded, the rows its effects move
+# to are worked out here as well
+class SynthConfig:
+    def __init__(self, specs, max_effects, previous=None):
+        specs = specs[:max_effects]
+        self.names = tuple(spec.name for spec in specs)
+        self.slots = {name: row for row, name in enumerate(self.names)}  # effect name -> row
+        self.active = min(max(len(specs), 2), max_effects)  # Rows render() works on, see SynthEngine.bind()
+        self.audio = tuple(audio_settings(spec) for spec in specs)  # To tell if a new config changes anything
+        self.settings = np.zeros((len(setting_names), max_effects))
+        for index, name in enumerate(setting_names):
+            setattr(self, name, self.settings[index])
+        self.gains = np.zeros((max_effects, max([channel + 1 for spec in specs for channel, _ in spec.channel_gains] + [1])))
+        for row, spec in enumerate(specs):
+            self.increment[row] = spec.frequency / samplerate
+            self.table_offset[row] = waveforms.index(spec.waveform) * (table_size + 1) if spec.waveform in waveforms else 0
+            for channel, gain in spec.channel_gains:
+                self.gains[row, channel] = gain
+            self.transition[row] = spec.transition_samples
+            attack = round(spec.pulse_attack * samplerate)
+            hold = round(spec.pulse_duration * samplerate)
+            release = round(spec.pulse_release * samplerate)
+            self.pulse_period[row] = max(attack + hold + release + round(spec.pulse_gap * samplerate), 1)
+            self.pulse_rise[row] = attack + 1  # Reaches 1 at the end of the attack, straight away without one
+            self.pulse_fall[row] = release + 1  # Falls from 1 to 0 over the release, straight to 0 without one
+            self.pulse_end[row] = attack + hold + release
+            self.pulse_length[row] = self.pulse_period[row] * spec.pulse_repeats
+        self.pulse_period[len(specs):] = 1  # Unused rows still get divided by
+        self.pulse_rise[len(specs):] = 1
+        self.pulse_fall[len(specs):] = 1
+
+        self.previous = previous
+        self.rows = self.moved_rows(previous.slots if previous is not None else {}, max_effects)
+        if previous is not None:
+            previous.previous = None  # Only the latest step is kept, so old configs can be freed
+
+    # For each row, the column of SynthEngine.state the state comes from: the row the effect had in a config with these
+    # slots, or the last column, which is always 0, for new effects and unused rows
+    def moved_rows(self, slots, max_effects):
+        rows = np.full(max_effects + 1, max_effects, dtype=np.int64)
+        for row, name in enumerate(self.names):
+            if name in slots:
+                rows[row] = slots[name]
+        return rows
+
+
+# The config of specs, or previous itself if it plays the same effects in the same slots with the same audio settings,
+# so edits the audio doesn't use (like the max output) give the engine nothing to load
+def synth_config(specs, max_effects, previous):
+    specs = specs[:max_effects]
+    if tuple(spec.name for spec in specs) == previous.names and tuple(audio_settings(spec) for spec in specs) == previous.audio:
+        return previous
+    return SynthConfig(specs, max_effects, previous)
+
+
+# The spec fields the audio engine uses
+def audio_settings(spec):
+    return (spec.frequency, spec.waveform, spec.channel_gains, spec.transition_samples, spec.pulse_attack,
+            spec.pulse_duration, spec.pulse_release, spec.pulse_gap, spec.pulse_repeats)
+
+
+class SynthEngine:
+    def __init__(self, frames, num_channels=2, max_effects=64):
+        self.num_channels = num_channels
+        self.max_effects = max_effects
+        self.config = SynthConfig((), max_effects)  # The config loaded, see apply()
+        self.slots = self.config.slots  # effect name -> row in the arrays below
+
+        # Per-effect state and settings, one column per slot. Their rows are views named after state_names and
+        # setting_names, so a new config is loaded with one copy of each. The state has an extra column that is always 0
+        self.state = np.zeros((len(state_names), max_effects + 1))
+        for index, name in enumerate(state_names):
+            setattr(self, name, self.state[index, :max_effects])
+        self.moved = np.zeros_like(self.state)  # Scratch for moving the state to new rows
+        self.settings = self.config.settings.copy()
+        for index, name in enumerate(setting_names):
+            setattr(self, name, self.settings[index])
+        self.gains = np.zeros((max_effects, num_channels))  # How much of each effect goes to each channel
+        self.gains_columns = [self.gains[:, :columns] for columns in range(num_channels + 1)]  # For configs using fewer channels
+        self.delta = np.zeros(max_effects)  # Scratch for differences between this and the last buffer
+        self.silent = np.zeros(max_effects, dtype=bool)  # Scratch, the effects that were silent in the last buffer
+        self.ramp_step = np.zeros(max_effects)  # Scratch for the amplitude ramps: samples to reach 1, at least 1
+        self.ramp_step_column = self.ramp_step[:, None]
+        self.ramp_mask = np.zeros(max_effects, dtype=bool)  # Scratch, the effects with a transition shorter than the buffer
+        self.ramp_mask_scratch = np.zeros(max_effects, dtype=bool)
+        self.ramp_weight = np.zeros(max_effects)  # ramp_mask as 1 and 0, and the other way round
+        self.ramp_weight_column = self.ramp_weight[:, None]
+        self.ramp_other = np.zeros(max_effects)
+        self.ramp_other_column = self.ramp_other[:, None]
+        self.mix_gains_store = np.zeros(num_channels * max_effects)  # Holds the contiguous (channels x effects) gains for np.dot
+
+        # Trigger pulses, timed in samples so their length doesn't depend on the buffer size. Sample counts are kept as
+        # float64, which holds whole numbers exactly for far longer than any session
+        self.clock = 0.0  # Samples rendered so far
+        self.clock_value = np.zeros(())  # The clock as a 0-d array for the pulse envelopes
+        self.pulse_scratch = np.zeros(max_effects)
+
+        # Constants as 0-d arrays, a Python number would be converted to an array in every ufunc call
+        self.zero = np.zeros(())
+        self.one = np.ones(())
+        self.minus_one = np.full((), -1.0)
+        self.table_length = np.full((), float(table_size))
+        self.frames_value = np.zeros(())  # The buffer size as a 0-d array
+        self.allocate(frames)
+
+    # (Re)allocate the scratch buffers for a buffer size. Only happens when the buffer size changes
+    def allocate(self, frames):
+        self.frames = frames
+        self.frames_float = float(frames)  # Added to the clock, adding an int to a float makes a new object
+        self.frames_value[()] = frames
+        self.ramp = np.linspace(0, 1, frames)  # 0 -> 1 across the buffer, scaled into the frequency ramp
+        self.ramp_sum = np.cumsum(self.ramp)  # Running sum of the ramp, how far the frequency ramp has moved the phase
+        self.sample_index = np.arange(frames, dtype=np.float64)
+        self.ramps = np.zeros((self.max_effects, frames))  # 0 -> 1 over each effect's transition, scaled into the amplitude ramp
+        self.signals = np.zeros((self.max_effects, frames))
+        self.envelopes = np.zeros((self.max_effects, frames))
+        self.phases = np.zeros((self.max_effects, frames))
+        self.fractions = np.zeros((self.max_effects, frames))
+        self.scratch = np.zeros((self.max_effects, frames))  # Per-effect values spread over the buffer
+        self.indices = np.zeros((self.max_effects, frames), dtype=np.int64)
+        self.pulse_time = np.zeros((self.max_effects, frames))
+        self.pulse_envelope = np.zeros((self.max_effects, frames))
+        self.mix = np.zeros((self.num_channels, frames))
+        self.mix_t = self.mix.T  # (frames x channels) like the output buffer
+        self.update_ramps()
+        self.bind()
+
+    # Make the views of the active rows used by render(). Called when the effects or the buffer size change
+    # At least two rows are used: NumPy allocates in in-place ufuncs on one-element arrays. The spare row has no gains,
+    # so it is never heard
+    def bind(self):
+        n = self.config.active
+        self.active = n
+        for name in ('amplitude', 'prev_amplitude', 'increment', 'prev_increment', 'phase', 'delta', 'pulse_amplitude',
+                     'pulse_start', 'pulse_length', 'pulse_scratch'):
+            setattr(self, name + '_rows', getattr(self, name)[:n])
+        for name in ('delta', 'prev_increment', 'phase', 'prev_amplitude', 'table_offset', 'pulse_amplitude',
+                     'pulse_period', 'pulse_rise', 'pulse_fall', 'pulse_end', 'pulse_length', 'pulse_scratch'):
+            setattr(self, name + '_column', getattr(self, name)[:n, None])
+        for name in ('signals', 'envelopes', 'phases', 'fractions', 'scratch', 'indices', 'ramps', 'pulse_time', 'pulse_envelope'):
+            setattr(self, name + '_rows', getattr(self, name)[:n])
+        self.phases_last = self.phases[:n, -1]  # Phase of the last sample of each effect
+        self.pulse_time_last = self.pulse_time[:n, -1]
+        self.gains_t = self.gains[:n].T
+        self.mix_gains = self.mix_gains_store[:self.num_channels * n].reshape(self.num_channels, n)  # Contiguous so np.dot doesn't copy it
+        np.copyto(self.mix_gains, self.gains_t)
+
+    # Load a config, keeping the state of the effects that were already playing (in their new rows). Only array copies,
+    # the config did the per-effect work, so this can run in the audio callback. Nothing is done for the config that is
+    # already loaded
+    def apply(self, config):
+        if config is self.config:
+            return
+        rows = config.rows if config.previous is self.config else config.moved_rows(self.slots, self.max_effects)  # Else the config it was built after never got loaded
+        self.state.take(rows, axis=1, out=self.moved, mode='clip')
+        np.copyto(self.state, self.moved)
+        np.copyto(self.settings, config.settings)
+        self.gains.fill(0)
+        columns = config.gains.shape[1]
+        if columns <= self.num_channels:
+            np.copyto(self.gains_columns[columns], config.gains)
+        else:  # Channels the device doesn't have are left out
+            np.copyto(self.gains, config.gains[:, :self.num_channels])
+        np.equal(self.prev_amplitude, self.zero, out=self.silent)  # Nothing audible to glide from, start at the new frequency
+        np.putmask(self.prev_increment, self.silent, self.increment)
+        self.config = config
+        self.slots = config.slots
+        self.update_ramps()
+        if config.active != self.active:
+            self.bind()
+        else:
+            np.copyto(self.mix_gains, self.gains_t)
+
+    # Load the audio settings of compiled effect specs, slot i plays specs[i]. For the callers that have no config
+    def configure(self, specs):
+        self.apply(SynthConfig(specs, self.max_effects, self.config))
+
+    # Start a pulse of an effect at the first sample of the next buffer, replacing a pulse that is still running
+    def trigger(self, name, amplitude):
+        row = self.slots.get(name)
+        if row is not None:
+            self.pulse_start[row] = self.clock
+            self.pulse_amplitude[row] = amplitude
+
+    # Amplitude ramp of each effect: 0 -> 1 over its transition samples and then held, or across the whole buffer.
+    # Worked out for every row with the scratch arrays, so it doesn't allocate
+    def update_ramps(self):
+        np.subtract(self.transition, self.one, out=self.ramp_step)
+        np.maximum(self.ramp_step, self.one, out=self.ramp_step)
+        np.copyto(self.scratch, self.sample_index)
+        np.copyto(self.envelopes, self.ramp_step_column)
+        np.divide(self.scratch, self.envelopes, out=self.scratch)
+        np.minimum(self.scratch, self.one, out=self.scratch)
+        np.greater(self.transition, self.zero, out=self.ramp_mask)
+        np.less(self.transition, self.frames_value, out=self.ramp_mask_scratch)
+        np.logical_and(self.ramp_mask, self.ramp_mask_scratch, out=self.ramp_mask)
+        # Pick the rows by weighting with 1 and 0, np.copyto(where=) allocates. Exact, as x * 1 + y * 0 == x
+        np.copyto(self.ramp_weight, self.ramp_mask)
+        np.subtract(self.one, self.ramp_weight, out=self.ramp_other)
+        np.copyto(self.phases, self.ramp_weight_column)
+        self.scratch *= self.phases
+        np.copyto(self.phases, self.ramp_other_column)
+        np.copyto(self.envelopes, self.ramp)
+        self.envelopes *= self.phases
+        np.add(self.envelopes, self.scratch, out=self.ramps)
+
+    # Phase accumulator oscillators: the increment ramps from the last buffer's frequency to the new one, so a frequency
+    # change never jumps the phase. Summed per sample, the phase of sample k is
+    #   phase + k * prev_increment + (increment - prev_increment) * ramp_sum[k]
+    def oscillators(self):
+        phases, scratch, fractions = self.phases_rows, self.scratch_rows, self.fractions_rows
+        np.subtract(self.increment_rows, self.prev_increment_rows, out=self.delta_rows)
+        np.copyto(phases, self.ramp_sum)
+        np.copyto(scratch, self.delta_column)
+        phases *= scratch
+        np.copyto(fractions, self.sample_index)
+        np.copyto(scratch, self.prev_increment_column)
+        fractions *= scratch
+        phases += fractions
+        np.copyto(scratch, self.phase_column)
+        phases += scratch
+        np.add(self.phases_last, self.increment_rows, out=self.phase_rows)  # Start phase of the next buffer
+        np.mod(self.phase_rows, self.one, out=self.phase_rows)
+        np.copyto(self.prev_increment_rows, self.increment_rows)
+
+        # Wavetable lookup with linear interpolation. The waveform's start in the store is a whole number, so it is added
+        # before splitting the position into the table index and the fraction between two samples
+        np.mod(phases, self.one, out=phases)
+        phases *= self.table_length
+        np.copyto(scratch, self.table_offset_column)
+        phases += scratch
+        np.floor(phases, out=fractions)
+        np.copyto(self.indices_rows, fractions, casting='unsafe')
+        np.subtract(phases, fractions, out=fractions)
+        signals = self.signals_rows
+        wavetables.take(self.indices_rows, out=signals, mode='clip')  # np.take() and mode='raise' copy through a temporary
+        wavetable_slopes.take(self.indices_rows, out=phases, mode='clip')  # Reuse phases as scratch for the slopes
+        phases *= fractions
+        signals += phases
+        return signals
+
+    # Add the envelopes of the running pulses to the amplitude envelopes: linear attack, hold, linear release, then
+    # silence until the next repeat. Effects without a running pulse have a pulse amplitude of 0 and add nothing.
+    # Ends the pulses whose last repeat is done
+    def pulses(self, envelopes):
+        time, envelope, scratch, phase = self.pulse_time_rows, self.pulse_envelope_rows, self.scratch_rows, self.fractions_rows
+        self.clock_value[()] = self.clock
+        np.subtract(self.clock_value, self.pulse_start_rows, out=self.pulse_scratch_rows)
+        np.copyto(time, self.sample_index)
+        np.copyto(scratch, self.pulse_scratch_column)
+        time += scratch  # Samples since the pulse started
+        np.copyto(scratch, self.pulse_period_column)
+        np.mod(time, scratch, out=phase)  # Samples since the start of the repeat
+        np.add(phase, self.one, out=envelope)
+        np.copyto(scratch, self.pulse_rise_column)
+        envelope /= scratch
+        np.copyto(scratch, self.pulse_end_column)
+        scratch -= phase
+        np.copyto(self.phases_rows, self.pulse_fall_column)
+        scratch /= self.phases_rows
+        np.minimum(envelope, scratch, out=envelope)
+        np.maximum(envelope, self.zero, out=envelope)
+        np.minimum(envelope, self.one, out=envelope)
+        # Silence after the last repeat: pulse_length - time is 1 or more while playing and 0 or less after, as both are
+        # whole numbers
+        np.copyto(scratch, self.pulse_length_column)
+        scratch -= time
+        np.maximum(scratch, self.zero, out=scratch)
+        np.minimum(scratch, self.one, out=scratch)
+        envelope *= scratch
+        np.copyto(scratch, self.pulse_amplitude_column)
+        envelope *= scratch
+        envelopes += envelope
+
+        # Keep the pulse amplitude while the last sample of the next buffer is still before the end, same trick as above
+        np.subtract(self.pulse_length_rows, self.pulse_time_last, out=self.pulse_scratch_rows)
+        self.pulse_scratch_rows -= self.one
+        np.maximum(self.pulse_scratch_rows, self.zero, out=self.pulse_scratch_rows)
+        np.minimum(self.pulse_scratch_rows, self.one, out=self.pulse_scratch_rows)
+        self.pulse_amplitude_rows *= self.pulse_scratch_rows
+
+    # Render one buffer of all effects into outdata (frames x channels). Callers that already know the buffer size pass
+    # it as frames, reading it from outdata.shape makes a new int object for sizes over 256
+    def render(self, outdata, frames=None):
+        if frames is None:
+            frames = outdata.shape[0]
+        if frames != self.frames:
+            self.allocate(frames)
+        signals = self.oscillators()
+
+        # Gradual transition from the previous amplitude to the new one
+        envelopes = self.envelopes_rows
+        np.subtract(self.amplitude_rows, self.prev_amplitude_rows, out=self.delta_rows)
+        np.copyto(envelopes, self.delta_column)
+        envelopes *= self.ramps_rows
+        np.copyto(self.scratch_rows, self.prev_amplitude_column)
+        envelopes += self.scratch_rows
+        if np.count_nonzero(self.pulse_amplitude_rows):
+            self.pulses(envelopes)
+        signals *= envelopes
+        np.copyto(self.prev_amplitude_rows, self.amplitude_rows)
+
+        # Mix the effects into the channels and protect against clipping
+        np.dot(self.mix_gains, signals, out=self.mix)
+        np.minimum(self.mix, self.one, out=self.mix)
+        np.maximum(self.mix, self.minus_one, out=self.mix)
+        np.copyto(outdata, self.mix_t, casting='same_kind')
+        self.clock += self.frames_float
@@ -0,0 +1,88 @@
+import os
+import struct
+import numpy as np
+import pytest
+import capture
+import game_files
+
+
+@pytest.fixture(scope="module")
+def game_index():
+    return game_files.game_index("f1_23")
+
+
+# A datagram of a packet with its packetId set and random bytes elsewhere
+def datagram(game_index, packet_id, rng):
+    packet = game_index["packets"][packet_id]
+    data = bytearray(rng.integers(0, 256, packet['size'], dtype=np.uint8).tobytes())
+    location = game_index["packet_id"]
+    struct.pack_into(location.code, data, location.offset, packet_id)
+    return bytes(data)
+
+
+# Write a capture of count datagrams cycling through a few packets. Returns the (packet_id, datagram) written
+def write_capture(path, game_index, count=30):
+    rng = np.random.default_rng(0)
+    written = [(packet_id, datagram(game_index, packet_id, rng)) for packet_id in [6, 13, 6] * (count // 3)]
+    writer = capture.CaptureWriter(path, "f1_23", 20777)
+    for packet_id, data in written:
+        writer.write(packet_id, data)
+    writer.stop()
+    writer.thread.join()
+    return written
+
+
+def test_round_trip(tmp_path, game_index):
+    path = str(tmp_path / "test.slcap")
+    written = write_capture(path, game_index)
+    with capture.CaptureReader(path) as reader:
+        assert reader.game_file == "f1_23"
+        assert reader.udp_port == 20777
+        assert len(reader) == len(written)
+        records = [(seconds, packet_id, bytes(data)) for seconds, packet_id, data in reader.records()]  # Copied, the views have to go before close()
+        assert [(packet_id, data) for _, packet_id, data in records] == written
+        times = [seconds for seconds, _, _ in records]
+        assert times == sorted(times)
+        assert reader.seek(times[5]) <= 5
+        assert list(reader.records_of(13)) == list(range(1, len(written), 3))
+
+        dtype = game_index["dtypes"][6]
+        decode_times, decoded = reader.decode(6, dtype)
+        assert len(decode_times) == len(decoded) == 2 * len(written) // 3
+        assert decoded.tobytes() == b"".join(data for packet_id, data in written if packet_id == 6)
+
+
+def test_index_is_rebuilt_when_missing(tmp_path, game_index):
+    path = str(tmp_path / "test.slcap")
+    write_capture(path, game_index)
+    with capture.CaptureReader(path) as reader:
+        expected = np.array(reader.index)
+    os.remove(capture.index_path(path))
+    with capture.CaptureReader(path) as reader:
+        assert np.array_equal(reader.index, expected)
+    assert os.path.exists(capture.index_path(path))
+
+
+def test_index_is_rebuilt_when_records_were_added(tmp_path, game_index):
+    path = str(tmp_path / "test.slcap")
+    written = write_capture(path, game_index)
+    data = datagram(game_index, 6, np.random.default_rng(1))
+    with open(path, 'ab') as file:  # A record the index doesn't have
+        file.write(capture.record_header.pack(10 ** 9, len(data)) + data)
+    with capture.CaptureReader(path) as reader:
+        assert len(reader) == len(written) + 1
+        assert bytes(reader.payload(len(written))) == data
+
+
+def test_record_cut_short_is_left_out(tmp_path, game_index):
+    path = str(tmp_path / "test.slcap")
+    written = write_capture(path, game_index)
+    with open(path, 'ab') as file:  # The capture wasn't stopped cleanly, the last record is only half written
+        file.write(capture.record_header.pack(10 ** 9, 100) + bytes(10))
+    os.remove(capture.index_path(path))
+    with capture.CaptureReader(path) as reader:
+        assert len(reader) == len(written)
+    index_time = os.path.getmtime(capture.index_path(path))
+    with capture.CaptureReader(path) as reader:  # The rebuilt index is kept, not rebuilt on every open
+        assert len(reader) == len(written)
+    assert os.path.getmtime(capture.index_path(path)) == index_time
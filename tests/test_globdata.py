@@ -0,0 +1,116 @@
+import numpy as np
+import globdata
+import processing
+
+
+def effect(name, **settings):
+    effect_data = {"effect_type": "trigger_effect", "frequency": 40, "channel": "channel_1"}
+    effect_data.update(settings)
+    return processing.compile_effect(name, effect_data, None)
+
+
+# Buffers that let the writer publish while the reader copies from them, as if it ran on another thread
+class PublishingBuffers(list):
+    def __init__(self, params, publishes):
+        super().__init__(params.buffers)
+        self.params = params
+        self.publishes = publishes
+
+    def __getitem__(self, index):
+        if self.publishes:
+            self.publishes -= 1
+            self.params.begin(self.params.specs[self.params.front])
+            self.params.write(0, self.params.sequence)
+            self.params.publish()
+        return super().__getitem__(index)
+
+
+def test_read_gets_the_published_amplitudes_and_config():
+    params = globdata.ParameterBlock(size=4)
+    specs = (effect("a"), effect("b"))
+    params.begin(specs)
+    params.write(0, 0.25)
+    params.write(1, 0.5)
+    params.write(9, 1.0)  # Past the last slot, ignored
+    out = np.zeros(4)
+    assert params.read(out) is params.configs[0]  # Nothing published yet
+    params.publish()
+
+    config = params.read(out)
+    assert list(out) == [0.25, 0.5, 0, 0]
+    assert config.names == ("a", "b")
+    assert params.read_sequence == params.sequence == 1
+
+    params.begin(specs)  # Same specs: the amplitudes carry on and the config is the same object
+    params.write(1, 0.75)
+    params.publish()
+    assert params.read(out) is config
+    assert list(out) == [0.25, 0.75, 0, 0]
+
+
+def test_read_copies_again_when_the_writer_publishes_during_the_copy():
+    params = globdata.ParameterBlock(size=4)
+    params.begin((effect("a"),))
+    params.write(0, 0.5)
+    params.publish()
+    out = np.zeros(4)
+
+    params.buffers = PublishingBuffers(params, publishes=1)
+    assert params.read(out) is not None  # The second copy is left alone
+    assert out[0] == params.sequence - 1  # The value written by that publish, the one the second copy read
+    assert params.read_sequence == params.sequence
+
+    out[:] = 0.125
+    params.buffers = PublishingBuffers(params, publishes=3)  # Publishing on every attempt
+    assert params.read(out) is None
+    assert np.all(out == 0.125)  # The previous values are kept
+
+
+def test_begin_moves_amplitudes_to_the_new_slots():
+    params = globdata.ParameterBlock(size=4)
+    params.begin((effect("a"), effect("b")))
+    params.write(0, 0.25)
+    params.write(1, 0.5)
+    params.publish()
+    before = params.configs[params.front]
+
+    params.begin((effect("b"), effect("c")))  # Recompiled: a removed, b moved to slot 0, c added
+    params.publish()
+    out = np.zeros(4)
+    config = params.read(out)
+    assert list(out) == [0.5, 0, 0, 0]
+    assert config.slots == {"b": 0, "c": 1}
+    assert config.previous is before
+    assert list(config.rows[:2]) == [1, 4]  # b's state comes from row 1, c starts from the zero column
+
+    params.begin((effect("b", max_output_amplitude=0.9), effect("c")))  # Nothing the audio uses changed
+    params.publish()
+    assert params.read(out) is config
+
+
+def test_pulse_queue_wraps_around():
+    queue = globdata.PulseQueue(capacity=4)
+    popped = []
+    for index in range(10):  # Through the ring twice and a half
+        queue.push(f"effect{index}", index / 10)
+        if index % 2:
+            popped.extend([queue.pop(), queue.pop()])
+    assert popped == [(f"effect{index}", index / 10) for index in range(10)]
+    assert queue.pop() is None
+    assert queue.dropped == 0
+
+
+def test_pulse_queue_drops_pulses_when_full():
+    queue = globdata.PulseQueue(capacity=4)
+    for index in range(6):
+        queue.push("effect", index)
+    assert queue.dropped == 2
+    assert [queue.pop()[1] for _ in range(4)] == [0, 1, 2, 3]  # The oldest are kept
+    assert queue.pop() is None
+
+    queue.push("effect", 6)
+    queue.push("effect", 7)
+    queue.clear()
+    assert queue.pop() is None
+    queue.push("effect", 8)
+    assert queue.pop() == ("effect", 8)
@@ -0,0 +1,66 @@
+import math
+import numpy as np
+import history
+
+
+def test_snapshot_is_oldest_first_after_wrapping():
+    field_history = history.FieldHistory(size=50)
+    for index in range(173):
+        field_history.append(index, index / 60, float(index))
+    end, times, lows, highs = field_history.snapshot(20)
+    assert end == 173
+    assert list(lows) == list(range(153, 173))
+    assert np.array_equal(lows, highs)  # The raw data has one value per entry
+    assert np.allclose(times, np.arange(153, 173) / 60)
+
+    _, _, lows, _ = field_history.snapshot(1000)  # Never more than the ring holds
+    assert len(lows) < 50
+    assert list(lows) == list(range(173 - len(lows), 173))
+
+
+def test_entries_overwritten_during_the_copy_are_dropped():
+    ring = history.Ring(10, 0, False)
+    for index in range(30):
+        ring.write(index, index, index, index)
+    # A reader that read the write index at 22 and copied after the writer got to 30 only keeps the entries still there
+    end, times, lows, highs = ring.snapshot(10, end=22)
+    assert end == 22
+    assert list(lows) == list(range(21, 22))
+
+
+def test_tiers_hold_the_lowest_and_highest_of_each_block():
+    field_history = history.FieldHistory(size=1000)
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-10, 10, 300)
+    values[5:15] = math.nan  # Only partly NaN blocks still have a low and a high
+    for index, value in enumerate(values):
+        field_history.append(index, float(index), value)
+
+    end, times, lows, highs = field_history.snapshot(1000, tier=1)
+    assert end == 300 // history.tier_factor
+    blocks = values.reshape(-1, history.tier_factor)
+    assert np.array_equal(lows, np.fmin.reduce(blocks, axis=1))
+    assert np.array_equal(highs, np.fmax.reduce(blocks, axis=1))
+    assert np.array_equal(times, np.arange(history.tier_factor - 1, 300, history.tier_factor))
+
+    _, _, lows, highs = field_history.snapshot(1000, tier=2)
+    assert len(lows) == 300 // history.tier_factor ** 2
+    assert lows[0] == np.fmin.reduce(values[:100]) and highs[0] == np.fmax.reduce(values[:100])
+
+
+def test_fields_are_aligned_by_update():
+    telemetry_history = history.TelemetryHistory(size=100)
+    telemetry_history.ensure(["speed"])
+    for update in range(30):
+        telemetry_history.append(update / 60, {"speed": float(update)})
+    telemetry_history.ensure(["speed", "rpm"])  # Added later, NaN before it was added
+    for update in range(30, 40):
+        telemetry_history.append(update / 60, {"speed": float(update), "rpm": 1000.0 + update})
+
+    end, times, lows, highs = telemetry_history.snapshot(["speed", "rpm"], 20)
+    assert end == 40
+    assert lows.shape == (2, 20)
+    assert list(lows[0]) == list(range(20, 40))
+    assert np.isnan(lows[1, :10]).all()
+    assert list(lows[1, 10:]) == [1000.0 + update for update in range(30, 40)]
+    assert telemetry_history.snapshot(["speed", "gear"], 20) is None
@@ -0,0 +1,141 @@
+import select
+import selectors
+import socket
+import struct
+import time
+import pytest
+import game_files
+import globdata
+import hub
+import processing
+
+
+@pytest.fixture(scope="module")
+def game_index():
+    return game_files.game_index("f1_23")
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def new_stats():
+    return {"datagrams": 0, "drains": 0, "mismatched": 0}
+
+
+# An F1 23 packet of one id with the header of the game version it is for
+def f1_23_packet(game_index, packet_id, size=None):
+    data = bytearray(size or game_index["packets"][packet_id]['size'])
+    struct.pack_into('<HB', data, 0, 2023, 23)
+    location = game_index["packet_id"]
+    struct.pack_into(location.code, data, location.offset, packet_id)
+    return bytes(data)
+
+
+# Send datagrams to a receiver and drain them once they have all arrived
+def send_and_drain(receiver, datagrams):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for data in datagrams:
+            sock.sendto(data, ('127.0.0.1', receiver.port))
+    select.select([receiver.sock], [], [], 1.0)
+    return receiver.drain(None, None)
+
+
+def test_packets_of_another_game_version_are_counted_as_mismatched(game_index):
+    stats = new_stats()
+    receiver = hub.SourceReceiver(hub.TelemetrySource(processing.primary_source, "f1_23", '127.0.0.1', free_port()), stats)
+    try:
+        f1_22 = bytearray(1347)  # Car telemetry in the F1 22 layout: shorter, with the packetId at offset 5
+        struct.pack_into('<HBBBBB', f1_22, 0, 2022, 22, 1, 0, 1, 6)
+        assert not send_and_drain(receiver, [bytes(f1_22)])
+        assert stats["mismatched"] == 1
+
+        assert send_and_drain(receiver, [f1_23_packet(game_index, 6)])
+        assert stats["mismatched"] == 1
+        assert stats["datagrams"] == 2
+    finally:
+        receiver.close()
+
+
+# A socket forwarded datagrams can be sent to
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    return sock
+
+
+def test_forwarder_counts_sent_and_dropped_datagrams():
+    with listener() as sock:
+        forwarder = hub.Forwarder(f"127.0.0.1:{sock.getsockname()[1]}")
+        try:
+            for index in range(3):
+                forwarder.send(bytes([index]) * 10)
+            assert [sock.recv(100) for _ in range(3)] == [bytes([index]) * 10 for index in range(3)]
+            assert (forwarder.sent, forwarder.dropped) == (3, 0)
+        finally:
+            forwarder.close()
+
+    forwarder = hub.Forwarder(f"127.0.0.1:{free_port()}")  # Nothing listens, the refusals come back from earlier sends
+    try:
+        attempts = 0
+        while not forwarder.dropped and attempts < 50:
+            forwarder.send(bytes(10))
+            attempts += 1
+            time.sleep(0.01)
+        assert forwarder.dropped
+        assert forwarder.sent + forwarder.dropped == attempts
+    finally:
+        forwarder.close()
+
+
+def test_forwarding_to_the_listening_port_is_rejected():
+    port = free_port()
+    for target in (f"localhost:{port}", f"127.0.0.1:{port}"):
+        with pytest.raises(ValueError):
+            hub.SourceReceiver(hub.TelemetrySource("rig", "f1_23", '127.0.0.1', port, (target,)), new_stats())
+    receiver = hub.SourceReceiver(hub.TelemetrySource("rig", "f1_23", '127.0.0.1', port), new_stats())  # The port was released
+    receiver.close()
+
+
+def test_every_datagram_is_forwarded_before_filtering(game_index):
+    with listener() as sock:
+        target = f"127.0.0.1:{sock.getsockname()[1]}"
+        receiver = hub.SourceReceiver(hub.TelemetrySource(processing.primary_source, "f1_23", '127.0.0.1', free_port(), (target,)), new_stats())
+        try:
+            f1_22 = bytearray(1347)
+            struct.pack_into('<HB', f1_22, 0, 2022, 22)
+            datagrams = [bytes(10),  # Shorter than the header
+                         bytes(f1_22),  # Another game version
+                         f1_23_packet(game_index, 2, size=100),  # A packet_id the game file has no layout for
+                         f1_23_packet(game_index, 6, size=100),  # Cut short
+                         f1_23_packet(game_index, 6)]
+            assert send_and_drain(receiver, datagrams)
+            assert [sock.recv(2048) for _ in datagrams] == datagrams
+            assert receiver.forwarders[0].sent == len(datagrams)
+        finally:
+            receiver.close()
+
+
+def test_setting_the_running_source_again_keeps_its_receiver():
+    telemetry_hub = hub.TelemetryHub(globdata.globdata())
+    selector = selectors.DefaultSelector()
+    source = hub.TelemetrySource("rig", "f1_23", '127.0.0.1', free_port())
+    try:
+        telemetry_hub.set_source(source)
+        telemetry_hub.apply_changes(selector)
+        receiver = telemetry_hub.receivers["rig"]
+        telemetry_hub.set_source(source)
+        telemetry_hub.apply_changes(selector)
+        assert telemetry_hub.receivers["rig"] is receiver
+
+        telemetry_hub.set_source(source._replace(port=free_port()))
+        telemetry_hub.apply_changes(selector)
+        assert telemetry_hub.receivers["rig"] is not receiver
+        assert receiver.sock.fileno() == -1  # The old socket was closed
+    finally:
+        for receiver in telemetry_hub.receivers.values():
+            receiver.close()
+        selector.close()
@@ -0,0 +1,62 @@
+import struct
+import numpy as np
+import pytest
+import game_files
+import packets
+
+
+@pytest.fixture(scope="module")
+def game_index():
+    return game_files.game_index("f1_23")
+
+
+def random_packet(packet, rng):
+    return rng.integers(0, 256, packet['size'], dtype=np.uint8).tobytes()
+
+
+def test_dtype_matches_struct_for_every_packet(game_index):
+    rng = np.random.default_rng(1)
+    for packet_id, packet in game_index["packets"].items():
+        dtype = game_index["dtypes"][packet_id]
+        assert dtype.itemsize == packet['size']
+        for _ in range(5):
+            assert packets.check_packet_dtype(packet, dtype, random_packet(packet, rng))
+
+
+def test_check_packet_dtype_catches_a_wrong_layout(game_index):
+    packet = game_index["packets"][13]
+    wrong = dict(packet, format=packet['format'][:-1] + 'i')  # Last field read as an int instead of a float
+    with pytest.raises(ValueError):
+        packets.check_packet_dtype(packet, packets.packet_dtype(wrong), packets.check_pattern(packet['size']))
+
+
+def test_field_reader_reads_the_player_car(game_index):
+    packet = game_index["packets"][6]
+    data = bytearray(packet['size'])
+    location = game_index["fields"]["speed"]
+    player = game_index["player_car"]
+    struct.pack_into(player.code, data, player.offset, 3)
+    struct.pack_into(location.code, data, location.offset + 3 * location.stride, 287)
+    assert packets.field_reader("speed", game_index)(data) == 287
+    struct.pack_into(player.code, data, player.offset, 255)  # Spectating
+    assert packets.field_reader("speed", game_index)(data) is None
+
+
+def test_decode_many_matches_packet_view(game_index, monkeypatch):
+    monkeypatch.setattr(packets, "decode_chunk_bytes", 4000)  # Several chunks, with a partial last one
+    dtype = game_index["dtypes"][6]
+    rng = np.random.default_rng(2)
+    buffer = rng.integers(0, 256, 40 * 1500, dtype=np.uint8).tobytes()
+    offsets = np.arange(40) * 1500 + rng.integers(0, 100, 40)
+    decoded = packets.decode_many(dtype, buffer, offsets)
+    assert len(decoded) == 40
+    for record, offset in zip(decoded, offsets):
+        assert record.tobytes() == buffer[offset:offset + dtype.itemsize]
+    assert len(packets.decode_many(dtype, buffer, offsets[:0])) == 0
+
+
+def test_packet_table_and_header_checks(game_index):
+    table = game_index["packet_table"]
+    assert len(table) == 256
+    assert {packet_id for packet_id, packet in enumerate(table) if packet is not None} == {6, 13}
+    assert game_index["header_checks"] == [(0, struct.pack('<HB', 2023, 23))]
@@ -0,0 +1,68 @@
+import json
+import os
+import struct
+import numpy as np
+import capture
+import game_files
+import recorder
+import render
+
+settings_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example_settings", "F1_23_example1.json")
+
+
+# Three seconds of 60 Hz telemetry with a gap in the middle and the player car index out of range at the end
+def write_capture(path):
+    game_index = game_files.game_index("f1_23")
+    rng = np.random.default_rng(0)
+    writer = capture.CaptureWriter(path, "f1_23", 20777)
+    for frame in range(180):
+        for packet_id, packet in game_index["packets"].items():
+            data = bytearray(rng.integers(0, 64, packet['size'], dtype=np.uint8).tobytes())  # Small bytes, so no float field is NaN
+            location = game_index["packet_id"]
+            struct.pack_into(location.code, data, location.offset, packet_id)
+            player = game_index["player_car"]
+            struct.pack_into(player.code, data, player.offset, 0 if frame < 150 else 255)
+            timestamp = int(frame * 1e9 / 60) + (500_000_000 if frame >= 90 else 0)
+            writer.pending.append((timestamp, packet_id, bytes(data)))
+    writer.stop()
+    writer.thread.join()
+
+
+def test_windows_give_the_same_audio_as_one_window(tmp_path, monkeypatch):
+    path = str(tmp_path / "test.slcap")
+    write_capture(path)
+    with open(settings_file) as file:
+        settings = json.load(file)
+
+    outputs = []
+    for blocks in (4096, 3):
+        monkeypatch.setattr(render, "chunk_blocks", blocks)
+        output = str(tmp_path / f"{blocks}.wav")
+        with capture.CaptureReader(path) as reader:
+            seconds = render.render(settings, reader, output, buffer_size=100)
+        with open(output, 'rb') as file:
+            outputs.append(file.read())
+    assert seconds > 3
+    assert outputs[0] == outputs[1]
+    assert np.frombuffer(outputs[0][recorder.data_offset:], dtype=np.float32).any()
+
+
+def test_inputs_of_other_sources_are_left_out(tmp_path, capsys):
+    path = str(tmp_path / "test.slcap")
+    write_capture(path)
+    with open(settings_file) as file:
+        settings = json.load(file)
+    game_only = json.loads(json.dumps(settings))
+    settings["sources"] = [{"name": "rig", "game_file": "f1_23", "port": 20800}]
+    settings["effects"]["effect1"]["telemetry_inputs"].append({"field_name": "rig:suspensionAccelerationFL"})
+    settings["effects"]["rig_only"] = dict(settings["effects"]["effect1"], telemetry_inputs=[{"field_name": "rig:speed"}])
+
+    outputs = []
+    for effects_settings in (settings, game_only):
+        output = str(tmp_path / "out.wav")
+        with capture.CaptureReader(path) as reader:
+            render.render(effects_settings, reader, output)
+        with open(output, 'rb') as file:
+            outputs.append(file.read())
+    assert outputs[0] == outputs[1]  # rig_only is silent and effect1 plays from its game inputs
+    assert "rig_only" in capsys.readouterr().out
@@ -0,0 +1,101 @@
+import math
+import numpy as np
+import processing
+import synth
+
+
+# Compile an effect with only the audio settings, a 0 Hz square wave plays a constant 1 so the output is the envelope
+def effect(name, **settings):
+    effect_data = {"effect_type": "trigger_effect", "frequency": 0, "waveform": "square", "channel": "channel_1"}
+    effect_data.update(settings)
+    return processing.compile_effect(name, effect_data, None)
+
+
+# Render buffers of frames samples and return all of them, one row per sample
+def render(engine, buffers, frames):
+    outdata = np.zeros((buffers * frames, engine.num_channels), dtype=np.float32)
+    for start in range(0, len(outdata), frames):
+        engine.render(outdata[start:start + frames])
+    return outdata
+
+
+def test_pulse_envelope_sample_counts():
+    attack, hold, release, gap = 10, 20, 5, 15  # In samples
+    spec = effect("pulse", pulse_attack=attack / synth.samplerate, pulse_duration=hold / synth.samplerate,
+                  pulse_release=release / synth.samplerate, pulse_gap=gap / synth.samplerate, pulse_repeats=3)
+    period = attack + hold + release + gap
+
+    outputs = []
+    for frames in (32, 256):  # Buffers of 32 samples cut through every part of the envelope
+        engine = synth.SynthEngine(frames, num_channels=2, max_effects=4)
+        engine.configure((spec,))
+        engine.trigger("pulse", 0.5)
+        outputs.append(render(engine, 256 // frames, frames)[:, 0])
+        assert engine.pulse_amplitude[0] == 0  # Ended after the last repeat
+    assert np.array_equal(outputs[0], outputs[1])
+
+    output = outputs[0]
+    assert np.allclose(output[:attack], 0.5 * np.arange(1, attack + 1) / (attack + 1))  # Rises, reaching 1 after the attack
+    assert np.all(output[attack:attack + hold] == 0.5)
+    falling = output[attack + hold:attack + hold + release]
+    assert np.allclose(falling, 0.5 * np.arange(release, 0, -1) / (release + 1))
+    assert np.all(output[attack + hold + release:period] == 0)  # The gap
+    assert np.array_equal(output[period:2 * period], output[:period])
+    assert np.array_equal(output[2 * period:3 * period], output[:period])
+    assert not output[3 * period:].any()
+
+
+def test_retrigger_restarts_the_pulse():
+    spec = effect("pulse", pulse_attack=0, pulse_duration=100 / synth.samplerate)
+    engine = synth.SynthEngine(64, num_channels=2, max_effects=4)
+    engine.configure((spec,))
+    engine.trigger("pulse", 0.5)
+    first = render(engine, 1, 64)[:, 0]
+    engine.trigger("pulse", 0.25)  # While the first pulse is still holding
+    second = render(engine, 2, 64)[:, 0]
+    assert np.all(first == 0.5)
+    assert np.all(second[:100] == 0.25)
+    assert not second[100:].any()
+
+
+def test_frequency_change_keeps_the_phase_continuous():
+    frames = 256
+    engine = synth.SynthEngine(frames, num_channels=2, max_effects=4)
+    engine.configure((effect("tone", frequency=100, waveform="sine"),))
+    engine.amplitude[0] = 1
+    render(engine, 2, frames)  # The amplitude has ramped up to 1 after the first buffer
+    phase = engine.phase[0]
+    assert 0.05 < phase < 0.45  # Far enough from 0 that a reset would show
+
+    engine.configure((effect("tone", frequency=200, waveform="sine"),))
+    assert engine.prev_increment[0] == 100 / synth.samplerate  # Glides from the old frequency
+    output = render(engine, 2, frames)[:, 0]
+    assert math.isclose(output[0], math.sin(2 * math.pi * phase), abs_tol=1e-4)
+    steps = np.abs(np.diff(output))
+    assert steps.max() <= 2 * math.pi * 200 / synth.samplerate * 1.01  # No jump anywhere, including the buffer boundary
+
+
+def test_silent_effect_starts_at_the_new_frequency():
+    engine = synth.SynthEngine(64, num_channels=2, max_effects=4)
+    engine.configure((effect("tone", frequency=100, waveform="sine"),))
+    render(engine, 1, 64)
+    engine.configure((effect("tone", frequency=200, waveform="sine"),))
+    assert engine.prev_increment[0] == engine.increment[0] == 200 / synth.samplerate
+
+
+def test_channel_gains_mix_the_effects():
+    specs = (effect("front", channel_gains={"channel_2": 0.25}),  # Full gain on channel 1 from the channel setting
+             effect("rear", channel="channel_2", channel_gains={"channel_2": 0.5}),
+             effect("missing", channel="channel_3"))  # A channel the device doesn't have
+    engine = synth.SynthEngine(64, num_channels=2, max_effects=4)
+    engine.configure(specs)
+    engine.amplitude[:3] = 0.4, 0.2, 0.8
+    output = render(engine, 2, 64)[64:]  # After the ramp up
+    assert np.allclose(output[:, 0], 0.4)
+    assert np.allclose(output[:, 1], 0.4 * 0.25 + 0.2 * 0.5)
+
+    engine.configure(specs[1:2])  # Gains follow the effect to its new row
+    engine.amplitude[:3] = 0.2, 0, 0
+    output = render(engine, 2, 64)[64:]
+    assert not output[:, 0].any()
+    assert np.allclose(output[:, 1], 0.2 * 0.5)